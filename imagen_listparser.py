@@ -0,0 +1,113 @@
+#################################################################################
+#!/usr/bin/env python
+# coding: utf-8
+""" IMAGEN run.csv list columns: bracketed number lists to ragged arrays """
+# Author: JiHoon Kim, <jihoon.kim@fu-berlin.de>, 15th November 2021
+#
+import warnings
+import numpy as np
+
+# Brackets to blanks, the numbers stay separated by the commas
+BRACKETS = str.maketrans('[]', '  ')
+# Characters of the float numbers: point, exponent, nan and inf
+FLOAT = '.eEnNiI'
+# Text of the missing cells: blank, NaN, None and pandas.NA
+MISSING = ('', 'nan', 'NaN', 'None', '<NA>')
+
+def parse_LIST(SERIES, missing='raise'):
+    """ Parse the list strings of a column to one ragged array, no eval
+
+    Parameters
+    ----------
+    SERIES : pandas.series
+        one list string per row, numbers '[0, 1, 1]' or rows of numbers
+        '[[0.2, 0.8], [0.9, 0.1]]', e.g. test_lbls or test_probs
+    missing : string, optional
+        missing cell (NaN, None or blank): 'raise' a ValueError naming
+        the rows, or 'empty' to parse it as the empty list '[]'
+
+    Returns
+    -------
+    VALUES : numpy.ndarray
+        int64 or float64 values of all the rows, (n,) for the number
+        lists or (n, width) for the lists of rows
+    OFFSETS : numpy.ndarray
+        int64, the items of row i are VALUES[OFFSETS[i]:OFFSETS[i+1]]
+
+    Examples
+    --------
+    >>> from imagen_listparser import *
+    >>> VALUES, OFFSETS = parse_LIST(
+    ...     df['test_probs'])               # LIST COLUMN
+    >>> PROBS = split_LIST(VALUES[:,1], OFFSETS)
+
+    Notes
+    -----
+    The brackets are blanked and all the rows are parsed by one
+    numpy.fromstring call, the items per row are counted from the
+    commas and brackets. The values are int64 if no number of the
+    column is a float. Anything else than numbers raises ValueError
+    instead of being executed. A missing cell is never read as a NaN
+    item, a 'nan' inside the brackets is a float NaN item.
+
+    """
+    if missing not in ['raise', 'empty']:
+        raise ValueError(f"missing should be 'raise' or 'empty', not {missing!r}")
+    TEXT = [str(i) for i in SERIES]
+    EMPTY = [k for k, i in enumerate(TEXT) if i.strip() in MISSING]
+    if EMPTY and missing == 'raise':
+        INDEX = list(getattr(SERIES, 'index', range(len(TEXT))))
+        raise ValueError(f"missing list in rows {[INDEX[k] for k in EMPTY]}")
+    for k in EMPTY:
+        TEXT[k] = '[]'
+    CLEAN = [i.translate(BRACKETS) for i in TEXT]
+    COUNT = np.array([i.count(',') + 1 if i.strip() else 0 for i in CLEAN],
+                     dtype=np.int64)
+    BODY = ','.join(i for i in CLEAN if i.strip())
+    # Integer lists stay int64 as with eval, e.g. IDs and labels
+    DTYPE = np.float64 if any(i in BODY for i in FLOAT) else np.int64
+    # numpy only warns on text it cannot read to the end, e.g. quotes
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            VALUES = np.fromstring(BODY, dtype=DTYPE, sep=',') if BODY \
+                else np.empty(0, dtype=DTYPE)
+        except DeprecationWarning:
+            VALUES = None
+    if (VALUES is None) or (len(VALUES) != COUNT.sum()):
+        raise ValueError("not a bracketed list of numbers")
+    # Lists of rows: the items are the inner lists
+    ITEMS = np.array([i.count('[') - 1 for i in TEXT], dtype=np.int64)
+    if (ITEMS > 0).any():
+        WIDTH = np.unique(COUNT[ITEMS > 0] // ITEMS[ITEMS > 0])
+        if (len(WIDTH) != 1) or (COUNT != ITEMS * WIDTH[0]).any():
+            raise ValueError("the inner lists have different lengths")
+        VALUES = VALUES.reshape(-1, WIDTH[0])
+        COUNT = ITEMS
+    OFFSETS = np.zeros(len(COUNT) + 1, dtype=np.int64)
+    np.cumsum(COUNT, out=OFFSETS[1:])
+    return VALUES, OFFSETS
+
+def split_LIST(VALUES, OFFSETS):
+    """ Split the ragged array back to one array per row
+
+    Parameters
+    ----------
+    VALUES : numpy.ndarray
+        values of all the rows, see parse_LIST
+    OFFSETS : numpy.ndarray
+        row offsets, see parse_LIST
+
+    Returns
+    -------
+    LIST : list
+        numpy.ndarray views of VALUES, one per row
+
+    Examples
+    --------
+    >>> from imagen_listparser import *
+    >>> LBLS = split_LIST(
+    ...     *parse_LIST(df['test_lbls']))   # LIST COLUMN
+
+    """
+    return np.split(VALUES, OFFSETS[1:-1])
@@ -5,252 +5,1923 @@
 # Author: JiHoon Kim, <jihoon.kim@fu-berlin.de>, 15th November 2021
 #
 import os
+import json
+import shutil
+import atexit
+import threading
 import h5py
 import shap
 import pickle
 import pandas as pd
 import numpy as np
 from glob import glob
+from collections import OrderedDict
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from joblib import load
 from sklearn.preprocessing import StandardScaler
+from imagen_subjectkey import to_ID, to_SESSION, exclude, sort_KEY, set_KEY
+from imagen_listparser import parse_LIST
 import warnings
 warnings.filterwarnings('ignore')
 
+# ----------------------------------------------------- #
+# Code-book: value to label maps of the instruments     #
+# ----------------------------------------------------- #
+MISSING = {-1: 'not known', -2: 'not available'}
+
+CODES = {
+    # PBQ
+    'test' : {0: 'No', 1: 'Yes', **MISSING},
+    'day' : {2: 'yes, every day', 1: 'yes, on occasion',
+             0: 'no, not at all', **MISSING},
+    'age' : {**MISSING},
+    'cigarettes' : {1: 'Less than 1 cigarette per week',
+                    2: 'Less than 1 cigarette per day',
+                    3: '1-5 cigarettes per day',
+                    8: '6-10 cigarettes per day',
+                    15: '11-20 cigarettes per day',
+                    25: '21-30 cigarettes per day',
+                    30: 'More than 30 cigarettes per day', **MISSING},
+    'alcohol' : {1: 'Monthly or less', 2: 'Two to four times a month',
+                 3: 'Two to three times a week',
+                 4: 'Four or more times a week', **MISSING},
+    'drinks' : {0: '1 or 2', 1: '3 or 4', 2: '5 or 6', 3: '7 to 9',
+                4: '10 or more', **MISSING},
+    'stage' : {1: 'first trimester', 2: 'second trimester',
+               3: 'third trimester', 12: 'first and second',
+               23: 'second and third', 13: 'first and third',
+               4: 'whole pregnancy', **MISSING},
+    # GEN
+    'disorder' : {'ALC': 'Alcohol problems',
+                  'DRUG': 'Drug problems',
+                  'SCZ': 'Schizophrenia',
+                  'SCZAD': 'Schizoaffective Disorder',
+                  'DPR_R': 'Major Depression recurrent',
+                  'DPR_SE': 'Major Depression single episode',
+                  'BIP_I': 'Bipolar I Disorder',
+                  'BIP_II': 'Bipolar II Disorder',
+                  'OCD': 'Obessive-compulsive Disroder',
+                  'ANX': 'Anxiety Disorder',
+                  'EAT': 'Eating Disorder',
+                  'SUIC': 'Suicide / Suicidal Attempt',
+                  'OTHER': 'Other'},
+}
+# Codes which keep the values not listed in the code-book (e.g. age)
+KEEP = {'age'}
+
+# Score ranges: (bin edges, labels, label of the values out of the bins)
+BINS = {
+    # MAST
+    'flag' : ([-np.inf, 4, np.inf],
+              ['negative alchololism screening',
+               'positive alchololism screening'],
+              'negative alchololism screening'),
+    # FTND
+    'dependence' : ([-np.inf, 3, 6, 10],
+                    ['less dependent', 'moderately dependent',
+                     'highly dependent'],
+                    np.NaN),
+}
+
+# Raw column to code per instrument
+CODEBOOK = {
+    'PBQ' : {'pbq_03': 'test', 'pbq_03a': 'day', 'pbq_03b': 'age',
+             'pbq_03c': 'cigarettes', 'pbq_05': 'test',
+             'pbq_05a': 'cigarettes', 'pbq_05b': 'cigarettes',
+             'pbq_05c': 'cigarettes', 'pbq_06': 'test',
+             'pbq_06a': 'cigarettes', 'pbq_12': 'test', 'pbq_13': 'test',
+             'pbq_13a': 'alcohol', 'pbq_13b': 'drinks', 'pbq_13g': 'stage'},
+    'GEN' : {**{f'Disorder_PF_{i}': 'disorder' for i in range(1, 5)},
+             **{f'Disorder_PM_{i}': 'disorder' for i in range(1, 7)}},
+    'MAST' : {'mast_sum': 'flag'},
+    'FTND' : {'ftnd_sum': 'dependence'},
+}
+
+# Decoded column of the instrument files to its code, restored when a saved
+# file is loaded (csv keeps neither the categoricals nor the numbers)
+DECODED = {
+    'PBQ' : CODEBOOK['PBQ'],
+    'MAST' : {'MAST flag': 'flag'},
+    'FTND' : {'Likelihood of nicotine dependence child': 'dependence'},
+}
+
+# Version of the decoding and scoring rules, recorded in the manifests:
+# increase it when a code-book, schema or scoring change alters the output
+CODEBOOK_VERSION = 3
+
+def decode(SERIES, CODE):
+    """ Decode the raw values of one column with the code-book
+
+    Parameters
+    ----------
+    SERIES : pandas.series
+        raw values of the instrument column
+    CODE : string
+        code name in CODES or BINS
+
+    Returns
+    -------
+    LABEL : pandas.Categorical or numpy.ndarray
+        decoded labels, np.NaN if the value is not in the code-book.
+        Categorical with the labels of the code-book, in code-book order,
+        as categories; object array for the codes in KEEP (e.g. age)
+
+    Examples
+    --------
+    >>> from imagen_posthocloader import *
+    >>> LABEL = decode(
+    ...     DF['pbq_03'],                   # SERIES
+    ...     'test')                         # CODE
+
+    Notes
+    -----
+    One lookup per column: the values are matched against the code-book
+    keys at once and the labels are taken by the matched position.
+
+    """
+    if CODE in BINS:
+        EDGES, LABELS, DEFAULT = BINS[CODE]
+        LABEL = pd.cut(SERIES, EDGES, labels=LABELS).values
+        if not pd.isnull(DEFAULT):
+            LABEL = LABEL.fillna(DEFAULT)
+        return LABEL
+    MAP = CODES[CODE]
+    KEYS = pd.Index(list(MAP.keys()))
+    IDX = KEYS.get_indexer(SERIES)
+    if CODE in KEEP:
+        # the last label is taken by the values out of the code-book
+        LABELS = np.array(list(MAP.values()) + [np.NaN], dtype=object)
+        LABEL = LABELS[IDX]
+        LABEL[IDX == -1] = np.asarray(SERIES, dtype=object)[IDX == -1]
+        return LABEL
+    return pd.Categorical.from_codes(IDX, categories=list(MAP.values()))
+
+def compact(DF, EXCEPT=('ID',)):
+    """ Downcast the float64 columns to float32 where it is lossless
+
+    Parameters
+    ----------
+    DF : pandas.dataframe
+        instrument dataframe
+    EXCEPT : tuple, optional
+        columns kept as they are
+
+    Returns
+    -------
+    DF : pandas.dataframe
+        float32 columns where every value is exactly representable,
+        e.g. sums of item scores; means are kept in float64
+
+    Examples
+    --------
+    >>> from imagen_posthocloader import *
+    >>> DF = compact(
+    ...     DF)                             # DATAFRAME
+
+    """
+    for COL in DF.columns[DF.dtypes == np.float64]:
+        if COL in EXCEPT:
+            continue
+        X = DF[COL].to_numpy()
+        X32 = X.astype(np.float32)
+        if np.array_equal(X32.astype(np.float64), X, equal_nan=True):
+            DF[COL] = X32
+    return DF
+
+def restore(DF, DATA):
+    """ Restore the dtypes of a saved instrument file, as it is built
+
+    Parameters
+    ----------
+    DF : pandas.dataframe
+        instrument in all session, read from the saved file
+    DATA : string
+        instrument name
+
+    Returns
+    -------
+    DF : pandas.dataframe
+        ordered categorical Session, the DECODED columns as categoricals
+        in the code-book order (numbers and labels for the codes in KEEP)
+        and the float32 scores where it is lossless
+
+    Examples
+    --------
+    >>> from imagen_posthocloader import *
+    >>> DF = restore(
+    ...     read_TABLE('posthoc/all_PBQ.csv'),  # SAVED INSTRUMENT
+    ...     'PBQ')                          # INSTRUMENT
+
+    """
+    DF['Session'] = to_SESSION(DF['Session'])
+    for COL, CODE in DECODED.get(DATA, {}).items():
+        if CODE in KEEP:
+            # the numbers are read as strings from csv
+            NUM = pd.to_numeric(DF[COL], errors='coerce')
+            DF[COL] = DF[COL].astype(object).where(NUM.isna(), NUM)
+        else:
+            # the bins are ordered, as pandas.cut
+            LABELS = BINS[CODE][1] if CODE in BINS else list(CODES[CODE].values())
+            DF[COL] = pd.Categorical(DF[COL], categories=LABELS,
+                                     ordered=CODE in BINS)
+    return compact(DF)
+
+def indicate(DF, COLS, CODE):
+    """ Aggregate the coded columns as a boolean subject x code matrix
+
+    Parameters
+    ----------
+    DF : pandas.dataframe
+        coded columns, e.g. Disorder_PF_1, ..., Disorder_PF_4
+    COLS : list
+        columns answering the same question
+    CODE : string
+        code name in CODES, the matrix columns are its keys
+
+    Returns
+    -------
+    IND : numpy.ndarray
+        boolean matrix, True if any of the columns has the code
+
+    Examples
+    --------
+    >>> from imagen_posthocloader import *
+    >>> IND = indicate(
+    ...     DF,                             # DATAFRAME
+    ...     ['Disorder_PF_1','Disorder_PF_2'], # COLUMNS
+    ...     'disorder')                     # CODE
+
+    """
+    KEYS = pd.Index(list(CODES[CODE]))
+    IDX = np.stack([KEYS.get_indexer(DF[COL]) for COL in COLS], axis=1)
+    # the last column is taken by the values out of the code-book
+    IND = np.zeros((len(DF), len(KEYS)+1), dtype=bool)
+    IND[np.arange(len(DF))[:, None], IDX] = True
+    return IND[:, :-1]
+
+def join_DISORDER(DF):
+    """ Derive the joined string and list views of the GEN disorders
+
+    Parameters
+    ----------
+    DF : pandas.dataframe
+        GEN with the Paternal_{code} and Maternal_{code} indicators
+
+    Returns
+    -------
+    DF : pandas.dataframe
+        GEN with Paternal_disorder, Maternal_disorder, Pd_list and Md_list
+
+    Examples
+    --------
+    >>> from imagen_posthocloader import *
+    >>> GEN = join_DISORDER(
+    ...     posthoc.get_INSTRUMENT('all_GEN.csv'))  # GEN
+    >>> GEN.query('Paternal_disorder.str.contains("Alcohol")', engine='python')
+
+    Notes
+    -----
+    The disorders are listed in the code-book order, each distinct row
+    of the indicator matrix is joined once. A disorder answered in two
+    columns of a parent (e.g. Disorder_PF_1 and Disorder_PF_3 both ALC)
+    is one indicator, it is listed once; the codes out of the code-book
+    are not listed.
+
+    """
+    DF = DF.copy()
+    LABELS = np.array(list(CODES['disorder'].values()), dtype=object)
+    for PARENT, LIST in [('Paternal', 'Pd_list'), ('Maternal', 'Md_list')]:
+        IND = DF[[f'{PARENT}_{i}' for i in CODES['disorder']]].to_numpy(dtype=bool)
+        PATTERN, INVERSE = np.unique(IND, axis=0, return_inverse=True)
+        VIEW = [list(LABELS[i]) for i in PATTERN]
+        DF[f'{PARENT}_disorder'] = np.array(
+            [','.join(i) for i in VIEW], dtype=object)[INVERSE.ravel()]
+        DF[LIST] = [list(VIEW[i]) for i in INVERSE.ravel()]
+    return DF
+
+# ----------------------------------------------------- #
+# Raw psytools files: (session, session folder, file)   #
+# ----------------------------------------------------- #
+# Not implemented yet: BMI, DAWBA, CANTAB, KIRBY, BIS, CSI, PHQ, CES, ANXDX,
+# CAPE, SDQ, IRI, RRS, PALP, CTQ, MINI5, DAST, SCID, DMQ, BULLY, ESPAD,
+# TLFB, AUDIT
+PSYTOOLS = {
+    # Demographic profile
+    'PBQ' : [
+        ('FU1','FU1','IMAGEN-IMGN_PBQ_FU_RC1-BASIC_DIGEST.csv'),
+        ('BL', 'BL', 'IMAGEN-IMGN_PBQ_RC1-BASIC_DIGEST.csv')
+    ],
+    'GEN' : [
+        ('FU3','BL','IMAGEN-IMGN_GEN_RC5-BASIC_DIGEST.csv'),
+        ('FU2','BL','IMAGEN-IMGN_GEN_RC5-BASIC_DIGEST.csv'),
+        ('FU1','BL','IMAGEN-IMGN_GEN_RC5-BASIC_DIGEST.csv'),
+        ('BL', 'BL','IMAGEN-IMGN_GEN_RC5-BASIC_DIGEST.csv')
+    ],
+    'LEQ' : [
+        ('FU3','FU3','IMAGEN-IMGN_LEQ_FU3.csv'),
+        ('FU2','FU2','IMAGEN-IMGN_LEQ_FU2-IMAGEN_DIGEST.csv'),
+        ('FU1','FU1','IMAGEN-IMGN_LEQ_FU_RC5-IMAGEN_DIGEST.csv'),
+        ('BL', 'BL', 'IMAGEN-IMGN_LEQ_RC5-BASIC_DIGEST.csv')
+    ],
+    # Psychological profile
+    'NEO' : [
+        ('FU3','FU3','IMAGEN-IMGN_NEO_FFI_FU3.csv'),
+        ('FU2','FU2','IMAGEN-IMGN_NEO_FFI_FU2-IMAGEN_SURVEY_DIGEST.csv'),
+        ('FU1','FU1','IMAGEN-IMGN_NEO_FFI_CHILD_FU_RC5-IMAGEN_SURVEY_DIGEST.csv'),
+        ('BL', 'BL', 'IMAGEN-IMGN_NEO_FFI_CHILD_RC5-IMAGEN_SURVEY_DIGEST.csv')
+    ],
+    'SURPS' : [
+        ('FU3','FU3','IMAGEN-IMGN_SURPS_FU3.csv'),
+        ('FU2','FU2','IMAGEN-IMGN_SURPS_FU2-IMAGEN_SURVEY_DIGEST.csv'),
+        ('FU1','FU1','IMAGEN-IMGN_SURPS_FU_RC5-IMAGEN_SURVEY_DIGEST.csv'),
+        ('BL', 'BL', 'IMAGEN-IMGN_SURPS_RC5-IMAGEN_SURVEY_DIGEST.csv')
+    ],
+    'TCI' : [
+        ('FU3','FU3','IMAGEN-IMGN_TCI_FU3.csv'),
+        ('FU2','FU2','IMAGEN-IMGN_TCI_CHILD_FU2-IMAGEN_DIGEST.csv'),
+        ('FU1','FU1','IMAGEN-IMGN_TCI_CHILD_FU_RC5-IMAGEN_DIGEST.csv'),
+        ('BL', 'BL', 'IMAGEN-IMGN_TCI_CHILD_RC5-IMAGEN_DIGEST.csv')
+    ],
+    'BSI' : [
+        ('FU3','FU3','IMAGEN-IMGN_BSI_FU3.csv'),
+        ('FU2','FU3','IMAGEN-IMGN_BSI_FU3.csv'),
+        ('FU1','FU3','IMAGEN-IMGN_BSI_FU3.csv'),
+        ('BL', 'FU3','IMAGEN-IMGN_BSI_FU3.csv')
+    ],
+    # Social profile
+    'CTQ_MD' : [
+        ('FU3','FU2','IMAGEN-IMGN_CTQ_CHILD_FU2-IMAGEN_DIGEST.csv'),
+        ('FU2','FU2','IMAGEN-IMGN_CTQ_CHILD_FU2-IMAGEN_DIGEST.csv'),
+        ('FU1','FU2','IMAGEN-IMGN_CTQ_CHILD_FU2-IMAGEN_DIGEST.csv'),
+        ('BL', 'FU2','IMAGEN-IMGN_CTQ_CHILD_FU2-IMAGEN_DIGEST.csv')
+    ],
+    'CTS' : [
+        ('FU3','BL','IMAGEN-IMGN_CTS_PARENT_RC5-BASIC_DIGEST.csv'),
+        ('FU2','BL','IMAGEN-IMGN_CTS_PARENT_RC5-BASIC_DIGEST.csv'),
+        ('FU1','BL','IMAGEN-IMGN_CTS_PARENT_RC5-BASIC_DIGEST.csv'),
+        ('BL', 'BL','IMAGEN-IMGN_CTS_PARENT_RC5-BASIC_DIGEST.csv')
+    ],
+    'PANAS' : [
+        ('FU3','FU3','IMAGEN-IMGN_PANAS_FU3.csv'),
+        ('FU2','FU3','IMAGEN-IMGN_PANAS_FU3.csv'),
+        ('FU1','FU3','IMAGEN-IMGN_PANAS_FU3.csv'),
+        ('BL', 'FU3','IMAGEN-IMGN_PANAS_FU3.csv')
+    ],
+    # Substance use profile
+    'MAST' : [
+        ('FU3','FU3','IMAGEN-IMGN_MAST_FU3.csv'),
+        ('FU2','FU2','IMAGEN-IMGN_MAST_CHILD_FU2-IMAGEN_DIGEST.csv'),
+        ('FU1','FU1','IMAGEN-IMGN_MAST_PARENT_FU_RC5-BASIC_DIGEST.csv'),
+        ('BL', 'BL', 'IMAGEN-IMGN_MAST_PARENT_RC5-BASIC_DIGEST.csv')
+    ],
+    'FTND' : [
+        ('FU3','FU3','IMAGEN-IMGN_ESPAD_FU3.csv'),
+        ('FU2','FU2','IMAGEN-IMGN_ESPAD_CHILD_FU2-IMAGEN_DIGEST.csv'),
+        ('FU1','FU1','IMAGEN-IMGN_ESPAD_CHILD_FU_RC5-IMAGEN_DIGEST.csv'),
+        ('BL', 'BL', 'IMAGEN-IMGN_ESPAD_CHILD_RC5-IMAGEN_DIGEST.csv')
+    ],
+}
+
+# ----------------------------------------------------- #
+# h5 label files: (session, dataset, file) per label    #
+# ----------------------------------------------------- #
+# There are no session in FU2 for imaging file
+H5FILES = {
+    'Binge' : [
+        ('FU3','Training','newlbls-clean-fu3-espad-fu3-19a-binge-n650.h5'),
+        ('FU3','Holdout', 'newholdout-clean-fu3-espad-fu3-19a-binge-n102.h5'),
+        ('FU2','Training','newlbls-clean-fu2-espad-fu3-19a-binge-n634.h5'),
+        ('FU2','Holdout', 'newholdout-clean-fu2-espad-fu3-19a-binge-n102.h5'),
+        ('BL', 'Training','newlbls-clean-bl-espad-fu3-19a-binge-n620.h5'),
+        ('BL', 'Holdout', 'newholdout-clean-bl-espad-fu3-19a-binge-n102.h5')
+    ],
+}
+
+# Class name per label value (the value is the position)
+CLASSES = {
+    'Binge' : ['HC', 'AAM'],
+}
+
+# Sex and site names per code of the h5 files
+SEX = ['Male', 'Female']
+SITE = ['Paris', 'Nottingham', 'Mannheim', 'London', 'Hamburg', 'Dublin',
+        'Dresden', 'Berlin']
+
+def categorize(CODE, NAMES, WHAT):
+    """ Map the codes of an h5 dataset to the names by position
+
+    Parameters
+    ----------
+    CODE : numpy.ndarray
+        integer codes, e.g. site or label values
+    NAMES : list
+        name per code, the code is the position
+    WHAT : string
+        dataset name, for the error message
+
+    Returns
+    -------
+    NAME : pandas.Categorical
+        the names as categorical, NAMES the categories
+
+    Raises
+    ------
+    ValueError
+        if a code is missing or not a position of NAMES
+
+    Examples
+    --------
+    >>> from imagen_posthocloader import *
+    >>> CLASS = categorize(
+    ...     d['Binge'][()],                 # LABEL
+    ...     CLASSES['Binge'],               # NAMES
+    ...     'Binge')                        # DATASET
+
+    """
+    CODE = np.asarray(CODE, dtype=np.float64)
+    BAD = ~np.isin(CODE, np.arange(len(NAMES)))
+    if BAD.any():
+        raise ValueError(f"{WHAT} values {np.unique(CODE[BAD])} are not codes "
+                         f"of {NAMES} (0 to {len(NAMES) - 1})")
+    return pd.Categorical.from_codes(CODE.astype(np.int8), NAMES)
+
+# ----------------------------------------------------- #
+# Raw columns and dtypes read per instrument            #
+# ----------------------------------------------------- #
+# 'User code' is always read and its dtype is inferred.
+# Codes and item scores are small integers with missing values: float32.
+# Digest scores (subscale means) keep float64 to write the same values.
+SCHEMA = {
+    # Demographic profile
+    'PBQ' : {COL: 'float32' for COL in CODEBOOK['PBQ']},
+    'GEN' : {COL: 'category' for COL in CODEBOOK['GEN']},
+    'LEQ' : {f'{i}_{j}': 'float64'
+             for j in ['valence', 'ever_meanfreq']
+             for i in ['family', 'accident', 'sexuality', 'autonomy',
+                       'devience', 'relocation', 'distress', 'noscale',
+                       'overall']},
+    # Psychological profile
+    'NEO' : {COL: 'float64' for COL in ['open_mean', 'cons_mean', 'extr_mean',
+                                        'agre_mean', 'neur_mean']},
+    'SURPS' : {COL: 'float64' for COL in ['as_mean', 'h_mean', 'imp_mean',
+                                          'ss_mean']},
+    'TCI' : {COL: 'float64' for COL in ['tci_excit', 'tci_imp', 'tci_extra',
+                                        'tci_diso', 'tci_novseek']},
+    # 'R' (refused) is coded in the BSI items
+    'BSI' : {f'BSI_{i:02d}': 'category'
+             for i in range(1, 54) if i not in [11, 25, 39, 52]},
+    # Social profile
+    'CTQ_MD' : {f'CTQ_{i}': 'float32' for i in range(1, 29)},
+    'CTS' : {COL: 'float64' for COL in ['cts_assault', 'cts_injury',
+                                        'cts_negotiation',
+                                        'cts_psychological_aggression',
+                                        'cts_sexual_coercion']},
+    'PANAS' : {f'PANAS_{i:02d}': 'float32' for i in range(1, 21)},
+    # Substance use profile
+    'MAST' : {COL: 'float32' for COL in ['mast_total', 'mast_dsm', 'mast_sum']},
+    'FTND' : {'ftnd_sum': 'float32'},
+}
+
+# ----------------------------------------------------- #
+# Scoring: subscales as item sums or means              #
+# ----------------------------------------------------- #
+# Scale name to (items, 'sum' or 'mean') per instrument
+# NEO, SURPS, TCI, CTS, LEQ and MAST use the scores of the digest files
+BSI_SCALES = {
+    'Somatization mean' : ['BSI_02','BSI_07','BSI_23','BSI_29','BSI_30',
+                           'BSI_33','BSI_37'],
+    'Obsession-Compulsion mean' : ['BSI_05','BSI_15','BSI_26','BSI_27',
+                                   'BSI_32','BSI_36'],
+    'Interpersonal Sensitivity mean' : ['BSI_20','BSI_21','BSI_22','BSI_42'],
+    'Depression mean' : ['BSI_09','BSI_16','BSI_17','BSI_18','BSI_35','BSI_50'],
+    'Anxiety mean' : ['BSI_01','BSI_12','BSI_19','BSI_38','BSI_45','BSI_49'],
+    'Hostility mean' : ['BSI_06','BSI_13','BSI_40','BSI_41','BSI_46'],
+    'Phobic Anxiety mean' : ['BSI_08','BSI_28','BSI_31','BSI_43','BSI_47'],
+    'Paranoid Ideation mean' : ['BSI_04','BSI_10','BSI_24','BSI_48','BSI_51'],
+    'Psychoticism mean' : ['BSI_03','BSI_14','BSI_34','BSI_44','BSI_53'],
+}
+BSI_ITEMS = [i for ITEMS in BSI_SCALES.values() for i in ITEMS]
+
+SCALES = {
+    'BSI' : {
+        **{k: (v, 'mean') for k, v in BSI_SCALES.items()},
+        'Positive Symptom Distress Index' : (BSI_ITEMS, 'sum'),
+        'Global Severity Index' : (BSI_ITEMS, 'mean'),
+    },
+    'CTQ_MD' : {
+        'ea_sum' : (['CTQ_3','CTQ_8','CTQ_14','CTQ_18','CTQ_25'], 'sum'),
+        'pa_sum' : (['CTQ_9','CTQ_11','CTQ_12','CTQ_15','CTQ_17'], 'sum'),
+        'sa_sum' : (['CTQ_20','CTQ_21','CTQ_23','CTQ_24','CTQ_27'], 'sum'),
+        'en_sum' : (['CTQ_5','CTQ_7','CTQ_13','CTQ_19','CTQ_28'], 'sum'),
+        'pn_sum' : (['CTQ_1','CTQ_2','CTQ_4','CTQ_6','CTQ_26'], 'sum'),
+        'dn_sum' : (['CTQ_10','CTQ_16','CTQ_22'], 'sum'),
+    },
+    'PANAS' : {
+        'Positive Affect Score' : (['PANAS_01','PANAS_03','PANAS_05',
+                                    'PANAS_09','PANAS_10','PANAS_12',
+                                    'PANAS_14','PANAS_16','PANAS_17',
+                                    'PANAS_19'], 'sum'),
+        'Negative Affect Score' : (['PANAS_02','PANAS_04','PANAS_06',
+                                    'PANAS_07','PANAS_08','PANAS_11',
+                                    'PANAS_13','PANAS_15','PANAS_18',
+                                    'PANAS_20'], 'sum'),
+    },
+}
+
+# Reverse-keyed items: item to (minimum + maximum) of its response scale,
+# the item is scored as (minimum + maximum) - value, e.g. {'CTQ_2': 6}
+REVERSE = {}
+
+def score(DF, DATA, MAX_MISSING=0):
+    """ Score all the subscales of the instrument in one matrix product
+
+    Parameters
+    ----------
+    DF : pandas.dataframe
+        numeric item columns of the instrument
+    DATA : string
+        instrument name, the subscales are SCALES[DATA]
+    MAX_MISSING : integer, optional
+        number of missing items allowed per subscale, the mean is taken
+        over the answered items and the sum is prorated to all the items
+
+    Returns
+    -------
+    SCORE : pandas.dataframe
+        subscale scores, same index as DF
+
+    Examples
+    --------
+    >>> from imagen_posthocloader import *
+    >>> SCORE = score(
+    ...     DF,                             # ITEMS
+    ...     'PANAS')                        # INSTRUMENT
+
+    Notes
+    -----
+    The items X and the answered flags A are one float32 block [X, A],
+    the subscales are one weight matrix [[W, 0], [R, |W|]] with W the 0/1
+    (-1 reverse-keyed) item weights and R the reverse-keyed offsets, so
+    the sums and the numbers of answered items are one matrix product.
+    Item scores are small integers, the float32 sums are exact and the
+    means are divided in float64. With MAX_MISSING=0 a subscale with a
+    missing item is missing, as sum(axis=1, skipna=False).
+
+    """
+    ITEMS = list(dict.fromkeys(i for COLS, _ in SCALES[DATA].values()
+                               for i in COLS))
+    POS = {j: i for i, j in enumerate(ITEMS)}
+    K = len(SCALES[DATA])
+    W = np.zeros((2*len(ITEMS), 2*K), dtype=np.float32)
+    for k, (COLS, _) in enumerate(SCALES[DATA].values()):
+        for i in COLS:
+            W[POS[i], k] = -1 if i in REVERSE else 1
+            W[len(ITEMS)+POS[i], k] = REVERSE.get(i, 0)
+            W[len(ITEMS)+POS[i], K+k] = 1
+    N = W[len(ITEMS):, K:].sum(axis=0, dtype=np.float64)
+
+    X = DF[ITEMS].to_numpy(dtype=np.float32)
+    NAN = np.isnan(X)
+    XA = np.hstack([np.where(NAN, 0, X), ~NAN]).astype(np.float32)
+    SA = (XA @ W).astype(np.float64)
+    SUM, ANSWERED = SA[:, :K], SA[:, K:]
+    IS_SUM = np.array([i == 'sum' for _, i in SCALES[DATA].values()])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        SCORE = np.where(IS_SUM, SUM * (N / ANSWERED), SUM / ANSWERED)
+    SCORE[ANSWERED < N - MAX_MISSING] = np.NaN
+    return pd.DataFrame(SCORE, index=DF.index, columns=list(SCALES[DATA]))
+
+# (ID, Session) rows excluded from the instruments in all session
+EXCLUDE = {
+    # Duplicate ID: 71766352, 58060181, 15765805, 12809392 in FU1
+    # Different ID: 12809392 in both BL and FU1
+    'PBQ' : [(71766352, 'FU1'), (58060181, 'FU1'), (15765805, 'FU1'),
+             (12809392, 'FU1'), (12809392, 'BL')],
+}
+
+# Column names of the instruments in all session
+RENAME = {
+    'LEQ' : {
+        # Mean valence of events
+        "family_valence"           : "Family valence",
+        "accident_valence"         : "Accident valence",
+        "sexuality_valence"        : "Sexuality valence",
+        "autonomy_valence"         : "Autonomy valence",
+        "devience_valence"         : "Devience valence",
+        "relocation_valence"       : "Relocation valence",
+        "distress_valence"         : "Distress valence",
+        "noscale_valence"          : "Noscale valence",
+        "overall_valence"          : "Overall valence",
+        # Mean frequency lifetime
+        "family_ever_meanfreq"     : "Family mean frequency",
+        "accident_ever_meanfreq"   : "Accident mean frequency",
+        "sexuality_ever_meanfreq"  : "Sexuality mean frequency",
+        "autonomy_ever_meanfreq"   : "Autonomy mean frequency",
+        "devience_ever_meanfreq"   : "Devience mean frequency",
+        "relocation_ever_meanfreq" : "Relocation mean frequency",
+        "distress_ever_meanfreq"   : "Distress mean frequency",
+        "noscale_ever_meanfreq"    : "Noscale mean frequency",
+        "overall_ever_meanfreq"    : "Overall mean frequency",
+    },
+    'NEO' : {
+        "neur_mean" : "Neuroticism mean",
+        "extr_mean" : "Extroversion mean",
+        "open_mean" : "Openness mean",
+        "agre_mean" : "Agreeableness mean",
+        "cons_mean" : "Conscientiousness mean",
+    },
+    'SURPS' : {
+        "as_mean" : "Anxiety Sensitivity mean",
+        "h_mean"  : "Hopelessness mean",
+        "imp_mean": "Impulsivity mean",
+        "ss_mean" : "Sensation seeking mean",
+    },
+    'TCI' : {
+        "tci_excit" : "Exploratory excitability vs. Stoic rigidity",
+        "tci_imp"  : "Impulsiveness vs. Reflection",
+        "tci_extra": "Extravagance vs. Reserve",
+        "tci_diso" : "Disorderliness vs. Regimentation",
+        "tci_novseek" : "Total Novelty Seeking score"
+    },
+    'CTQ_MD' : {
+        "ea_sum" : "Emotional abuse sum",
+        "pa_sum" : "Physical abuse sum",
+        "sa_sum" : "Sexual abuse sum",
+        "en_sum" : "Emotional neglect sum",
+        "pn_sum" : "Physical neglect sum",
+        "dn_sum" : "Denial sum",
+        "md1" : "MD 1",
+        "md2" : "MD 2",
+        "md3" : "MD 3"
+    },
+    'CTS' : {
+        "cts_assault"                  : "Assault mean",
+        "cts_injury"                   : "Injury mean",
+        "cts_negotiation"              : "Negotiation mean",
+        "cts_psychological_aggression" : "Psychological Aggression mean",
+        "cts_sexual_coercion"          : "Sexual Coercion mean"
+    },
+}
+
+# ----------------------------------------------------- #
+# ML run.csv: position of the run configuration columns #
+# ----------------------------------------------------- #
+# Repeated on every subject row of the run, in this order
+RUN = {
+    # Model configuration
+    "i" : 7, "o" : 8, "io" : 1, "technique" : 2, "Session" : 25,
+    "Trial" : 4, "path" : 24, "n_samples" : 5, "n_samples_cc" : 6,
+    "i_is_conf" : 9, "o_is_conf" : 10, "Model" : 3,
+    "model_SVM-rbf__C" : 18, "model_SVM-rbf__gamma" : 19, "runtime" : 20,
+    "model_SVM-lin__C" : 21, "model_GB__learning_rate" : 22,
+    "model_LR__C" : 23,
+    # Result
+    "train_score" : 11, "valid_score" : 12, "test_score" : 13,
+    "roc_auc" : 14, "holdout_score" : 26, "holdout_roc_auc" : 27,
+}
+
+# Subject rows per run: dataset name and (ids, lbls, probs) list columns
+RUN_SETS = [
+    ("Test set", 'test_ids', 'test_lbls', 'test_probs'),
+    ("Holdout set", 'holdout_ids', 'holdout_lbls', 'holdout_probs'),
+]
+
+# Outcome code per (prediction >= 0.5, true_label == 1), -1 not specified
+OUTCOME = ['TN', 'FN', 'FP', 'TP']
+
+# Categorical views of the outcome code: name per code TN, FN, FP, TP
+VIEWS = {
+    'Prob' : ['TN', 'FN', 'FP', 'TP'],
+    'Predict TF' : ['TP & TN', 'FP & FN', 'FP & FN', 'TP & TN'],
+    'Model PN' : ['TN & FN', 'TN & FN', 'TP & FP', 'TP & FP'],
+    'Label PN' : ['TN & FP', 'TP & FN', 'TN & FP', 'TP & FN'],
+}
+
+# Prediction of the rows with these outcome codes, NaN otherwise
+PROBS = {
+    'TP prob' : [3], 'TN prob' : [0], 'FP prob' : [2], 'FN prob' : [1],
+    'T prob' : [0, 3], 'F prob' : [1, 2],
+}
+
+def outcome(TRUE, PRED):
+    """ Code the prediction outcome of the subject rows
+
+    Parameters
+    ----------
+    TRUE : numpy.ndarray
+        true_label, 0 or 1
+    PRED : numpy.ndarray
+        prediction, probability of the label 1
+
+    Returns
+    -------
+    CODE : numpy.ndarray
+        int8, the position in OUTCOME (TN=0, FN=1, FP=2, TP=3), -1 if
+        the label is not 0 or 1 or the prediction is missing
+
+    Examples
+    --------
+    >>> from imagen_posthocloader import *
+    >>> DF2['Outcome'] = outcome(
+    ...     DF2['true_label'],              # LABEL
+    ...     DF2['prediction'])              # PREDICTION
+
+    """
+    TRUE = np.asarray(TRUE)
+    PRED = np.asarray(PRED, dtype=np.float64)
+    CODE = (2 * (PRED >= 0.5) + (TRUE == 1)).astype(np.int8)
+    CODE[~((TRUE == 0) | (TRUE == 1)) | np.isnan(PRED)] = -1
+    return CODE
+
+def derive(DF2, columns=None):
+    """ Add the outcome views of the Outcome code
+
+    Parameters
+    ----------
+    DF2 : pandas.dataframe
+        subject rows with the Outcome and prediction columns
+    columns : list, optional
+        VIEWS and PROBS names to add, None adds all of them
+
+    Returns
+    -------
+    DF2 : pandas.dataframe
+        new dataframe with the requested views, VIEWS as categoricals
+        and PROBS as the prediction of the matching rows; the input
+        dataframe is not modified
+
+    Examples
+    --------
+    >>> from imagen_posthocloader import *
+    >>> DF2 = derive(
+    ...     DF2,                            # SUBJECT ROWS
+    ...     ['Prob', 'T prob'])             # VIEWS
+
+    """
+    # Missing code, e.g. the rows without RUN of the posthoc dataset
+    CODE = DF2['Outcome'].fillna(-1).to_numpy(dtype=np.int8)
+    NEW = {}
+    for i in [*VIEWS, *PROBS] if columns is None else columns:
+        if i in VIEWS:
+            # Category per code, 'Not Specified' the last one for -1
+            NAMES = [*dict.fromkeys(VIEWS[i]), 'Not Specified']
+            LOOKUP = np.array([NAMES.index(j) for j in VIEWS[i]]
+                              + [len(NAMES) - 1], dtype=np.int8)
+            NEW[i] = pd.Categorical.from_codes(LOOKUP[CODE], NAMES)
+        else:
+            NEW[i] = DF2['prediction'].where(np.isin(CODE, PROBS[i]))
+    return DF2.assign(**NEW)
+
+def read_OUTCOME(path, columns=None):
+    """ Read the RUN table, the requested outcome views are derived
+
+    Parameters
+    ----------
+    path : string
+        RUN table file or partitioned dataset directory absolute path,
+        e.g. posthoc/all_RUN saved by build_RUNS
+    columns : list, optional
+        columns to read, the VIEWS and PROBS names not saved in the file
+        are derived from its Outcome and prediction columns
+
+    Returns
+    -------
+    DF : pandas.dataframe
+        the columns in the requested order
+
+    Examples
+    --------
+    >>> from imagen_posthocloader import *
+    >>> DF = read_OUTCOME(
+    ...     path,                           # RUN TABLE
+    ...     ['ID','Model','Prob','T prob']) # COLUMNS
+
+    """
+    # Partitioned dataset: the columns of its first part file
+    if os.path.isdir(path):
+        READ_TABLE = read_PARTITION
+        PARTS = sorted(glob(f"{path}/*=*/part.*"))
+        if not PARTS:
+            raise FileNotFoundError(f"no partition in {path}")
+    else:
+        READ_TABLE, PARTS = read_TABLE, [path]
+    if columns is None:
+        return READ_TABLE(path)
+    FILE = set(read_COLUMNS(PARTS[0]))
+    NEW = [i for i in columns
+           if ((i in VIEWS) or (i in PROBS)) and (i not in FILE)]
+    if not NEW:
+        return READ_TABLE(path, columns)
+    READ = [i for i in columns if i not in NEW]
+    DF = READ_TABLE(path, list(dict.fromkeys([*READ, 'Outcome', 'prediction'])))
+    return derive(DF, NEW)[list(columns)]
+
+# Prediction groups of the threshold sweep
+SWEEP = ['Session', 'Model', 'Trial', 'dataset']
+
+def sweep(DF, KEY=SWEEP):
+    """ Confusion matrix, ROC and PR curves at every threshold per group
+
+    Parameters
+    ----------
+    DF : pandas.dataframe
+        subject rows with the true_label, prediction and KEY columns
+    KEY : list, optional
+        group columns, one curve per group
+
+    Returns
+    -------
+    CURVE : pandas.dataframe
+        KEY, threshold, TP, FP, FN, TN, TPR, FPR, precision, ACC, F1 and
+        Youden per distinct prediction of the group, in decreasing order;
+        the rows predicted 1 are prediction >= threshold
+    SCORE : pandas.dataframe
+        KEY, n, P, N, roc_auc and average_precision per group
+
+    Examples
+    --------
+    >>> from imagen_posthocloader import *
+    >>> CURVE, SCORE = sweep(
+    ...     DF,                             # RUN
+    ...     ['Session', 'Model'])           # GROUPS
+    >>> BEST = best_threshold(CURVE, ['Session', 'Model'], 'F1')
+
+    Notes
+    -----
+    The rows of all the groups are sorted once by (group, -prediction),
+    the counts are cumulative sums restarted at each group and the
+    areas are summed per group with numpy.bincount. The rows whose
+    label is not 0 or 1 or whose prediction is missing are dropped.
+    roc_auc and average_precision are the trapezoidal ROC area and the
+    step PR area, as sklearn roc_auc_score and average_precision_score.
+
+    """
+    KEY = list(KEY)
+    DF = DF[DF['true_label'].isin([0, 1]) & DF['prediction'].notna()]
+    DF = DF.dropna(subset=KEY)
+    GROUP = DF.groupby(KEY, sort=True, observed=True)
+    KEYS = GROUP.size().reset_index(name='n')
+    G = GROUP.ngroup().to_numpy()
+    Y = DF['true_label'].to_numpy() == 1
+    S = DF['prediction'].to_numpy(dtype=np.float64)
+    ORDER = np.lexsort((-S, G))
+    G, Y, S = G[ORDER], Y[ORDER], S[ORDER]
+
+    # Cumulative counts, restarted at the first row of each group
+    P = np.bincount(G, weights=Y, minlength=len(KEYS))
+    N = KEYS['n'].to_numpy() - P
+    FIRST = np.searchsorted(G, G, side='left')
+    TP = np.cumsum(Y)
+    FP = np.cumsum(~Y)
+    TP = TP - np.where(FIRST > 0, TP[FIRST - 1], 0)
+    FP = FP - np.where(FIRST > 0, FP[FIRST - 1], 0)
+    # One point per distinct prediction: the last row of the ties
+    LAST = np.r_[(G[1:] != G[:-1]) | (S[1:] != S[:-1]), True]
+    G, S, TP, FP = G[LAST], S[LAST], TP[LAST], FP[LAST]
+    FN = P[G] - TP
+    TN = N[G] - FP
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        TPR = TP / P[G]
+        FPR = FP / N[G]
+        PRECISION = TP / (TP + FP)
+        CURVE = KEYS[KEY].iloc[G].reset_index(drop=True)
+        CURVE = CURVE.assign(
+            threshold = S, TP = TP.astype(np.int64), FP = FP.astype(np.int64),
+            FN = FN.astype(np.int64), TN = TN.astype(np.int64),
+            TPR = TPR, FPR = FPR, precision = PRECISION,
+            ACC = (TP + TN) / (P[G] + N[G]),
+            F1 = 2 * TP / (2 * TP + FP + FN),
+            Youden = TPR - FPR)
+
+    # Areas: the previous point of the group, (0, 0) before the first one
+    NEW = np.r_[True, G[1:] != G[:-1]]
+    TPR_0 = np.where(NEW, 0, np.r_[0, TPR[:-1]])
+    FPR_0 = np.where(NEW, 0, np.r_[0, FPR[:-1]])
+    SCORE = KEYS.assign(
+        P = P.astype(np.int64), N = N.astype(np.int64),
+        roc_auc = np.bincount(G, weights=(FPR - FPR_0) * (TPR + TPR_0) / 2,
+                              minlength=len(KEYS)),
+        average_precision = np.bincount(G, weights=(TPR - TPR_0) * PRECISION,
+                                        minlength=len(KEYS)))
+    # Undefined with one class only
+    SCORE.loc[(SCORE['P'] == 0) | (SCORE['N'] == 0), 'roc_auc'] = np.NaN
+    SCORE.loc[SCORE['P'] == 0, 'average_precision'] = np.NaN
+    return CURVE, SCORE
+
+def best_threshold(CURVE, KEY=SWEEP, metric='Youden'):
+    """ Select the threshold maximizing the metric per group
+
+    Parameters
+    ----------
+    CURVE : pandas.dataframe
+        threshold sweep, see sweep
+    KEY : list, optional
+        group columns of the sweep
+    metric : string, optional
+        CURVE column to maximize: Youden, F1, ACC, ...
+
+    Returns
+    -------
+    BEST : pandas.dataframe
+        the CURVE row of the best threshold per group
+
+    Examples
+    --------
+    >>> from imagen_posthocloader import *
+    >>> BEST = best_threshold(
+    ...     CURVE,                          # SWEEP
+    ...     metric = 'F1')                  # METRIC
+
+    """
+    ROW = CURVE.groupby(list(KEY), observed=True)[metric].idxmax()
+    return CURVE.loc[ROW.dropna().to_numpy()].reset_index(drop=True)
+
+def join_RUN(RUNS, PRED, columns=None):
+    """ Join the run configuration back to the subject predictions
+
+    Parameters
+    ----------
+    RUNS : pandas.dataframe
+        run table keyed by run_id, or by (experiment, run_id) for
+        several experiments, see RUN_loader.set_RUN and build_RUNS
+    PRED : pandas.dataframe
+        subject prediction table with the same key columns
+    columns : list, optional
+        run columns to join, None joins all the columns
+
+    Returns
+    -------
+    DF2 : pandas.dataframe
+        wide RUN dataframe, the run columns repeated on every subject row,
+        the Outcome code and its VIEWS categoricals
+
+    Examples
+    --------
+    >>> from imagen_posthocloader import *
+    >>> DF2 = join_RUN(
+    ...     RUNS,                           # RUN TABLE
+    ...     PRED,                           # PREDICTION TABLE
+    ...     ['Session', 'Model'])           # RUN COLUMNS
+
+    """
+    # Key of the runs: run_id, within the experiment if both are tagged
+    KEY = [i for i in ['experiment', 'run_id'] if (i in RUNS) and (i in PRED)]
+    RUNS = RUNS.set_index(KEY)
+    if columns is not None:
+        RUNS = RUNS[[i for i in columns if i not in KEY]]
+    CONF = RUNS.reindex(pd.MultiIndex.from_frame(PRED[KEY]) if len(KEY) > 1
+                        else PRED['run_id'].to_numpy()).reset_index(drop=True)
+    # The key columns once, first, except the run_id
+    DF2 = pd.concat([PRED[KEY[:-1]].reset_index(drop=True), CONF,
+                     PRED.drop(columns=KEY).reset_index(drop=True)], axis=1)
+    if 'Outcome' not in DF2:
+        DF2['Outcome'] = outcome(DF2['true_label'], DF2['prediction'])
+    return derive(DF2, list(VIEWS))
+
+# ----------------------------------------------------- #
+# Raw psytools cache: each file is parsed once          #
+# ----------------------------------------------------- #
+# (path, size, mtime) to the parsed columns of the file, least recently
+# used first; RAW_SIZE files are kept per process
+RAW = OrderedDict()
+RAW_SIZE = 16
+
+def read_PSYTOOLS(path, DATA):
+    """ Read the raw columns of the instrument once per process
+
+    Parameters
+    ----------
+    path : string
+        raw psytools file absolute path
+    DATA : string
+        instrument name, the columns and dtypes are SCHEMA[DATA]
+
+    Returns
+    -------
+    DF : pandas.dataframe
+        copy of the cached raw columns of the instrument
+
+    Examples
+    --------
+    >>> from imagen_posthocloader import *
+    >>> DF = read_PSYTOOLS(
+    ...     path,                           # PSYTOOLS FILE
+    ...     'FTND')                         # INSTRUMENT
+
+    Notes
+    -----
+    The cache key is the path, size and modification time of the file,
+    so a rewritten file is parsed again and the entries of its previous
+    versions are dropped. Columns of another instrument reading the same
+    file are parsed and added to the cached entry. RAW_SIZE files are
+    kept, the least recently used one is dropped first.
+    The columns are copied out of the cache, a consumer modifying them
+    in place does not change the cached columns.
+
+    """
+    STAT = os.stat(path)
+    KEY = (path, STAT.st_size, STAT.st_mtime_ns)
+    # Drop the entries of the previous versions of the file
+    for i in [i for i in RAW if (i[0] == path) and (i != KEY)]:
+        del RAW[i]
+    DF = RAW.get(KEY)
+    COLS = ['User code', *SCHEMA[DATA]]
+    MISS = COLS if DF is None else [i for i in COLS if i not in DF.columns]
+    if MISS:
+        NEW = pd.read_csv(path, usecols=MISS, low_memory=False,
+                          dtype={i: SCHEMA[DATA][i] for i in MISS if i != 'User code'})
+        DF = NEW if DF is None else pd.concat([DF, NEW], axis=1)
+        RAW[KEY] = DF
+    RAW.move_to_end(KEY)
+    while len(RAW) > RAW_SIZE:
+        RAW.popitem(last=False)
+    return DF[COLS].copy()
+
+# ----------------------------------------------------- #
+# h5 handle pool: each h5 file is opened once           #
+# ----------------------------------------------------- #
+# path to (mtime, read-only h5py.File), least recently used first
+H5POOL = OrderedDict()
+H5POOL_SIZE = 8
+H5LOCK = threading.RLock()
+# (path, mtime, group) to the feature names, labels and IDs of the file
+H5META = {}
+
+def open_H5(path):
+    """ Get the read-only handle of the h5 file from the pool
+
+    Parameters
+    ----------
+    path : string
+        h5 file absolute path
+
+    Returns
+    -------
+    data : h5py.File
+        open read-only handle, owned by the pool
+
+    Examples
+    --------
+    >>> from imagen_posthocloader import *
+    >>> data = open_H5(
+    ...     path)                           # H5 FILE
+    >>> X_col = data.attrs['X_col_names']
+
+    Notes
+    -----
+    The handle is reused until it is evicted, H5POOL_SIZE handles are
+    kept open and the least recently used one is closed first. A file
+    rewritten since it was opened is opened again. Do not close the
+    handle, use close_H5.
+
+    """
+    MTIME = os.stat(path).st_mtime_ns
+    with H5LOCK:
+        if path in H5POOL:
+            if H5POOL[path][0] == MTIME:
+                H5POOL.move_to_end(path)
+                return H5POOL[path][1]
+            close_H5(path)
+        while len(H5POOL) >= H5POOL_SIZE:
+            _, (_, data) = H5POOL.popitem(last=False)
+            data.close()
+        H5POOL[path] = (MTIME, h5py.File(path, 'r'))
+        return H5POOL[path][1]
+
+def close_H5(path=None):
+    """ Close the pooled h5 handles
+
+    Parameters
+    ----------
+    path : string, optional
+        h5 file absolute path, None closes all the handles
+
+    Examples
+    --------
+    >>> from imagen_posthocloader import *
+    >>> close_H5()                          # ALL H5 FILES
+
+    """
+    with H5LOCK:
+        for i in list(H5POOL) if path is None else [path]:
+            if i in H5POOL:
+                H5POOL.pop(i)[1].close()
+
+atexit.register(close_H5)
+
+def read_META(path, group=False):
+    """ Read the feature names, labels and IDs of the h5 file without X
+
+    Parameters
+    ----------
+    path : string
+        h5 file absolute path
+    group : boolean, optional
+        If True then add the sex and class group masks
+
+    Returns
+    -------
+    X_col_names : numpy.ndarray
+        X features name list
+    Other : list
+        y, ID and, if group, the sex and class group masks
+
+    Examples
+    --------
+    >>> from imagen_posthocloader import *
+    >>> X_col_names, Other = read_META(
+    ...     path)                           # H5 FILE
+
+    Notes
+    -----
+    The result is cached per path and modification time, the arrays are
+    shared between the callers and should not be modified.
+
+    """
+    with H5LOCK:
+        data = open_H5(path)
+        KEY = (path, H5POOL[path][0], group)
+        if KEY not in H5META:
+            # Drop the entries of the previous versions of the file
+            for i in [i for i in H5META if i[0] == path and i[1] != KEY[1]]:
+                del H5META[i]
+            X_col = data.attrs['X_col_names']
+            X_col_names = np.array([i.replace(")","") for i in X_col])
+            y = data[data.attrs['labels'][0]][()]
+            ID = data['i'][()]
+            if group == True:
+                Other = [y, ID, data['sex'][()], data['Binge'][()]]
+            else:
+                Other = [y, ID]
+            H5META[KEY] = (X_col_names, Other)
+        X_col_names, Other = H5META[KEY]
+    return X_col_names, list(Other)
+
+# ----------------------------------------------------- #
+# Feature catalogue: names parsed once per h5 file      #
+# ----------------------------------------------------- #
+# Region type per second token of the name, else DTI
+TYPES = {'cor': 'Cortical region', 'subcor': 'Subcortical region'}
+
+# Lobe per cortical region (Desikan-Killiany atlas)
+LOBES = {
+    'Temporal lobe' : ['bankssts', 'entorhinal', 'fusiform', 'inferiortemporal',
+                       'middletemporal', 'parahippocampal', 'superiortemporal',
+                       'temporalpole', 'transversetemporal'],
+    'Frontal lobe' : ['caudalmiddlefrontal', 'lateralorbitofrontal', 'paracentral',
+                      'parsopercularis', 'parsorbitalis', 'parstriangularis',
+                      'precentral', 'rostralmiddlefrontal', 'superiorfrontal',
+                      'medialorbitofrontal', 'frontalpole'],
+    'Parietal lobe' : ['inferiorparietal', 'postcentral', 'precuneus',
+                       'superiorparietal', 'supramarginal'],
+    'Occipital lobe' : ['cuneus', 'lateraloccipital', 'pericalcarine', 'lingual'],
+    'Cingulate cortex' : ['caudalanteriorcingulate', 'isthmuscingulate',
+                          'posteriorcingulate', 'rostralanteriorcingulate'],
+    'Insula cortex' : ['insula'],
+}
+LOBE = {i: k for k, v in LOBES.items() for i in v}
+
+# Hemisphere per name token
+HEMISPHERES = {'lh': 'Left', 'Left': 'Left', 'L': 'Left',
+               'rh': 'Right', 'Right': 'Right', 'R': 'Right'}
+
+# Catalogue columns with a precomputed index per value
+GROUPS = ['Modality', 'Type', 'Lobe Region', 'Hemisphere', 'Value']
+
+def catalogue(NAMES):
+    """ Parse the feature names into the feature catalogue
+
+    Parameters
+    ----------
+    NAMES : list
+        X features name list
+
+    Returns
+    -------
+    CAT : pandas.dataframe
+        Feature ID (position in X), Feature name and the categorical
+        Modality, Type, Lobe Region, Hemisphere and Value (measure)
+    INDEX : dictionary
+        GROUPS column to value to the Feature ID array of the group
+
+    Examples
+    --------
+    >>> from imagen_posthocloader import *
+    >>> CAT, INDEX = catalogue(
+    ...     X_col_names)                    # FEATURE NAMES
+    >>> X_DTI = X[:, INDEX['Type']['DTI region']]
+
+    Notes
+    -----
+    Type: 'cor' and 'subcor' second name token, else DTI region.
+    Lobe Region: LOBE of the cortical region, the Type otherwise.
+    Value: last '-' then '_' token of the name.
+
+    """
+    NAMES = [str(i) for i in NAMES]
+    TOKEN = [i.split('_') for i in NAMES]
+    TYPE = [TYPES.get(i[1], 'DTI region') if len(i) > 1 else 'DTI region'
+            for i in TOKEN]
+    REGION = [i[2].split('-')[0] if len(i) > 2 else '' for i in TOKEN]
+    CAT = pd.DataFrame({
+        'Feature ID' : np.arange(len(NAMES), dtype=np.int32),
+        'Feature name' : NAMES,
+        'Modality' : pd.Categorical([i[0] for i in TOKEN]),
+        'Type' : pd.Categorical(TYPE),
+        'Lobe Region' : pd.Categorical(
+            [LOBE.get(r, 'Other') if t == 'Cortical region' else t
+             for t, r in zip(TYPE, REGION)]),
+        'Hemisphere' : pd.Categorical(
+            [next((HEMISPHERES[j] for j in i.replace('_', '-').split('-')
+                   if j in HEMISPHERES), 'Bilateral') for i in NAMES]),
+        'Value' : pd.Categorical(
+            [i.split('-')[-1].split('_')[-1] for i in NAMES])
+    })
+    INDEX = {i: {k: v.astype(np.int32) for k, v in
+                 CAT.groupby(i, observed=True).indices.items()}
+             for i in GROUPS}
+    return CAT, INDEX
+
+# (path, mtime) to the feature catalogue of the file
+H5CATALOGUE = {}
+
+def read_CATALOGUE(path):
+    """ Get the feature catalogue of the h5 file
+
+    Parameters
+    ----------
+    path : string
+        h5 file absolute path
+
+    Returns
+    -------
+    CAT : pandas.dataframe
+        feature catalogue, see catalogue
+    INDEX : dictionary
+        GROUPS column to value to the Feature ID array of the group
+
+    Examples
+    --------
+    >>> from imagen_posthocloader import *
+    >>> CAT, INDEX = read_CATALOGUE(
+    ...     path)                           # H5 FILE
+
+    Notes
+    -----
+    Built once per path and modification time, the cached catalogue is
+    shared between the callers and should not be modified.
+
+    """
+    with H5LOCK:
+        X_col_names, _ = read_META(path)
+        KEY = (path, H5POOL[path][0])
+        if KEY not in H5CATALOGUE:
+            # Drop the entries of the previous versions of the file
+            for i in [i for i in H5CATALOGUE if i[0] == path]:
+                del H5CATALOGUE[i]
+            H5CATALOGUE[KEY] = catalogue(X_col_names)
+        return H5CATALOGUE[KEY]
+
+# ----------------------------------------------------- #
+# Lazy feature matrix and the h5 files of all sessions  #
+# ----------------------------------------------------- #
+def runs(INDEX):
+    """ Split sorted unique positions into slices of consecutive positions
+
+    Parameters
+    ----------
+    INDEX : numpy.ndarray
+        sorted unique integer positions
+
+    Returns
+    -------
+    RUNS : list
+        slice per run, e.g. [0, 1, 2, 7, 8] gives [0:3, 7:9]
+
+    """
+    CUT = np.flatnonzero(np.diff(INDEX) != 1) + 1
+    return [slice(i[0], i[-1] + 1) for i in np.split(INDEX, CUT) if len(i)]
+
+class H5_matrix:
+    def __init__(self, path, ROWS=None, COLS=None):
+        """ Set up a lazy view of X, nothing is read until asked
+
+        Parameters
+        ----------
+        path : string
+            h5 file absolute path
+        ROWS : numpy.ndarray, optional
+            subject row positions in X, None selects all the rows
+        COLS : numpy.ndarray, optional
+            feature column positions in X, None selects all the columns
+
+        Examples
+        --------
+        >>> from imagen_posthocloader import *
+        >>> X = H5_matrix(path)
+        >>> X_DTI = X.select('DTI_')
+        >>> for ROWS, CHUNK in X_DTI.iter_chunks(256):
+        ...     pass
+
+        """
+        self.path = path
+        with H5LOCK:
+            N, M = open_H5(path)['X'].shape
+        self.ROWS = np.arange(N) if ROWS is None else np.asarray(ROWS)
+        self.COLS = np.arange(M) if COLS is None else np.asarray(COLS)
+
+    @property
+    def shape(self):
+        return (len(self.ROWS), len(self.COLS))
+
+    @property
+    def columns(self):
+        """ X features name list of the selected columns """
+        return read_META(self.path)[0][self.COLS]
+
+    def __len__(self):
+        return len(self.ROWS)
+
+    def __repr__(self):
+        return f"H5_matrix({os.path.basename(self.path)}, shape={self.shape})"
+
+    def select(self, prefix=None, columns=None):
+        """ Select the feature columns
+
+        Parameters
+        ----------
+        prefix : string or tuple, optional
+            keep the features starting with the prefix(es), e.g. 'DTI_'
+        columns : list, optional
+            keep these feature names, in this order
+
+        Returns
+        -------
+        X : H5_matrix
+            new view with the selected columns
+
+        Examples
+        --------
+        >>> from imagen_posthocloader import *
+        >>> X_T1w = H5_matrix(path).select(
+        ...     ('T1w_subcor_', 'T1w_cor_'))   # PREFIX
+
+        """
+        NAMES = self.columns
+        KEEP = np.ones(len(NAMES), dtype=bool)
+        if prefix is not None:
+            PREFIX = prefix if isinstance(prefix, str) else tuple(prefix)
+            KEEP = np.array([i.startswith(PREFIX) for i in NAMES], dtype=bool)
+        COLS = self.COLS[KEEP]
+        if columns is not None:
+            POS = pd.Index(NAMES[KEEP]).get_indexer(list(columns))
+            if (POS == -1).any():
+                raise KeyError(f"{np.asarray(columns)[POS == -1]} not in X")
+            COLS = COLS[POS]
+        return H5_matrix(self.path, self.ROWS, COLS)
+
+    def take(self, ROWS):
+        """ Select the subject rows
+
+        Parameters
+        ----------
+        ROWS : numpy.ndarray
+            row positions or boolean mask of the current rows
+
+        Returns
+        -------
+        X : H5_matrix
+            new view with the selected rows
+
+        Examples
+        --------
+        >>> from imagen_posthocloader import *
+        >>> X_HC = H5_matrix(path).take(
+        ...     y == 0)                         # MASK
+
+        """
+        return H5_matrix(self.path, self.ROWS[np.asarray(ROWS)], self.COLS)
+
+    def read(self, ROWS):
+        """ Read the selected columns of the rows as numpy.ndarray
+
+        Only the selected cells are read: one read per run of consecutive
+        rows, the columns as one slice if consecutive, else as the sorted
+        positions (h5py takes one list axis, in increasing order). The
+        values are put back in the order of ROWS and COLS in memory.
+
+        """
+        # Sorted unique positions, the inverse restores the asked order
+        U_ROWS, I_ROWS = np.unique(ROWS, return_inverse=True)
+        U_COLS, I_COLS = np.unique(self.COLS, return_inverse=True)
+        with H5LOCK:
+            d = open_H5(self.path)['X']
+            BLOCK = np.empty((len(U_ROWS), len(U_COLS)), dtype=d.dtype)
+            if len(U_ROWS) and len(U_COLS):
+                C_RUNS = runs(U_COLS)
+                COLS = C_RUNS[0] if len(C_RUNS) == 1 else U_COLS
+                for R in runs(U_ROWS):
+                    i = np.searchsorted(U_ROWS, R.start)
+                    BLOCK[i:i + R.stop - R.start] = d[R, COLS]
+        return BLOCK[np.ix_(I_ROWS, I_COLS)]
+
+    def iter_chunks(self, CHUNK=1024):
+        """ Iterate over the rows in dense chunks
+
+        Parameters
+        ----------
+        CHUNK : integer, optional
+            number of rows per chunk
+
+        Yields
+        ------
+        ROWS : slice
+            position of the chunk in the selected rows
+        X : numpy.ndarray
+            dense chunk, (rows, selected columns)
+
+        """
+        for i in range(0, len(self.ROWS), CHUNK):
+            yield slice(i, i + CHUNK), self.read(self.ROWS[i:i + CHUNK])
+
+    def to_numpy(self):
+        """ Read the selected rows and columns as numpy.ndarray """
+        return self.read(self.ROWS)
+
+    def __array__(self, dtype=None):
+        X = self.to_numpy()
+        return X if dtype is None else X.astype(dtype)
+
+class H5_dataset:
+    def __init__(self, DATA_DIR="/ritter/share/data/IMAGEN", DATA='Binge'):
+        """ Set up one view of the training and holdout h5 files of y
+
+        Parameters
+        ----------
+        DATA_DIR : string, optional
+            Directory IMAGEN absolute path
+        DATA : string, optional
+            y name, a key of H5FILES
+
+        Examples
+        --------
+        >>> from imagen_posthocloader import *
+        >>> D = H5_dataset()
+        >>> DF = D.read(
+        ...     ID = [12809392],                # SUBJECT
+        ...     prefix = 'DTI_')                # FEATURES
+        >>> DF.xs(12809392, level='ID')
+
+        Notes
+        -----
+        Only the IDs of the files are read here, the index maps each
+        (Session, Dataset, ID) to the file and row of its features. X is
+        read by read(), one read per run of consecutive rows of a file.
+
+        """
+        self.DATA_DIR = DATA_DIR
+        self.DATA = DATA
+        LIST = []
+        for SES, DATASET, H5 in H5FILES[DATA]:
+            _, Other = read_META(f"{DATA_DIR}/h5files/{H5}")
+            LIST.append(pd.DataFrame({
+                'Session' : SES,
+                'Dataset' : DATASET,
+                'ID' : Other[1],
+                'File' : H5,
+                'Row' : np.arange(len(Other[1]))
+            }))
+        INDEX = pd.concat(LIST, ignore_index=True)
+        INDEX['Session'] = to_SESSION(INDEX['Session'])
+        INDEX['Dataset'] = INDEX['Dataset'].astype('category')
+        INDEX['File'] = INDEX['File'].astype('category')
+        self.INDEX = INDEX.set_index(['Session', 'Dataset', 'ID']).sort_index()
+
+    def __len__(self):
+        return len(self.INDEX)
+
+    def __repr__(self):
+        return f"H5_dataset({self.DATA}, rows={len(self)})"
+
+    def locate(self, session=None, dataset=None, ID=None):
+        """ Select the index rows
+
+        Parameters
+        ----------
+        session : string or list, optional
+            BL, FU2 or FU3, None selects all the sessions
+        dataset : string or list, optional
+            Training or Holdout, None selects both
+        ID : integer or list, optional
+            subject IDs, None selects all the subjects
+
+        Returns
+        -------
+        INDEX : pandas.dataframe
+            File and Row per selected (Session, Dataset, ID)
+
+        """
+        INDEX = self.INDEX
+        for LEVEL, VALUE in zip(['Session', 'Dataset', 'ID'],
+                                [session, dataset, ID]):
+            if VALUE is not None:
+                VALUE = VALUE if isinstance(VALUE, (list, tuple, np.ndarray)) else [VALUE]
+                INDEX = INDEX[INDEX.index.get_level_values(LEVEL).isin(VALUE)]
+        return INDEX
+
+    def read(self, session=None, dataset=None, ID=None, prefix=None,
+             columns=None):
+        """ Read the features of the selected rows
+
+        Parameters
+        ----------
+        session, dataset, ID : optional
+            row selection, see locate
+        prefix : string or tuple, optional
+            keep the features starting with the prefix(es), e.g. 'DTI_'
+        columns : list, optional
+            keep these feature names
+
+        Returns
+        -------
+        DF : pandas.dataframe
+            features indexed by (Session, Dataset, ID), a feature missing
+            in a file is NaN for its rows
+
+        Examples
+        --------
+        >>> from imagen_posthocloader import *
+        >>> D = H5_dataset()
+        >>> DF = D.read(dataset='Holdout', prefix='T1w_cor_')
+        >>> WIDE = DF.droplevel('Dataset').unstack('Session')
+
+        """
+        INDEX = self.locate(session, dataset, ID)
+        LIST = []
+        for H5, ROWS in INDEX.groupby('File', observed=True)['Row']:
+            X = H5_matrix(f"{self.DATA_DIR}/h5files/{H5}").take(ROWS.to_numpy())
+            if (prefix is not None) or (columns is not None):
+                NAMES = set(X.columns)
+                PREFIX = '' if prefix is None else \
+                    prefix if isinstance(prefix, str) else tuple(prefix)
+                X = X.select(columns=[
+                    i for i in (X.columns if columns is None else columns)
+                    if (i in NAMES) and i.startswith(PREFIX)])
+            LIST.append(pd.DataFrame(X.to_numpy(), index=ROWS.index,
+                                     columns=X.columns))
+        if not LIST:
+            return pd.DataFrame(index=INDEX.index)
+        return pd.concat(LIST).reindex(INDEX.index)
+
+# ----------------------------------------------------- #
+# Storage: csv for sharing, parquet/feather columnar    #
+# ----------------------------------------------------- #
+EXT = {'csv': '.csv', 'parquet': '.parquet', 'feather': '.feather'}
+
+# Label column of an object column mixing numbers and labels (e.g. age
+# with 'not known'), listed in the 'mixed' metadata of parquet/feather
+MIXED = '{}__label'
+
+def split_MIXED(DF):
+    """ Split the object columns mixing numbers and labels in two columns
+
+    Parameters
+    ----------
+    DF : pandas.dataframe
+        table to save, its columns are replaced
+
+    Returns
+    -------
+    DF : pandas.dataframe
+        the numbers as float64 in the column and the labels in the
+        MIXED label column, missing in the other column
+    SPLIT : dictionary
+        column to its label column
+
+    Examples
+    --------
+    >>> from imagen_posthocloader import *
+    >>> DF, SPLIT = split_MIXED(
+    ...     DF)                             # DATAFRAME
+
+    """
+    SPLIT = {}
+    for COL in DF.columns[DF.dtypes == object]:
+        if pd.api.types.infer_dtype(DF[COL], skipna=True) not in \
+                ['mixed', 'mixed-integer', 'mixed-integer-float']:
+            continue
+        X = DF[COL].to_numpy()
+        NULL = pd.isna(X)
+        NUM = np.array([isinstance(i, (int, float, np.number))
+                        and not isinstance(i, (bool, np.bool_)) for i in X]) & ~NULL
+        STR = np.array([isinstance(i, str) for i in X])
+        # other objects (e.g. lists) are kept as they are
+        if not (NUM.any() and STR.any() and (NUM | STR | NULL).all()):
+            continue
+        SPLIT[COL] = MIXED.format(COL)
+        DF[SPLIT[COL]] = np.where(STR, X, None)
+        DF[COL] = np.where(NUM, X, np.NaN).astype(np.float64)
+    return DF, SPLIT
+
+def join_MIXED(DF, SPLIT):
+    """ Join the split columns back to the object columns
+
+    Parameters
+    ----------
+    DF : pandas.dataframe
+        table read with the label columns of its split columns
+    SPLIT : dictionary
+        column to its label column, see split_MIXED
+
+    Returns
+    -------
+    DF : pandas.dataframe
+        object columns of the numbers and the labels, no label column
+
+    """
+    for COL, LABEL in SPLIT.items():
+        if LABEL not in DF:
+            continue
+        if COL in DF:
+            DF[COL] = DF[COL].astype(object).where(DF[LABEL].isna(), DF[LABEL])
+        DF = DF.drop(columns=LABEL)
+    return DF
+
+def read_SCHEMA(path):
+    """ Read the arrow schema of the parquet/feather file, None for csv """
+    if path.endswith(EXT['parquet']):
+        import pyarrow.parquet as pq
+        return pq.read_schema(path)
+    elif path.endswith(EXT['feather']):
+        import pyarrow.ipc as ipc
+        return ipc.open_file(path).schema
+    return None
+
+def write_TABLE(DF, save_path, FORMAT='csv'):
+    """ Save the dataframe in the storage format
+
+    Parameters
+    ----------
+    DF : pandas.dataframe
+        table to save
+    save_path : string
+        save path, the extension is replaced by the one of FORMAT
+    FORMAT : string, optional
+        storage format: 'csv', 'parquet' or 'feather'
+
+    Returns
+    -------
+    save_path : string
+        the written file path
+
+    Examples
+    --------
+    >>> from imagen_posthocloader import *
+    >>> save_path = write_TABLE(
+    ...     DF,                             # DATAFRAME
+    ...     'posthoc/all_NEO.csv',          # PATH
+    ...     'parquet')                      # FORMAT
+
+    Notes
+    -----
+    Parquet and feather keep the dtypes and the categoricals.
+    Object columns mixing numbers and labels (e.g. age with 'not known')
+    are stored as a float64 column and a label column, see split_MIXED,
+    and joined back by read_TABLE; the numbers are read as floats.
+
+    """
+    save_path = os.path.splitext(save_path)[0] + EXT[FORMAT]
+    # set the save option
+    if not os.path.isdir(os.path.dirname(save_path)):
+        os.makedirs(os.path.dirname(save_path))
+    if FORMAT == 'csv':
+        DF.to_csv(save_path, index=None)
+        return save_path
+    import pyarrow as pa
+    DF, SPLIT = split_MIXED(DF.reset_index(drop=True))
+    TABLE = pa.Table.from_pandas(DF, preserve_index=False)
+    if SPLIT:
+        TABLE = TABLE.replace_schema_metadata(
+            {**TABLE.schema.metadata, b'mixed': json.dumps(SPLIT).encode()})
+    if FORMAT == 'parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(TABLE, save_path)
+    if FORMAT == 'feather':
+        import pyarrow.feather as feather
+        feather.write_feather(TABLE, save_path)
+    return save_path
+
+def read_TABLE(path, columns=None, filters=None):
+    """ Load the table in the format of the file extension
+
+    Parameters
+    ----------
+    path : string
+        table absolute path (*.csv, *.parquet, *.feather)
+    columns : list, optional
+        columns to read, None reads all the columns
+    filters : list, optional
+        parquet only, (column, 'in', values) row group filters
+
+    Returns
+    -------
+    DF : pandas.dataframe
+        the table
+
+    Examples
+    --------
+    >>> from imagen_posthocloader import *
+    >>> DF = read_TABLE(
+    ...     'posthoc/all_RUN.parquet',      # PATH
+    ...     ['ID','Session','Prob'])        # COLUMNS
+
+    """
+    ARROW = read_SCHEMA(path)
+    if ARROW is None:
+        DF = pd.read_csv(path, usecols=columns, low_memory=False)
+        if columns is not None:
+            DF = DF[columns]
+        return DF
+    # the label columns of the requested split columns are read too
+    SPLIT = json.loads((ARROW.metadata or {}).get(b'mixed', b'{}'))
+    READ = columns if columns is None else list(dict.fromkeys(
+        [*columns, *[SPLIT[i] for i in columns if i in SPLIT]]))
+    if path.endswith(EXT['parquet']):
+        DF = pd.read_parquet(path, columns=READ, filters=filters or None)
+    else:
+        DF = pd.read_feather(path, columns=READ)
+    return join_MIXED(DF, SPLIT)
+
+def read_COLUMNS(path):
+    """ Read the column names of the table, not the rows
+
+    Parameters
+    ----------
+    path : string
+        table absolute path (*.csv, *.parquet, *.feather)
+
+    Returns
+    -------
+    COLUMNS : list
+        column names of the table
+
+    Examples
+    --------
+    >>> from imagen_posthocloader import *
+    >>> COLUMNS = read_COLUMNS(
+    ...     'posthoc/all_RUN.parquet')      # PATH
+
+    """
+    ARROW = read_SCHEMA(path)
+    if ARROW is None:
+        return list(pd.read_csv(path, nrows=0).columns)
+    SPLIT = json.loads((ARROW.metadata or {}).get(b'mixed', b'{}'))
+    return [i for i in ARROW.names if i not in SPLIT.values()]
+
+def write_PARTITION(DF, save_dir, FORMAT='csv', KEY='Session'):
+    """ Save the dataframe as one file per value of the key
+
+    Parameters
+    ----------
+    DF : pandas.dataframe
+        table to save
+    save_dir : string
+        dataset directory, the files are {save_dir}/{KEY}={value}/part.*
+    FORMAT : string, optional
+        storage format: 'csv', 'parquet' or 'feather'
+    KEY : string, optional
+        partition column, kept in the files
+
+    Returns
+    -------
+    save_dir : string
+        the dataset directory
+
+    Examples
+    --------
+    >>> from imagen_posthocloader import *
+    >>> save_dir = write_PARTITION(
+    ...     DF,                             # DATAFRAME
+    ...     'posthoc/IMAGEN_posthoc',       # DIRECTORY
+    ...     'parquet')                      # FORMAT
+
+    Notes
+    -----
+    Only the partitions in DF are written, the files of another format in
+    these partitions are removed; the other partitions are kept.
+
+    """
+    for VALUE, PART in DF.groupby(KEY, sort=False, observed=True):
+        save_path = write_TABLE(PART, f"{save_dir}/{KEY}={VALUE}/part.csv", FORMAT)
+        for OLD in glob(f"{os.path.dirname(save_path)}/part.*"):
+            if OLD != save_path:
+                os.remove(OLD)
+    return save_dir
+
+def read_PARTITION(path, columns=None):
+    """ Load the partitioned dataset in one dataframe
+
+    Parameters
+    ----------
+    path : string
+        dataset directory written by write_PARTITION
+    columns : list, optional
+        columns to read, None reads all the columns
+
+    Returns
+    -------
+    DF : pandas.dataframe
+        the partitions concatenated in the sorted order of the key
+
+    Examples
+    --------
+    >>> from imagen_posthocloader import *
+    >>> DF = read_PARTITION(
+    ...     'posthoc/IMAGEN_posthoc')       # DIRECTORY
+
+    """
+    LIST = [read_TABLE(i, columns) for i in sorted(glob(f"{path}/*=*/part.*"))]
+    DF = pd.concat(LIST, ignore_index=True)
+    return DF
+
 class INSTRUMENT_loader:
-    def __init__(self, DATA_DIR="/ritter/share/data/IMAGEN"):
+    def __init__(self, DATA_DIR="/ritter/share/data/IMAGEN", FORMAT="csv"):
         """ Set up path
         
         Parameters
         ----------
         DATA_DIR : string, optional
             Directory IMAGEN absolute path
+        FORMAT : string, optional
+            storage format of the saved files: csv, parquet or feather
         
         """
         # Set the directory path: IMAGEN
         self.DATA_DIR = DATA_DIR
+        self.FORMAT = FORMAT
     
-    def set_INSTRUMENT(self, DATA, save=False):
-        """ Save all session instrument in one file
-        
+    def set_SESSION(self, DATA, SES, DIR, CSV):
+        """ Read and decode one session of the instrument
+
         Parameters
         ----------
         DATA : string,
             instrument name
-        save : boolean,
-            save the pandas.dataframe to .csv file
-            
+        SES : string,
+            session label of the rows (BL, FU1, FU2, FU3)
+        DIR : string,
+            session folder of the raw psytools file
+        CSV : string,
+            raw psytools file name
+
         Returns
         -------
-        DF3 : pandas.dataframe
-            instrument in all session (BL, FU1, FU2, FU3)
-            
+        DF2 : pandas.dataframe
+            instrument in one session
+
         Examples
         --------
         >>> from imagen_posthocloader import *
         >>> DATA = INSTRUMENT_loader()
-        >>> DF3 = DATA.set_INSTRUMENT(
+        >>> DF2 = DATA.set_SESSION(
         ...     'NEO',                          # INSTRUMENT
-        ...     save = True)                    # Save
-        >>> DF_FU3 = DF3.groupby('Session').get_group('FU3')
-        
-        Notes
-        -----
-        If only one session has information,
-        the same value is copied to all sessions based on ID.
-        (e.g. CTQ[FU2], CTS[BL], PBQ[BL,FU1], BSI[FU3], PANAS[FU3])
-        
+        ...     *PSYTOOLS['NEO'][0])            # SES, DIR, CSV
+
         """
+        path = f"{self.DATA_DIR}/IMAGEN_RAW/2.7/{DIR}/psytools/{CSV}"
+        # Read only the raw columns of the instrument
+        DF = read_PSYTOOLS(path, DATA)
+        DF['ID'] = to_ID(DF['User code'])
+        DF['Session'] = SES
+
         # ----------------------------------------------------- #
         # ROI Columns: Demographic profile                      #
-        # ----------------------------------------------------- #        
-        if DATA == "BMI":
-            pass
-        
+        # ----------------------------------------------------- #
         if DATA == "PBQ":
-            # Set the files with session and roi columns
-            PBQ = [
-                ('FU1','IMAGEN-IMGN_PBQ_FU_RC1-BASIC_DIGEST.csv'),
-                ('BL', 'IMAGEN-IMGN_PBQ_RC1-BASIC_DIGEST.csv')
-            ]
             ROI = [
                 'ID','Session','pbq_03','pbq_03a','pbq_03b','pbq_03c',
                 'pbq_05','pbq_05a','pbq_05b','pbq_05c','pbq_06','pbq_06a',
                 'pbq_12','pbq_13','pbq_13a','pbq_13b','pbq_13g',
             ]
-            # Generate the columns
-            def test(x):
-                if x == 0: return 'No'
-                elif x == 1: return 'Yes'
-                elif x == -1: return 'not known'
-                elif x == -2: return 'not available'
-                else: return np.NaN
-            def day(x):
-                if x == 2: return 'yes, every day'
-                elif x == 1: return 'yes, on occasion'
-                elif x == 0: return 'no, not at all'
-                elif x == -1: return 'not known'
-                elif x == -2: return 'not available'
-                else: return np.NaN
-            def age(x):
-                if x == -1: return 'not known'
-                elif x == -2: return 'not available'
-                else: return x
-            def cigarettes(x):
-                if x == 1: return 'Less than 1 cigarette per week'
-                elif x == 2: return 'Less than 1 cigarette per day'
-                elif x == 3: return '1-5 cigarettes per day'
-                elif x == 8: return '6-10 cigarettes per day'
-                elif x == 15: return '11-20 cigarettes per day'
-                elif x == 25: return '21-30 cigarettes per day'
-                elif x == 30: return 'More than 30 cigarettes per day'
-                elif x == -1: return 'not known'
-                elif x == -2: return 'not available'
-                else: return np.NaN
-            def alcohol(x):
-                if x == 1: return 'Monthly or less'
-                elif x == 2: return 'Two to four times a month'
-                elif x == 3: return 'Two to three times a week'
-                elif x == 4: return 'Four or more times a week'
-                elif x == -1: return 'not known'
-                elif x == -2: return 'not available'
-                else: return np.NaN
-            def drinks(x):
-                if x == 0: return '1 or 2'
-                elif x == 1: return '3 or 4'
-                elif x == 2: return '5 or 6'
-                elif x == 3: return '7 to 9'
-                elif x == 4: return '10 or more'
-                elif x == -1: return 'not known'
-                elif x == -2: return 'not available'
-                else: return np.NaN
-            def stage(x):
-                if x == 1: return 'first trimester'
-                elif x == 2: return 'second trimester'
-                elif x == 3: return 'third trimester'
-                elif x == 12: return 'first and second'
-                elif x == 23: return 'second and third'
-                elif x == 13: return 'first and third'
-                elif x == 4: return 'whole pregnancy'
-                elif x == -1: return 'not known'
-                elif x == -2: return 'not available'
-                else: return np.NaN            
-            # Generate the instrument files in one dataframe
-            PBQ_LIST = []
-            for SES, CSV in PBQ:
-                path = f"{self.DATA_DIR}/IMAGEN_RAW/2.7/{SES}/psytools/{CSV}"
-                DF = pd.read_csv(path, low_memory=False)
-                # Rename the values
-                DF['ID'] = DF['User code'] if SES=='FU3' else DF['User code'].apply(lambda x : int(x[:12]))
-                DF['Session'] = SES
-                DF["pbq_03"] = DF['pbq_03'].apply(test)
-                DF['pbq_03a'] = DF['pbq_03a'].apply(day)
-                DF['pbq_03b'] = DF['pbq_03b'].apply(age)
-                DF["pbq_03c"] = DF['pbq_03c'].apply(cigarettes)
-                DF["pbq_05"] = DF['pbq_05'].apply(test)
-                DF["pbq_05a"] = DF['pbq_05a'].apply(cigarettes)
-                DF["pbq_05b"] = DF['pbq_05b'].apply(cigarettes)
-                DF["pbq_05c"] = DF['pbq_05c'].apply(cigarettes)
-                DF["pbq_06"] = DF['pbq_06'].apply(test)
-                DF["pbq_06a"] = DF['pbq_06a'].apply(cigarettes)
-                DF["pbq_12"] = DF['pbq_12'].apply(test)
-                DF["pbq_13"] = DF['pbq_13'].apply(test)
-                DF["pbq_13a"] = DF['pbq_13a'].apply(alcohol)
-                DF["pbq_13b"] = DF['pbq_13b'].apply(drinks)
-                DF["pbq_13g"] = DF['pbq_13g'].apply(stage)
-                DF2 = DF[ROI]
-                PBQ_LIST.append(DF2)
-            PBQ = pd.concat(PBQ_LIST)
-            # Exclude the rows:          
-            # Duplicate ID: 71766352, 58060181, 15765805, 15765805 in FU1
-            for i in [71766352, 58060181, 15765805, 12809392]:
-                is_out = (PBQ['ID']==i) & (PBQ['Session']=='FU1')
-                PBQ = PBQ[~is_out]
-            # Different ID: 12809392 in both BL and FU1
-            for i in [12809392]:
-                is_out = (PBQ['ID']==i) & (PBQ['Session']=='BL')
-                PBQ = PBQ[~is_out]
-            DF3 = PBQ
-        
+            # Rename the values
+            for COL, CODE in CODEBOOK['PBQ'].items():
+                DF[COL] = decode(DF[COL], CODE)
+
         if DATA == 'GEN':
-            # Set the files with session and roi columns
-            GEN = [
-                ('FU3','IMAGEN-IMGN_GEN_RC5-BASIC_DIGEST.csv'),
-                ('FU2','IMAGEN-IMGN_GEN_RC5-BASIC_DIGEST.csv'),
-                ('FU1','IMAGEN-IMGN_GEN_RC5-BASIC_DIGEST.csv'),
-                ('BL','IMAGEN-IMGN_GEN_RC5-BASIC_DIGEST.csv')
-            ]
-            ROI = ['ID','Session','Paternal_disorder','Maternal_disorder',
-                   'Pd_list','Md_list']
-            # Generate the columns
-            def disorder(x):
-                if x == 'ALC': return 'Alcohol problems'
-                elif x == 'DRUG': return 'Drug problems'
-                elif x == 'SCZ': return 'Schizophrenia'
-                elif x == 'SCZAD': return 'Schizoaffective Disorder'
-                elif x == 'DPR_R': return 'Major Depression recurrent'
-                elif x == 'DPR_SE': return 'Major Depression single episode'
-                elif x == 'BIP_I': return 'Bipolar I Disorder'
-                elif x == 'BIP_II': return 'Bipolar II Disorder'
-                elif x == 'OCD': return 'Obessive-compulsive Disroder'
-                elif x == 'ANX': return 'Anxiety Disorder'
-                elif x == 'EAT': return 'Eating Disorder'
-                elif x == 'SUIC': return 'Suicide / Suicidal Attempt'
-                elif x == 'OTHER': return 'Other'
-                else: return np.NaN
-            # Generate the instrument files in one dataframe
-            GEN_LIST = []
-            for SES, CSV in GEN:
-                path = f"{self.DATA_DIR}/IMAGEN_RAW/2.7/BL/psytools/{CSV}"
-                DF = pd.read_csv(path, low_memory=False)
-                DF['ID'] = DF['User code'].apply(lambda x : int(x[:12]))
-                DF['Session'] = SES
-                DF['Disorder_PF_1'] = DF['Disorder_PF_1'].apply(disorder)
-                DF['Disorder_PF_2'] = DF['Disorder_PF_2'].apply(disorder)
-                DF['Disorder_PF_3'] = DF['Disorder_PF_3'].apply(disorder)
-                DF['Disorder_PF_4'] = DF['Disorder_PF_4'].apply(disorder)
-                DF['Disorder_PM_1'] = DF['Disorder_PM_1'].apply(disorder)
-                DF['Disorder_PM_2'] = DF['Disorder_PM_2'].apply(disorder)
-                DF['Disorder_PM_3'] = DF['Disorder_PM_3'].apply(disorder)
-                DF['Disorder_PM_4'] = DF['Disorder_PM_4'].apply(disorder)
-                DF['Disorder_PM_5'] = DF['Disorder_PM_5'].apply(disorder)
-                DF['Disorder_PM_6'] = DF['Disorder_PM_6'].apply(disorder)
-                P1 = DF['Disorder_PF_1'].values.tolist()
-                P2 = DF['Disorder_PF_2'].values.tolist()
-                P3 = DF['Disorder_PF_3'].values.tolist()
-                P4 = DF['Disorder_PF_4'].values.tolist()
-                M1 = DF['Disorder_PM_1'].values.tolist()
-                M2 = DF['Disorder_PM_1'].values.tolist()
-                M3 = DF['Disorder_PM_1'].values.tolist()
-                M4 = DF['Disorder_PM_1'].values.tolist()
-                M5 = DF['Disorder_PM_1'].values.tolist()
-                M6 = DF['Disorder_PM_1'].values.tolist()
-                Pd_raw = [list(i) for i in zip(P1,P2,P3,P4)]
-                Md_raw = [list(j) for j in zip(M1,M2,M3,M4,M5,M6)]
-                DF['Pd_list'] = [[x for x in i if pd.isnull(x) == False] for i in Pd_raw]
-                DF['Md_list'] = [[x for x in i if pd.isnull(x) == False] for i in Md_raw]
-                Variables = [
-                    'ID','Session','Disorder_PF_1','Disorder_PF_2','Disorder_PF_3',
-                    'Disorder_PF_4','Disorder_PM_1','Disorder_PM_2','Disorder_PM_3',
-                    'Disorder_PM_4','Disorder_PM_5','Disorder_PM_6','Pd_list','Md_list'
-                ]
-                Check_DF = DF[Variables]
-                Check_DF['Paternal_disorder'] = Check_DF.loc[:, Check_DF.columns[2:6]].apply(
-                    lambda x: ','.join(x.dropna().astype(str)), axis=1)
-                Check_DF['Maternal_disorder'] = Check_DF.loc[:, Check_DF.columns[6:12]].apply(
-                    lambda x: ','.join(x.dropna().astype(str)), axis=1)
-                DF2 = Check_DF[ROI]
-                GEN_LIST.append(DF2)
-            GEN = pd.concat(GEN_LIST)
-            DF3 = GEN
+            ROI = ['ID','Session',
+                   *[f'Paternal_{i}' for i in CODES['disorder']],
+                   *[f'Maternal_{i}' for i in CODES['disorder']]]
+            # Aggregate the disorders of each parent
+            PF = [f'Disorder_PF_{i}' for i in range(1, 5)]
+            PM = [f'Disorder_PM_{i}' for i in range(1, 7)]
+            for PARENT, COLS in [('Paternal', PF), ('Maternal', PM)]:
+                IND = indicate(DF, COLS, 'disorder')
+                for i, COL in enumerate(CODES['disorder']):
+                    DF[f'{PARENT}_{COL}'] = IND[:, i]
 
         if DATA == 'LEQ':
-            # Set the files with session and roi columns
-            LEQ = [
-                ('FU3','IMAGEN-IMGN_LEQ_FU3.csv'),
-                ('FU2','IMAGEN-IMGN_LEQ_FU2-IMAGEN_DIGEST.csv'),
-                ('FU1','IMAGEN-IMGN_LEQ_FU_RC5-IMAGEN_DIGEST.csv'),
-                ('BL' ,'IMAGEN-IMGN_LEQ_RC5-BASIC_DIGEST.csv')
-            ]
             ROI = [
                 'ID','Session','family_valence','accident_valence','sexuality_valence',
                 'autonomy_valence','devience_valence','relocation_valence',
@@ -259,544 +1930,279 @@ class INSTRUMENT_loader:
                 'autonomy_ever_meanfreq','devience_ever_meanfreq','relocation_ever_meanfreq',
                 'distress_ever_meanfreq','noscale_ever_meanfreq','overall_ever_meanfreq'
             ]
-            # Generate the instrument files in one dataframe
-            LEQ_LIST = []
-            for SES, CSV in LEQ:
-                path = f"{self.DATA_DIR}/IMAGEN_RAW/2.7/{SES}/psytools/{CSV}"
-                DF = pd.read_csv(path, low_memory=False)
-                DF['ID'] = DF['User code'] if SES=='FU3' else DF['User code'].apply(lambda x : int(x[:12]))
-                DF['Session'] = SES
-                DF2 = DF[ROI]
-                LEQ_LIST.append(DF2)
-            LEQ = pd.concat(LEQ_LIST)
-            # Rename the columns
-            DF3 = LEQ.rename(
-                columns = {
-                    # Mean valence of events
-                    "family_valence"           : "Family valence",
-                    "accident_valence"         : "Accident valence",
-                    "sexuality_valence"        : "Sexuality valence",
-                    "autonomy_valence"         : "Autonomy valence",
-                    "devience_valence"         : "Devience valence",
-                    "relocation_valence"       : "Relocation valence",
-                    "distress_valence"         : "Distress valence",
-                    "noscale_valence"          : "Noscale valence",
-                    "overall_valence"          : "Overall valence",
-                    # Mean frequency lifetime
-                    "family_ever_meanfreq"     : "Family mean frequency",
-                    "accident_ever_meanfreq"   : "Accident mean frequency",
-                    "sexuality_ever_meanfreq"  : "Sexuality mean frequency",
-                    "autonomy_ever_meanfreq"   : "Autonomy mean frequency",
-                    "devience_ever_meanfreq"   : "Devience mean frequency",
-                    "relocation_ever_meanfreq" : "Relocation mean frequency",
-                    "distress_ever_meanfreq"   : "Distress mean frequency",
-                    "noscale_ever_meanfreq"    : "Noscale mean frequency",
-                    "overall_ever_meanfreq"    : "Overall mean frequency",
-                }
-            )
-            
-        if DATA == "DAWBA":
-            pass
-        
-        if DATA == "CANTAB":
-            pass
-        
+
         # ----------------------------------------------------- #
         # ROI Columns: Psychological profile                    #
-        # ----------------------------------------------------- #        
+        # ----------------------------------------------------- #
         if DATA == "NEO":
-            # Set the files with session and roi columns
-            NEO = [
-                ('FU3','IMAGEN-IMGN_NEO_FFI_FU3.csv'),
-                ('FU2','IMAGEN-IMGN_NEO_FFI_FU2-IMAGEN_SURVEY_DIGEST.csv'),
-                ('FU1','IMAGEN-IMGN_NEO_FFI_CHILD_FU_RC5-IMAGEN_SURVEY_DIGEST.csv'),
-                ('BL', 'IMAGEN-IMGN_NEO_FFI_CHILD_RC5-IMAGEN_SURVEY_DIGEST.csv')
-            ]
             ROI = ['ID','Session','open_mean','cons_mean','extr_mean','agre_mean','neur_mean']
-            # Generate the instrument files in one dataframe
-            NEO_LIST = []
-            for SES, CSV in NEO:
-                path = f"{self.DATA_DIR}/IMAGEN_RAW/2.7/{SES}/psytools/{CSV}"
-                DF = pd.read_csv(path, low_memory=False)
-                DF['ID'] = DF['User code'] if SES=='FU3' else DF['User code'].apply(lambda x : int(x[:12]))
-                DF['Session'] = SES
-                DF2 = DF[ROI]
-                NEO_LIST.append(DF2)
-            NEO = pd.concat(NEO_LIST)
-            # Rename the columns
-            DF3 = NEO.rename(
-                columns = {
-                    "neur_mean" : "Neuroticism mean",
-                    "extr_mean" : "Extroversion mean",
-                    "open_mean" : "Openness mean",
-                    "agre_mean" : "Agreeableness mean",
-                    "cons_mean" : "Conscientiousness mean",
-                }
-            )
 
         if DATA == "SURPS":
-            # Set the files with session and roi columns
-            SURPS = [
-                ('FU3','IMAGEN-IMGN_SURPS_FU3.csv'),
-                ('FU2','IMAGEN-IMGN_SURPS_FU2-IMAGEN_SURVEY_DIGEST.csv'),
-                ('FU1','IMAGEN-IMGN_SURPS_FU_RC5-IMAGEN_SURVEY_DIGEST.csv'),
-                ('BL', 'IMAGEN-IMGN_SURPS_RC5-IMAGEN_SURVEY_DIGEST.csv')
-            ]
             ROI = ['ID', 'Session', 'as_mean', 'h_mean', 'imp_mean', 'ss_mean']
-            # Generate the instrument files in one dataframe
-            SURPS_LIST = []
-            for SES, CSV in SURPS:
-                path = f"{self.DATA_DIR}/IMAGEN_RAW/2.7/{SES}/psytools/{CSV}"
-                DF = pd.read_csv(path, low_memory=False)
-                DF['ID'] = DF['User code'] if SES=='FU3' else DF['User code'].apply(lambda x : int(x[:12]))
-                DF['Session'] = SES
-                DF2 = DF[ROI]
-                SURPS_LIST.append(DF2)
-            SURPS = pd.concat(SURPS_LIST)
-            # Rename the columns
-            DF3 = SURPS.rename(
-                columns = {
-                    "as_mean" : "Anxiety Sensitivity mean",
-                    "h_mean"  : "Hopelessness mean",
-                    "imp_mean": "Impulsivity mean",
-                    "ss_mean" : "Sensation seeking mean",
-                }
-            )
-            
+
         if DATA == "TCI":
-            # Set the files with session and roi columns
-            TCI = [
-                ('FU3','IMAGEN-IMGN_TCI_FU3.csv'),
-                ('FU2','IMAGEN-IMGN_TCI_CHILD_FU2-IMAGEN_DIGEST.csv'),
-                ('FU1','IMAGEN-IMGN_TCI_CHILD_FU_RC5-IMAGEN_DIGEST.csv'),
-                ('BL','IMAGEN-IMGN_TCI_CHILD_RC5-IMAGEN_DIGEST.csv')
-            ]
             ROI = ['ID','Session','tci_excit','tci_imp','tci_extra','tci_diso','tci_novseek']
-            # Generate the instrument files in one dataframe
-            TCI_LIST = []
-            for SES, CSV in TCI:
-                path = f"{self.DATA_DIR}/IMAGEN_RAW/2.7/{SES}/psytools/{CSV}"
-                DF = pd.read_csv(path, low_memory=False)
-                DF['ID'] = DF['User code'] if SES=='FU3' else DF['User code'].apply(lambda x : int(x[:12]))
-                DF['Session'] = SES
-                DF2 = DF[ROI]
-                TCI_LIST.append(DF2)
-            TCI = pd.concat(TCI_LIST)
-            # Rename the columns
-            DF3 = TCI.rename(
-                columns = {
-                    "tci_excit" : "Exploratory excitability vs. Stoic rigidity",
-                    "tci_imp"  : "Impulsiveness vs. Reflection",
-                    "tci_extra": "Extravagance vs. Reserve",
-                    "tci_diso" : "Disorderliness vs. Regimentation",
-                    "tci_novseek" : "Total Novelty Seeking score"
-                }
-            )
-            
+
         if DATA == 'BSI':
-            # Set the files with session and roi columns
-            BSI = [
-                ('FU3','IMAGEN-IMGN_BSI_FU3.csv'),
-                ('FU2','IMAGEN-IMGN_BSI_FU3.csv'),
-                ('FU1','IMAGEN-IMGN_BSI_FU3.csv'),
-                ('BL','IMAGEN-IMGN_BSI_FU3.csv')
-            ]
-            ROI = ['ID','Session','Somatization mean','Obsession-Compulsion mean','Interpersonal Sensitivity mean',
-                   'Depression mean','Anxiety mean','Hostility mean','Phobic Anxiety mean','Paranoid Ideation mean',
-                   'Psychoticism mean','Positive Symptom Distress Index','Global Severity Index']
-            # Generate the columns
-            ## Somatization
-            Somatization = ['BSI_02','BSI_07','BSI_23','BSI_29','BSI_30','BSI_33','BSI_37']
-            ## Obsession-Compulsion
-            Obsession_compulsion = ['BSI_05','BSI_15','BSI_26','BSI_27','BSI_32','BSI_36']
-            ## Interpersonal Sensitivity
-            Interpersonal_sensitivity = ['BSI_20','BSI_21','BSI_22','BSI_42']
-            ## Depression
-            Depression = ['BSI_09','BSI_16','BSI_17','BSI_18','BSI_35','BSI_50']
-            ## Anxiety
-            Anxiety = ['BSI_01','BSI_12','BSI_19','BSI_38','BSI_45','BSI_49']
-            ## Hostility
-            Hostility = ['BSI_06','BSI_13','BSI_40','BSI_41','BSI_46']
-            ## Phobic Anxiety
-            Phobic_anxiety = ['BSI_08','BSI_28','BSI_31','BSI_43','BSI_47']
-            ## Paranoid Ideation
-            Paranoid_ideation = ['BSI_04','BSI_10','BSI_24','BSI_48','BSI_51']
-            ## Psychoticism
-            Psychoticism = ['BSI_03','BSI_14','BSI_34','BSI_44','BSI_53']
-            BSI_labels = ['ID','Session']+Somatization+Obsession_compulsion+\
-                         Interpersonal_sensitivity+Depression+Anxiety+\
-                         Hostility+Phobic_anxiety+Paranoid_ideation+Psychoticism
-            
-            # Generate the instrument files in one dataframe
-            BSI_LIST = []
-            for SES, CSV in BSI:
-                path = f"{self.DATA_DIR}/IMAGEN_RAW/2.7/FU3/psytools/{CSV}"
-                DF = pd.read_csv(path, low_memory=False)
-                DF['ID'] = DF['User code']
-                DF['Session'] = SES
-                # Rename the values
-                DF2 = DF[BSI_labels].replace(
-                    {'0': 0, '1': 1, '2': 2,'3': 3, '4': 4, '5': 5,'6': 6,'R':np.NaN}
-                )
-                DF2 = DF2.dropna()
-                DF2['Somatization mean'] = DF2[Somatization].mean(axis=1,skipna=False)
-                DF2['Obsession-Compulsion mean'] = DF2[Obsession_compulsion].mean(axis=1,skipna=False)
-                DF2['Interpersonal Sensitivity mean'] = DF2[Interpersonal_sensitivity].mean(axis=1,skipna=False)
-                DF2['Depression mean'] = DF2[Depression].mean(axis=1,skipna=False)
-                DF2['Anxiety mean'] = DF2[Anxiety].mean(axis=1,skipna=False)
-                DF2['Hostility mean'] = DF2[Hostility].mean(axis=1,skipna=False)
-                DF2['Phobic Anxiety mean'] = DF2[Phobic_anxiety].mean(axis=1,skipna=False)
-                DF2['Paranoid Ideation mean'] = DF2[Paranoid_ideation].mean(axis=1,skipna=False)
-                DF2['Psychoticism mean'] = DF2[Psychoticism].mean(axis=1,skipna=False)
-                DF2['Positive Symptom Distress Index'] = DF2[BSI_labels[2:]].sum(axis=1,skipna=False)
-                DF2['Global Severity Index'] = DF2[BSI_labels[2:]].mean(axis=1,skipna=False)
-                DF2 = DF2[ROI]
-                BSI_LIST.append(DF2)
-            BSI = pd.concat(BSI_LIST)
-            DF3 = BSI
-        
-        if DATA == "KIRBY":
-            # Set the files with session and roi columns
-            pass
-        
-        if DATA == "BIS":
-            pass
-        
-        if DATA == "CSI":
-            pass
-        
-        if DATA == "PHQ":
-            pass
-        
-        if DATA == "CES":
-            pass
-        
-        if DATA == "ANXDX":
-            pass
-        
-        if DATA == "CAPE":
-            pass
-        
-        if DATA == "SDQ":
-            pass
-        
-        if DATA == "IRI":
-            pass
-        
-        if DATA == "RRS":
-            pass
-        
-        if DATA == "PALP":
-            pass
-        
+            ROI = ['ID','Session',*SCALES['BSI']]
+            # Rename the values: 'R' to np.NaN
+            DF = DF[['ID','Session',*BSI_ITEMS]]
+            for COL in BSI_ITEMS:
+                DF[COL] = pd.to_numeric(DF[COL].astype(object), errors='coerce')
+            DF = DF.dropna()
+            DF = pd.concat([DF, score(DF, 'BSI')], axis=1)
+
         # ----------------------------------------------------- #
         # ROI Columns: Sociial profile                          #
         # ----------------------------------------------------- #
-#         if DATA == "CTQ":
-#             # Set the files with session and roi columns
-#             CTQ = [
-#                 ('FU3','IMAGEN-IMGN_CTQ_CHILD_FU2-IMAGEN_DIGEST.csv'),
-#                 ('FU2','IMAGEN-IMGN_CTQ_CHILD_FU2-IMAGEN_DIGEST.csv'),
-#                 ('FU1','IMAGEN-IMGN_CTQ_CHILD_FU2-IMAGEN_DIGEST.csv'),
-#                 ('BL', 'IMAGEN-IMGN_CTQ_CHILD_FU2-IMAGEN_DIGEST.csv')
-#             ]
-#             ROI = ['ID','Session','ea_sum','pa_sum','sa_sum','en_sum','pn_sum','dn_sum']
-#             # Set the columns for computation
-#             emot_abu = ['CTQ_3','CTQ_8','CTQ_14','CTQ_18','CTQ_25']
-#             phys_abu = ['CTQ_9','CTQ_11','CTQ_12','CTQ_15','CTQ_17']
-#             sexual_abu = ['CTQ_20','CTQ_21','CTQ_23','CTQ_24','CTQ_27']
-#             emot_neg = ['CTQ_5','CTQ_7','CTQ_13','CTQ_19','CTQ_28']
-#             phys_neg = ['CTQ_1','CTQ_2','CTQ_4','CTQ_6','CTQ_26']
-#             denial = ['CTQ_10','CTQ_16','CTQ_22']
-#             # Generate the instrument files in one dataframe
-#             CTQ_LIST = []
-#             for SES, CSV in CTQ:
-#                 path = f"{self.DATA_DIR}/IMAGEN_RAW/2.7/FU2/psytools/{CSV}"
-#                 DF = pd.read_csv(path, low_memory=False)
-#                 DF['ID'] = DF['User code'].apply(lambda x : int(x[:12]))
-#                 DF['Session'] = SES
-#                 DF['ea_sum'] = DF[emot_abu].sum(axis=1,skipna=False)
-#                 DF['pa_sum'] = DF[phys_abu].sum(axis=1,skipna=False)
-#                 DF['sa_sum'] = DF[sexual_abu].sum(axis=1,skipna=False)
-#                 DF['en_sum'] = DF[emot_neg].sum(axis=1,skipna=False)
-#                 DF['pn_sum'] = DF[phys_neg].sum(axis=1,skipna=False)
-#                 DF['dn_sum'] = DF[denial].sum(axis=1, skipna=False)
-#                 DF2 = DF[ROI]
-#                 CTQ_LIST.append(DF2)
-#             CTQ = pd.concat(CTQ_LIST)
-#             # Rename the columns
-#             DF3 = CTQ.rename(
-#                 columns = {
-#                     "ea_sum" : "Emotional abuse sum",
-#                     "pa_sum" : "Physical abuse sum",
-#                     "sa_sum" : "Sexual abuse sum",
-#                     "en_sum" : "Emotional neglect sum",
-#                     "pn_sum" : "Physical neglect sum",
-#                     "dn_sum" : "Denial sum"
-#                 }
-#             )
-            
         if DATA == "CTQ_MD":
-            # Set the files with session and roi columns
-            CTQ = [
-                ('FU3','IMAGEN-IMGN_CTQ_CHILD_FU2-IMAGEN_DIGEST.csv'),
-                ('FU2','IMAGEN-IMGN_CTQ_CHILD_FU2-IMAGEN_DIGEST.csv'),
-                ('FU1','IMAGEN-IMGN_CTQ_CHILD_FU2-IMAGEN_DIGEST.csv'),
-                ('BL', 'IMAGEN-IMGN_CTQ_CHILD_FU2-IMAGEN_DIGEST.csv')
-            ]
-            ROI = ['ID','Session','ea_sum','pa_sum','sa_sum','en_sum','pn_sum',
-                   'dn_sum','md1','md2','md3']
-            # Set the columns for computation
-            emot_abu = ['CTQ_3','CTQ_8','CTQ_14','CTQ_18','CTQ_25']
-            phys_abu = ['CTQ_9','CTQ_11','CTQ_12','CTQ_15','CTQ_17']
-            sexual_abu = ['CTQ_20','CTQ_21','CTQ_23','CTQ_24','CTQ_27']
-            emot_neg = ['CTQ_5','CTQ_7','CTQ_13','CTQ_19','CTQ_28']
-            phys_neg = ['CTQ_1','CTQ_2','CTQ_4','CTQ_6','CTQ_26']
-            denial = ['CTQ_10','CTQ_16','CTQ_22']
-            # Generate the instrument files in one dataframe
-            CTQ_LIST = []
-            for SES, CSV in CTQ:
-                path = f"{self.DATA_DIR}/IMAGEN_RAW/2.7/FU2/psytools/{CSV}"
-                DF = pd.read_csv(path, low_memory=False)
-                DF['ID'] = DF['User code'].apply(lambda x : int(x[:12]))
-                DF['Session'] = SES
-                DF['ea_sum'] = DF[emot_abu].sum(axis=1,skipna=False)
-                DF['pa_sum'] = DF[phys_abu].sum(axis=1,skipna=False)
-                DF['sa_sum'] = DF[sexual_abu].sum(axis=1,skipna=False)
-                DF['en_sum'] = DF[emot_neg].sum(axis=1,skipna=False)
-                DF['pn_sum'] = DF[phys_neg].sum(axis=1,skipna=False)
-                DF['dn_sum'] = DF[denial].sum(axis=1, skipna=False)
-                DF['md1'] = DF['CTQ_10']
-                DF['md2'] = DF['CTQ_16']
-                DF['md3'] = DF['CTQ_22']
-                DF2 = DF[ROI]
-                CTQ_LIST.append(DF2)
-            CTQ = pd.concat(CTQ_LIST)
-            # Rename the columns
-            DF3 = CTQ.rename(
-                columns = {
-                    "ea_sum" : "Emotional abuse sum",
-                    "pa_sum" : "Physical abuse sum",
-                    "sa_sum" : "Sexual abuse sum",
-                    "en_sum" : "Emotional neglect sum",
-                    "pn_sum" : "Physical neglect sum",
-                    "dn_sum" : "Denial sum",
-                    "md1" : "MD 1",
-                    "md2" : "MD 2",
-                    "md3" : "MD 3"
-                }
-            )
+            ROI = ['ID','Session',*SCALES['CTQ_MD'],'md1','md2','md3']
+            DF = pd.concat([DF, score(DF, 'CTQ_MD')], axis=1)
+            DF['md1'] = DF['CTQ_10']
+            DF['md2'] = DF['CTQ_16']
+            DF['md3'] = DF['CTQ_22']
 
         if DATA == "CTS":
-            # Set the files with session and roi columns
-            CTS = [
-                ('FU3','IMAGEN-IMGN_CTS_PARENT_RC5-BASIC_DIGEST.csv'),
-                ('FU2','IMAGEN-IMGN_CTS_PARENT_RC5-BASIC_DIGEST.csv'),
-                ('FU1','IMAGEN-IMGN_CTS_PARENT_RC5-BASIC_DIGEST.csv'),
-                ('BL', 'IMAGEN-IMGN_CTS_PARENT_RC5-BASIC_DIGEST.csv')
-            ]
             ROI = [
                 'ID','Session','cts_assault','cts_injury','cts_negotiation',
                 'cts_psychological_aggression','cts_sexual_coercion'
             ]
-            # Generate the instrument files in one dataframe
-            CTS_LIST = []
-            for SES, CSV in CTS:
-                path = f"{self.DATA_DIR}/IMAGEN_RAW/2.7/BL/psytools/{CSV}"
-                DF = pd.read_csv(path, low_memory=False)
-                DF['ID'] = DF['User code'].apply(lambda x : int(x[:12]))
-                DF['Session'] = SES
-                DF2 = DF[ROI]
-                CTS_LIST.append(DF2)
-            CTS = pd.concat(CTS_LIST)
-            # Rename the columns
-            DF3 = CTS.rename(
-                columns = {
-                    "cts_assault"                  : "Assault mean",
-                    "cts_injury"                   : "Injury mean",
-                    "cts_negotiation"              : "Negotiation mean",
-                    "cts_psychological_aggression" : "Psychological Aggression mean",
-                    "cts_sexual_coercion"          : "Sexual Coercion mean"
-                }
-            )
-            
+
         if DATA == "PANAS":
-            # Set the files with session and roi columns
-            PANAS = [
-                ('FU3','IMAGEN-IMGN_PANAS_FU3.csv'),
-                ('FU2','IMAGEN-IMGN_PANAS_FU3.csv'),
-                ('FU1','IMAGEN-IMGN_PANAS_FU3.csv'),
-                ('BL','IMAGEN-IMGN_PANAS_FU3.csv')
-            ]
-            ROI = ['ID','Session','Positive Affect Score','Negative Affect Score']
-            # Set the columns for computation
-            panas_pas = ['PANAS_01','PANAS_03','PANAS_05','PANAS_09','PANAS_10',
-                         'PANAS_12','PANAS_14','PANAS_16','PANAS_17','PANAS_19']
-            panas_nas = ['PANAS_02','PANAS_04','PANAS_06','PANAS_07','PANAS_08',
-                         'PANAS_11','PANAS_13','PANAS_15','PANAS_18','PANAS_20']
-            # Generate the instrument files in one dataframe
-            PANAS_LIST=[]
-            for SES, CSV in PANAS:
-                path = f"{self.DATA_DIR}/IMAGEN_RAW/2.7/FU3/psytools/{CSV}"
-                DF = pd.read_csv(path, low_memory=False)
-                DF['ID'] = DF['User code']
-                DF['Session'] = SES
-                DF['Positive Affect Score'] = DF[panas_pas].sum(axis=1,skipna=False)
-                DF['Negative Affect Score'] = DF[panas_nas].sum(axis=1,skipna=False)
-                DF2 = DF[ROI]
-                PANAS_LIST.append(DF2)
-            PANAS = pd.concat(PANAS_LIST)
-            DF3 = PANAS
-        
-        if DATA == "MINI5":
-            pass
+            ROI = ['ID','Session',*SCALES['PANAS']]
+            DF = pd.concat([DF, score(DF, 'PANAS')], axis=1)
+
+        # ----------------------------------------------------- #
+        # ROI Columns: Substance use profile                    #
+        # ----------------------------------------------------- #
+        if DATA == "MAST":
+            ROI = ['ID','Session','MAST flag','MAST total','MAST Alcohol dependency symptoms','MAST sum']
+            # Rename the values
+            DF['MAST total'] = DF['mast_total']
+            DF['MAST Alcohol dependency symptoms'] = DF['mast_dsm']
+            DF['MAST sum'] = DF['mast_sum']
+            DF['MAST flag'] = decode(DF['mast_sum'], CODEBOOK['MAST']['mast_sum'])
+
+        if DATA == "FTND":
+            ROI = ['ID','Session','Likelihood of nicotine dependence child','FTND Sum']
+            # Rename the values
+            DF['Likelihood of nicotine dependence child'] = decode(
+                DF['ftnd_sum'], CODEBOOK['FTND']['ftnd_sum'])
+            DF['FTND Sum'] = DF['ftnd_sum']
+
+        DF2 = DF[ROI]
+        return DF2
+
+    def concat_SESSION(self, DATA, LIST):
+        """ Concatenate the sessions of the instrument in one dataframe
+
+        Parameters
+        ----------
+        DATA : string,
+            instrument name
+        LIST : list
+            pandas.dataframe of each session, in the order of PSYTOOLS[DATA]
+
+        Returns
+        -------
+        DF3 : pandas.dataframe
+            instrument in all session (BL, FU1, FU2, FU3),
+            sorted by ID and Session
+
+        Notes
+        -----
+        Session is an ordered categorical (BL, FU1, FU2, FU3), the decoded
+        answers are categoricals in the code-book order and the float
+        scores are float32 where it is lossless.
+
+        """
+        DF3 = pd.concat(LIST)
+        # Exclude the (ID, Session) rows and sort by the subject key
+        DF3 = sort_KEY(exclude(DF3, EXCLUDE.get(DATA, [])))
+        DF3['Session'] = to_SESSION(DF3['Session'])
+        DF3 = compact(DF3)
+
+        if DATA in RENAME:
+            # Rename the columns
+            DF3 = DF3.rename(columns = RENAME[DATA])
+        return DF3
+
+    def get_MANIFEST(self, DATA):
+        """ Generate the manifest of the derived instrument file
+
+        Parameters
+        ----------
+        DATA : string,
+            instrument name
+
+        Returns
+        -------
+        MANIFEST : dictionary
+            output path, storage format, code-book version and
+            [size, mtime] of each raw psytools file of the instrument
+
+        Examples
+        --------
+        >>> from imagen_posthocloader import *
+        >>> DATA = INSTRUMENT_loader()
+        >>> MANIFEST = DATA.get_MANIFEST(
+        ...     'NEO')                          # INSTRUMENT
+
+        """
+        save_path = f"{self.DATA_DIR}/posthoc/all_{DATA}{EXT[self.FORMAT]}"
+        SOURCE = {}
+        for SES, DIR, CSV in PSYTOOLS[DATA]:
+            path = f"{self.DATA_DIR}/IMAGEN_RAW/2.7/{DIR}/psytools/{CSV}"
+            STAT = os.stat(path)
+            SOURCE[path] = [STAT.st_size, STAT.st_mtime_ns]
+        MANIFEST = {
+            'output' : save_path,
+            'format' : self.FORMAT,
+            'codebook' : CODEBOOK_VERSION,
+            'sources' : SOURCE
+        }
+        return MANIFEST
+
+    def set_INSTRUMENT(self, DATA, save=False, update=False):
+        """ Save all session instrument in one file
+
+        Parameters
+        ----------
+        DATA : string,
+            instrument name
+        save : boolean,
+            save the pandas.dataframe to .csv file
+        update : boolean, optional
+            load the saved file instead if its manifest is up to date
+
+        Returns
+        -------
+        DF3 : pandas.dataframe
+            instrument in all session (BL, FU1, FU2, FU3)
 
-        # ----------------------------------------------------- #
-        # ROI Columns: Substance use profile                    #
-        # ----------------------------------------------------- #
-        if DATA == "MAST":
-            # Set the files with session and roi columns
-            MAST = [
-                ('FU3','IMAGEN-IMGN_MAST_FU3.csv'),
-                ('FU2','IMAGEN-IMGN_MAST_CHILD_FU2-IMAGEN_DIGEST.csv'),
-                ('FU1','IMAGEN-IMGN_MAST_PARENT_FU_RC5-BASIC_DIGEST.csv'),
-                ('BL','IMAGEN-IMGN_MAST_PARENT_RC5-BASIC_DIGEST.csv')
-            ]
-            ROI = ['ID','Session','MAST flag','MAST total','MAST Alcohol dependency symptoms','MAST sum']
-            # Generate the columns
-            def flag(x):
-                if (x > 4): return 'positive alchololism screening'
-                else: return 'negative alchololism screening'
-            # Generate the instrument files in one dataframe
-            MAST_LIST = []
-            for SES, CSV in MAST:
-                path = f"{self.DATA_DIR}/IMAGEN_RAW/2.7/{SES}/psytools/{CSV}"
-                DF = pd.read_csv(path, low_memory=False)
-                DF['ID'] = DF['User code'] if SES=='FU3' else DF['User code'].apply(lambda x : int(x[:12]))
-                DF['Session'] = SES
-                # Renmae the values
-                DF['MAST total'] = DF['mast_total']
-                DF['MAST Alcohol dependency symptoms'] = DF['mast_dsm']
-                DF['MAST sum'] = DF['mast_sum']
-                DF['MAST flag'] = DF['mast_sum'].apply(flag)
-                DF2 = DF[ROI]
-                MAST_LIST.append(DF2)
-            MAST = pd.concat(MAST_LIST)
-            DF3 = MAST
+        Examples
+        --------
+        >>> from imagen_posthocloader import *
+        >>> DATA = INSTRUMENT_loader()
+        >>> DF3 = DATA.set_INSTRUMENT(
+        ...     'NEO',                          # INSTRUMENT
+        ...     save = True)                    # Save
+        >>> DF_FU3 = DF3.groupby('Session').get_group('FU3')
 
-        if DATA == "FTND":
-            # Set the files with session and roi columns
-            FTND = [
-                ('FU3','IMAGEN-IMGN_ESPAD_FU3.csv'),
-                ('FU2','IMAGEN-IMGN_ESPAD_CHILD_FU2-IMAGEN_DIGEST.csv'),
-                ('FU1','IMAGEN-IMGN_ESPAD_CHILD_FU_RC5-IMAGEN_DIGEST.csv'),
-                ('BL','IMAGEN-IMGN_ESPAD_CHILD_RC5-IMAGEN_DIGEST.csv')
-            ]
-            ROI = ['ID','Session','Likelihood of nicotine dependence child','FTND Sum']
-            # Generate the columns
-            def test(x):
-                if (7<=x and x <=10): return 'highly dependent'
-                elif (4<=x and x <=6): return 'moderately dependent'
-                elif (x<4): return 'less dependent'
-                else: return np.NaN
-            # Generate the instrument files in one dataframe
-            FTND_LIST = []
-            for SES, CSV in FTND:
-                path = f"{self.DATA_DIR}/IMAGEN_RAW/2.7/{SES}/psytools/{CSV}"
-                DF = pd.read_csv(path, low_memory=False)
-                DF['ID'] = DF['User code'] if SES=='FU3' else DF['User code'].apply(lambda x : int(x[:12]))
-                DF['Session'] = SES
-                # Rename the values
-                DF['Likelihood of nicotine dependence child'] = DF['ftnd_sum'].apply(test)
-                DF['FTND Sum'] = DF['ftnd_sum']
-                DF2 = DF[ROI]
-                FTND_LIST.append(DF2)
-            FTND = pd.concat(FTND_LIST)
-            DF3 = FTND
-
-        if DATA == "DAST":
-            # Set the files with session and roi columns
-            DAST = [
-                
-            ]
-            # Generate the columns
-            
-            # Generate the instrument files in one dataframe
-#             if SESSION == 'FU3':
-#                 Variables = ['sex', 'site', 'class']
-#                 DATA_DF = self.NEW_DF[Variables]
-#                 return Variables, DATA_DF
-#             if 'DAST' == self.DATA: # 'DAST'
-#                 self.VARIABLES, self.NEW_DF2 = DAST_SESSION(self.SESSION)
-            pass
-
-        if DATA == "SCID":
-            # Set the files with session and roi columns
-            
-            # Generate the columns
-            
-            # Generate the instrument files in one dataframe
-#         def SCID_SESSION(SESSION):
-#             if SESSION == 'FU3':
-#                 Variables = ['sex', 'site', 'class']
-#                 DATA_DF = self.NEW_DF[Variables]
-#                 return Variables, DATA_DF
-#             if 'SCID' == self.DATA: # 'SCID'
-#                 self.VARIABLES, self.NEW_DF2 = SCID_SESSION(self.SESSION)
-            pass
-
-        if DATA == "DMQ":
-            # Set the files with session and roi columns
-            
-            # Generate the columns
-            
-            # Generate the instrument files in one dataframe
-#             if SESSION == 'FU3':
-#                 Variables = ['sex', 'site', 'class']
-#                 DATA_DF = self.NEW_DF[Variables]
-#                 return Variables, DATA_DF
-#             if 'DMQ' == self.DATA: # 'DMQ'
-#                 self.VARIABLES, self.NEW_DF2 = DMQ_SESSION(self.SESSION)
-            pass
-
-        if DATA == "BULLY":
-            pass
-
-        if DATA == "ESPAD":
-            pass
-        
-        if DATA == "TLFB":
-            pass
-
-        if DATA == "AUDIT":
-            # Set the files with session and roi columns
-            
-            # Generate the columns
-            
-            # Generate the instrument files in one dataframe
-#             if SESSION == 'FU3':
-#                 Variables = ['sex', 'site', 'class']
-#                 DATA_DF = self.NEW_DF[Variables]
-#                 return Variables, DATA_DF
-#         elif 'AUDIT' == self.DATA: # 'AUDIT'
-#             self.VARIABLES, self.NEW_DF2 = AUDIT_SESSION(self.SESSION)
-            pass
+        Notes
+        -----
+        If only one session has information,
+        the same value is copied to all sessions based on ID.
+        (e.g. CTQ[FU2], CTS[BL], PBQ[BL,FU1], BSI[FU3], PANAS[FU3])
 
-        if save == True:
-            save_path = f"{self.DATA_DIR}/posthoc/all_{DATA}.csv"
-            # set the save option
-            if not os.path.isdir(os.path.dirname(save_path)):
-                os.makedirs(os.path.dirname(save_path))
-            DF3.to_csv(save_path, index=None)
+        """
+        # Generate the instrument files in one dataframe
+        DF3 = self.build_instruments([DATA], save=save, update=update)[DATA]
         return DF3
 
-    def get_INSTRUMENT(self, instrument_file):
+    def build_instruments(self, LIST, n_jobs=1, save=False, update=False):
+        """ Save all session of several instruments in parallel
+
+        Parameters
+        ----------
+        LIST : list
+            instrument name list
+        n_jobs : integer, optional
+            number of worker processes, -1 uses all the cores
+        save : boolean,
+            save each pandas.dataframe to all_{DATA}.csv file
+        update : boolean, optional
+            rebuild only the instruments whose manifest is out of date,
+            the others are loaded from the saved file
+
+        Returns
+        -------
+        DICT : dictionary
+            instrument name to the instrument in all session
+
+        Examples
+        --------
+        >>> from imagen_posthocloader import *
+        >>> DATA = INSTRUMENT_loader()
+        >>> DICT = DATA.build_instruments(
+        ...     ['NEO','SURPS','PBQ','GEN'],    # INSTRUMENT
+        ...     n_jobs = 8,                     # Processes
+        ...     save = True,                    # Save
+        ...     update = True)                  # Skip the up to date
+        >>> NEO = DICT['NEO']
+
+        Notes
+        -----
+        Each raw file is one task of the pool: the instruments reading it
+        are decoded in the same worker, so the file is parsed once there,
+        and the sessions sharing the raw file are relabeled copies.
+        The rows are sorted by ID and Session (BL, FU1, FU2, FU3).
+
+        The manifest posthoc/manifest/all_{DATA}.json is written with each
+        saved file. It is up to date when the output exists and the format,
+        the CODEBOOK_VERSION and the size and mtime of the raw files match.
+        A loaded file gets the dtypes of a built one, see restore.
+
+        """
+        DICT = {}
+        MANIFEST = {}
+        for DATA in LIST:
+            MANIFEST[DATA] = self.get_MANIFEST(DATA)
+            manifest_path = f"{self.DATA_DIR}/posthoc/manifest/all_{DATA}.json"
+            if (update == True) and os.path.isfile(manifest_path) \
+                    and os.path.isfile(MANIFEST[DATA]['output']):
+                with open(manifest_path) as f:
+                    if json.load(f) == MANIFEST[DATA]:
+                        DICT[DATA] = restore(
+                            read_TABLE(MANIFEST[DATA]['output']), DATA)
+
+        # One task per raw file with the instruments reading it, the rows
+        # are relabeled per session below
+        FILE = {}
+        for DATA in LIST:
+            if DATA in DICT:
+                continue
+            for SES, DIR, CSV in PSYTOOLS[DATA]:
+                FILE.setdefault((DIR, CSV), {})[DATA] = SES
+        TASK = [(self.DATA_DIR, DIR, CSV, list(JOB.items()))
+                for (DIR, CSV), JOB in FILE.items()]
+        if n_jobs == -1:
+            n_jobs = os.cpu_count()
+        if (n_jobs == 1) or (len(TASK) <= 1):
+            RESULT = [_set_SESSION(i) for i in TASK]
+        else:
+            with ProcessPoolExecutor(max_workers=min(n_jobs, len(TASK))) as pool:
+                RESULT = list(pool.map(_set_SESSION, TASK))
+
+        RAW_DF = {(DATA, DIR, CSV): DF
+                  for (_, DIR, CSV, JOB), LIST_DF in zip(TASK, RESULT)
+                  for (DATA, _), DF in zip(JOB, LIST_DF)}
+        for DATA in LIST:
+            if DATA in DICT:
+                continue
+            SESSION = [RAW_DF[(DATA, DIR, CSV)].assign(Session=SES)
+                       for SES, DIR, CSV in PSYTOOLS[DATA]]
+            DF3 = self.concat_SESSION(DATA, SESSION)
+            if save == True:
+                save_path = f"{self.DATA_DIR}/posthoc/all_{DATA}.csv"
+                write_TABLE(DF3, save_path, self.FORMAT)
+                manifest_path = f"{self.DATA_DIR}/posthoc/manifest/all_{DATA}.json"
+                if not os.path.isdir(os.path.dirname(manifest_path)):
+                    os.makedirs(os.path.dirname(manifest_path))
+                with open(manifest_path, 'w') as f:
+                    json.dump(MANIFEST[DATA], f, indent=4)
+            DICT[DATA] = DF3
+        return {DATA: DICT[DATA] for DATA in LIST}
+
+    def get_INSTRUMENT(self, instrument_file, columns=None):
         """ Load the INSTRUMENT file
         
         Parameters
         ----------            
         instrument_file : string
             The IMAGEN's instrument file (*.csv)
+        columns : list, optional
+            columns to read, None reads all the columns
 
         Returns
         -------
@@ -822,7 +2228,7 @@ class INSTRUMENT_loader:
         """
         # Load the instrument file       
         instrument_path = f"{self.DATA_DIR}/posthoc/{instrument_file}"
-        DF = pd.read_csv(instrument_path, low_memory=False)
+        DF = read_TABLE(instrument_path, columns)
         return DF
 
 #     def __str__(self):
@@ -835,28 +2241,92 @@ class INSTRUMENT_loader:
 #             print(f"{'-'*83} \n{self.__str__()} \n{'-'*83}")
 #             print(f"{self.NEW_DF.info(), self.NEW_DF.describe()}")
 
+def _set_SESSION(TASK):
+    """ Read and decode the instruments of one raw file in a worker process """
+    DATA_DIR, DIR, CSV, JOB = TASK
+    LOADER = INSTRUMENT_loader(DATA_DIR)
+    return [LOADER.set_SESSION(DATA, SES, DIR, CSV) for DATA, SES in JOB]
+
 class HDF5_loader:
-    def __init__(self, DATA_DIR="/ritter/share/data/IMAGEN"):
+    def __init__(self, DATA_DIR="/ritter/share/data/IMAGEN", FORMAT="csv"):
         """ Set up path
         
         Parameters
         ----------
         DATA_DIR : string, optional
             Directory IMAGEN absolute path
+        FORMAT : string, optional
+            storage format of the saved files: csv, parquet or feather
         
         """
         # Set the directory path: IMAGEN
-        self.DATA_DIR = DATA_DIR    
+        self.DATA_DIR = DATA_DIR
+        self.FORMAT = FORMAT
+
+    def set_LABEL(self, DATA, SES, DATASET, H5):
+        """ Read the subjects and labels of one h5 file
+
+        Parameters
+        ----------
+        DATA : string,
+            y name, the label dataset of the h5 file
+        SES : string,
+            session label of the rows (BL, FU1, FU2, FU3)
+        DATASET : string,
+            Training or Holdout
+        H5 : string,
+            h5 file name in h5files
+
+        Returns
+        -------
+        DF2 : pandas.dataframe
+            ID, Session, y, Dataset, Sex, Site and Class of the h5 file
+
+        Examples
+        --------
+        >>> from imagen_posthocloader import *
+        >>> DATA = HDF5_loader()
+        >>> DF2 = DATA.set_LABEL(
+        ...     'Binge',                        # y
+        ...     *H5FILES['Binge'][0])           # SES, DATASET, H5
+
+        Notes
+        -----
+        The datasets are read as arrays and the codes are mapped to the
+        names by position: SEX, SITE and CLASSES[DATA]. A sex code other
+        than 0 is Female, a site or label value out of the names raises
+        ValueError, see categorize.
+
+        """
+        path = f"{self.DATA_DIR}/h5files/{H5}"
+        with h5py.File(path, 'r') as d:
+            ID = d['i'][()]
+            SEX_CODE = d['sex'][()]
+            SITE_CODE = d['site'][()]
+            LABEL = d[DATA][()]
+        DF2 = pd.DataFrame({
+            "ID" : ID,
+            "Session" : SES,
+            "y" : DATA,
+            "Dataset" : DATASET,
+            "Sex" : pd.Categorical.from_codes(
+                (SEX_CODE != 0).astype(np.int8), SEX),
+            "Site" : categorize(SITE_CODE, SITE, f"{H5} site"),
+            "Class" : categorize(LABEL, CLASSES[DATA], f"{H5} {DATA}")
+        })
+        return DF2
 
-    def set_HDF5(self, DATA, save=False):
+    def set_HDF5(self, DATA, save=False, n_jobs=-1):
         """ Save all session y in one file
         
         Parameters
         ----------
         DATA : string,
-            y name
+            y name, a key of H5FILES and CLASSES
         save : boolean,
             save the pandas.dataframe to .csv file
+        n_jobs : integer, optional
+            number of threads reading the h5 files, -1 reads all at once
             
         Returns
         -------
@@ -875,70 +2345,33 @@ class HDF5_loader:
         Notes
         -----
         There are no session in FU2 for imaging file
-        y = {Binge} # Other y can be added as if
+        y = {Binge} # Other y is one entry in H5FILES and CLASSES
         
         """
-        if DATA == "Binge":
-            # Set the files with session and roi columns
-            BINGE = [
-                ('FU3','Training','newlbls-clean-fu3-espad-fu3-19a-binge-n650.h5'),
-                ('FU3','Holdout', 'newholdout-clean-fu3-espad-fu3-19a-binge-n102.h5'),
-                ('FU2','Training','newlbls-clean-fu2-espad-fu3-19a-binge-n634.h5'),
-                ('FU2','Holdout', 'newholdout-clean-fu2-espad-fu3-19a-binge-n102.h5'),
-                ('BL', 'Training','newlbls-clean-bl-espad-fu3-19a-binge-n620.h5'),
-                ('BL', 'Holdout', 'newholdout-clean-bl-espad-fu3-19a-binge-n102.h5')
-            ]
-            ROI = ['ID','Session','y','Dataset','Sex','Site','Class']
-            # Generate the instrument files in one dataframe
-            BINGE_LIST = []
-            for SES, DATASET, HDF5 in BINGE:
-                path = f"{self.DATA_DIR}/h5files/{HDF5}"
-                # Convert HDF5 to List
-                d = h5py.File(path,'r')
-                # Set All, HC, and AAM
-                b_list = list(np.array(d[list(d.keys())[0]]))
-                ALL = list(np.array(d['i']))
-                HC = [ALL[i] for i, j in enumerate(b_list) if j%2==0]
-                AAM = [ALL[i] for i, j in enumerate(b_list) if j%2==1]
-                # Set Sex
-                sex = list(np.array(d['sex']))
-                SEX = ['Male' if i==0 else 'Female' for i in sex]
-                # Set Site
-                sites = list(np.array(d['site']))
-                center = {0: 'Paris', 1: 'Nottingham', 2:'Mannheim', 3:'London',
-                          4: 'Hamburg', 5: 'Dublin', 6:'Dresden', 7:'Berlin'}
-                SITE = [center[i] for i in sites]
-                # Set Class
-                target = list(np.array(d[list(d.keys())[0]]))
-                CLASS = ['HC' if i==0 else 'AAM' for i in target]
-                # Generate the DF
-                DF2 = pd.DataFrame(
-                    {"ID" : ALL,
-                    "Session" : SES,
-                    "y" : list(d.keys())[0],
-                    "Dataset" : DATASET,
-                    "Sex" : SEX,
-                    "Site" : SITE,
-                    "Class" : CLASS}
-                )
-                BINGE_LIST.append(DF2)
-            DF3 = pd.concat(BINGE_LIST)
+        TASK = [(DATA, SES, DATASET, H5) for SES, DATASET, H5 in H5FILES[DATA]]
+        if n_jobs == -1:
+            n_jobs = len(TASK)
+        if n_jobs == 1:
+            LIST = [self.set_LABEL(*i) for i in TASK]
+        else:
+            with ThreadPoolExecutor(max_workers=min(n_jobs, len(TASK))) as pool:
+                LIST = list(pool.map(lambda i: self.set_LABEL(*i), TASK))
+        DF3 = pd.concat(LIST)
 
         if save == True:
             save_path = f"{self.DATA_DIR}/posthoc/all_{DATA}.csv"
-            # set the save option
-            if not os.path.isdir(os.path.dirname(save_path)):
-                os.makedirs(os.path.dirname(save_path))
-            DF3.to_csv(save_path, index=None)
+            write_TABLE(DF3, save_path, self.FORMAT)
         return DF3
     
-    def get_HDF5(self, hdf5_file):
+    def get_HDF5(self, hdf5_file, columns=None):
         """ Select the ROI y as file
         
         Parameters
         ----------            
         h5df_file : string
             The IMAGEN's instrument file (*.csv)
+        columns : list, optional
+            columns to read, None reads all the columns
 
         Returns
         -------
@@ -961,10 +2394,10 @@ class HDF5_loader:
         """
         # Load the hdf5 file       
         hdf5_path = f"{self.DATA_DIR}/posthoc/{hdf5_file}"
-        DF = pd.read_csv(hdf5_path, low_memory=False)
+        DF = read_TABLE(hdf5_path, columns)
         return DF
 
-    def get_train_data(self, H5_DIR, group=False):
+    def get_train_data(self, H5_DIR, group=False, lazy=False):
         """ Load the train data
         
         Parameters
@@ -973,10 +2406,12 @@ class HDF5_loader:
             Directory saved File path
         group : boolean
             If True then generate the gorup_mask
+        lazy : boolean, optional
+            If True then X is a H5_matrix, read on demand
             
         Returns
         -------
-        self.tr_X : numpy.ndarray
+        self.tr_X : numpy.ndarray or H5_matrix
             Data, hdf5 file
         self.tr_X_col_names : numpy.ndarray
             X features name list
@@ -991,27 +2426,24 @@ class HDF5_loader:
         ...     'H5_DIR')                                  # DATA
         
         """
-        data = h5py.File(self.DATA_DIR+"/h5files/"+H5_DIR, 'r')
-        print(data.keys(), data.attrs.keys())
-        X = data['X'][()]
-        X_col = data.attrs['X_col_names']
-        X_col_names = np.array([i.replace(")","") for i in X_col])
+        path = self.DATA_DIR+"/h5files/"+H5_DIR
+        with H5LOCK:
+            data = open_H5(path)
+            print(data.keys(), data.attrs.keys())
+            X = H5_matrix(path) if lazy == True else data['X'][()]
+        X_col_names, Other = read_META(path, group)
         self.tr_X = X
         self.tr_X_col_names = X_col_names
         
-        y = data[data.attrs['labels'][0]][()]
-        ID = data['i'][()]
-        
         if group == True:
-            sex_mask = data['sex'].astype(bool)[()]
-            class_mask = data['Binge'][()].astype(bool)
-            self.tr_Other = [y, ID, sex_mask, class_mask]
+            sex_mask = Other[2].astype(bool)
+            class_mask = Other[3].astype(bool)
+            self.tr_Other = [Other[0], Other[1], sex_mask, class_mask]
         else:
-            self.tr_Other = [y, ID]
-        X.shape, len(X_col_names)
+            self.tr_Other = Other
         return self.tr_X, self.tr_X_col_names, self.tr_Other
 
-    def get_holdout_data(self, H5_DIR, group=False):
+    def get_holdout_data(self, H5_DIR, group=False, lazy=False):
         """ Load the holdout data
         
         Parameters
@@ -1020,10 +2452,12 @@ class HDF5_loader:
             Directory saved File path
         group : boolean
             If True then generate the gorup_mask
+        lazy : boolean, optional
+            If True then X is a H5_matrix, read on demand
             
         Returns
         -------
-        self.ho_X : numpy.ndarray
+        self.ho_X : numpy.ndarray or H5_matrix
             Data, hdf5 file
         self.ho_X_col_names : numpy.ndarray
             X features name list
@@ -1036,45 +2470,132 @@ class HDF5_loader:
         >>> DATA = HDF5_loader()
         >>> ho_X, ho_X_col_names, ho_Other = DATA.get_train_data(
         ...     'H5_DIR')                                  # DATA
+        >>> ho_X_DTI = DATA.get_holdout_data(
+        ...     'H5_DIR', lazy=True)[0].select('DTI_').to_numpy()
         
         """
-        data = h5py.File(self.DATA_DIR+"/h5files/"+H5_DIR, 'r')
-#         print(data.keys(), data.attrs.keys())
-        X = data['X'][()]
-        X_col = data.attrs['X_col_names']
-        X_col_names = np.array([i.replace(")","") for i in X_col])
+        path = self.DATA_DIR+"/h5files/"+H5_DIR
+        with H5LOCK:
+            data = open_H5(path)
+#             print(data.keys(), data.attrs.keys())
+            X = H5_matrix(path) if lazy == True else data['X'][()]
+        X_col_names, Other = read_META(path, group)
         self.ho_X = X
         self.ho_X_col_names = X_col_names
+        self.ho_Other = Other
+        return self.ho_X, self.ho_X_col_names, self.ho_Other
+
+    def get_META(self, H5_DIR, group=False):
+        """ Load the feature names, labels and IDs without the data
+        
+        Parameters
+        ----------
+        H5_DIR : string
+            Directory saved File path
+        group : boolean
+            If True then generate the gorup_mask
+            
+        Returns
+        -------
+        X_col_names : numpy.ndarray
+            X features name list
+        Other : list
+            at least contain y, ID, numpy.ndarray or other Group mask
+            
+        Examples
+        --------
+        >>> from imagen_posthocloader import *
+        >>> DATA = HDF5_loader()
+        >>> X_col_names, Other = DATA.get_META(
+        ...     'H5_DIR')                                  # DATA
+
+        Notes
+        -----
+        Same names, labels and masks as get_holdout_data, but X is not
+        read and the result is cached per file, see read_META.
         
-        y = data[data.attrs['labels'][0]][()]
-        ID = data['i'][()]
+        """
+        return read_META(self.DATA_DIR+"/h5files/"+H5_DIR, group)
+
+    def get_CATALOGUE(self, H5_DIR):
+        """ Load the feature catalogue
         
-        if group == True:
-            sex_mask = data['sex'][()]
-            class_mask = data['Binge'][()]
-            self.ho_Other = [y, ID, sex_mask, class_mask]
-        else:
-            self.ho_Other = [y, ID]
-        X.shape, len(X_col_names)
-        return self.ho_X, self.ho_X_col_names, self.ho_Other
+        Parameters
+        ----------
+        H5_DIR : string
+            Directory saved File path
+            
+        Returns
+        -------
+        CAT : pandas.dataframe
+            Feature ID, name, Modality, Type, Lobe Region, Hemisphere, Value
+        INDEX : dictionary
+            column to value to the Feature ID array of the group
+            
+        Examples
+        --------
+        >>> from imagen_posthocloader import *
+        >>> DATA = HDF5_loader()
+        >>> CAT, INDEX = DATA.get_CATALOGUE(
+        ...     'H5_DIR')                                  # DATA
+        >>> COR = INDEX['Type']['Cortical region']
+        
+        """
+        return read_CATALOGUE(self.DATA_DIR+"/h5files/"+H5_DIR)
+
+    def get_DATASET(self, DATA='Binge'):
+        """ Index the training and holdout h5 files of all sessions
+        
+        Parameters
+        ----------
+        DATA : string, optional
+            y name, a key of H5FILES
+            
+        Returns
+        -------
+        D : H5_dataset
+            (Session, Dataset, ID) view of the h5 files, read lazily
+            
+        Examples
+        --------
+        >>> from imagen_posthocloader import *
+        >>> DATA = HDF5_loader()
+        >>> D = DATA.get_DATASET('Binge')
+        >>> DF = D.read(ID=[12809392], prefix='DTI_')
+        
+        """
+        return H5_dataset(self.DATA_DIR, DATA)
+
+    def close(self):
+        """ Close the pooled h5 handles, see close_H5 """
+        close_H5()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
     
 #     def __str__(self):
 #         pass
     
 class RUN_loader:
-    def __init__(self, DATA_DIR="/ritter/share/data/IMAGEN"):
+    def __init__(self, DATA_DIR="/ritter/share/data/IMAGEN", FORMAT="csv"):
         """ Set up path
         
         Parameters
         ----------
         DATA_DIR : string, optional
             Directory IMAGEN absolute path
+        FORMAT : string, optional
+            storage format of the saved files: csv, parquet or feather
         
         """
         # Set the directory path: IMAGEN
         self.DATA_DIR = DATA_DIR
+        self.FORMAT = FORMAT
     
-    def set_RUN(self, run_file, save=False):
+    def set_RUN(self, run_file, save=False, star=False):
         """ Save the ML RUN result in one file &
         Generate the RUN classification report for posthoc analysis
         
@@ -1084,11 +2605,17 @@ class RUN_loader:
             ML models result run.csv path
         save : boolean
             if save == True, then save it as .csv
+        star : boolean, optional
+            if star == True, then return and save the run table and the
+            subject prediction table instead of the wide dataframe
         
         Returns
         -------
         DF3 : pandas.dataframe
             The RUN dataframe
+        RUNS, PRED : pandas.dataframe, if star
+            one row per run keyed by run_id, and run_id, dataset, ID,
+            true_label, prediction and Outcome per subject of the run
         
         Examples
         --------
@@ -1097,151 +2624,200 @@ class RUN_loader:
         >>> DF3 = DATA.set_RUN(
         ...     run_file)                              # RUN
         >>> DF_FU3 = DF3.groupby('Session').get_group('fu3')
+        >>> RUNS, PRED = DATA.set_RUN(
+        ...     run_file,                              # RUN
+        ...     star = True)                           # star schema
+        >>> DF3 = join_RUN(RUNS, PRED, ['Session', 'Model'])
+
+        Notes
+        -----
+        Each list column is parsed once for all the runs, the run columns
+        of RUN are repeated by the run index of each subject row and the
+        dataframe is built once, test set then holdout set rows per run.
+        The star tables are saved as all_RUN_runs and all_RUN_predictions,
+        the wide dataframe is join_RUN of both.
+        The outcome is one int8 Outcome code (TN=0, FN=1, FP=2, TP=3, -1
+        not specified) with the VIEWS categoricals, the PROBS columns (TP
+        prob, ...) are derived on demand by derive or get_RUN.
         
         """
         df = pd.read_csv(run_file, low_memory = False)
         
-        DF = []
-        for i in range(len(df)):
-            test_ids = eval(df['test_ids'].values[i])
-            test_lbls = eval(df['test_lbls'].values[i])
-            test_probs = [probs[1] for probs in eval(df['test_probs'].values[i])]
-            holdout_ids = eval(df['holdout_ids'].values[i])
-            holdout_lbls = eval(df['holdout_lbls'].values[i])
-            holdout_preds = [probs[1] for probs in eval(df['holdout_probs'].values[i])]
-            # generate the dataframe
-            DF_TEST = pd.DataFrame({
-                # Model configuration
-                "i" : df.iloc[i][7],
-                "o" : df.iloc[i][8],
-                "io" : df.iloc[i][1],
-                "technique" : df.iloc[i][2],
-                "Session" : df.iloc[i][25],
-                "Trial" : df.iloc[i][4],
-                "path" : df.iloc[i][24],
-                "n_samples" : df.iloc[i][5],
-                "n_samples_cc" : df.iloc[i][6],
-                "i_is_conf" : df.iloc[i][9],
-                "o_is_conf" : df.iloc[i][10],
-                "Model" : df.iloc[i][3],
-                "model_SVM-rbf__C" : df.iloc[i][18],
-                "model_SVM-rbf__gamma" : df.iloc[i][19],
-                "runtime" : df.iloc[i][20],
-                "model_SVM-lin__C" : df.iloc[i][21],
-                "model_GB__learning_rate" : df.iloc[i][22],
-                "model_LR__C" : df.iloc[i][23],
-                # Result
-                "train_score" : df.iloc[i][11],
-                "valid_score" : df.iloc[i][12],
-                "test_score" : df.iloc[i][13],
-                "roc_auc" : df.iloc[i][14],
-                "holdout_score" : df.iloc[i][26],
-                "holdout_roc_auc" : df.iloc[i][27],
-                # Test
-                "dataset" : "Test set",
-                "ID" : test_ids,
-                "true_label" : test_lbls,
-                "prediction" : test_probs,
-            })
-            DF_HOLDOUT = pd.DataFrame({
-                # Model configuration
-                "i" : df.iloc[i][7],
-                "o" : df.iloc[i][8],
-                "io" : df.iloc[i][1],
-                "technique" : df.iloc[i][2],
-                "Session" : df.iloc[i][25],
-                "Trial" : df.iloc[i][4],
-                "path" : df.iloc[i][24],
-                "n_samples" : df.iloc[i][5],
-                "n_samples_cc" : df.iloc[i][6],
-                "i_is_conf" : df.iloc[i][9],
-                "o_is_conf" : df.iloc[i][10],
-                "Model" : df.iloc[i][3],
-                "model_SVM-rbf__C" : df.iloc[i][18],
-                "model_SVM-rbf__gamma" : df.iloc[i][19],
-                "runtime" : df.iloc[i][20],
-                "model_SVM-lin__C" : df.iloc[i][21],
-                "model_GB__learning_rate" : df.iloc[i][22],
-                "model_LR__C" : df.iloc[i][23],
-                # Result
-                "train_score" : df.iloc[i][11],
-                "valid_score" : df.iloc[i][12],
-                "test_score" : df.iloc[i][13],
-                "roc_auc" : df.iloc[i][14],
-                "holdout_score" : df.iloc[i][26],
-                "holdout_roc_auc" : df.iloc[i][27],
-                # Holdout
-                "dataset" : "Holdout set",
-                "ID" : holdout_ids,
-                "true_label" : holdout_lbls,
-                "prediction" : holdout_preds
-            })
-            DF.append(DF_TEST)
-            DF.append(DF_HOLDOUT)
-            
-        # generate the columns
-        DF2 = pd.concat(DF).reset_index(drop=True)
-        
-        TP = (DF2.true_label == 1.0) & (DF2.prediction >= 0.5)
-        TN = (DF2.true_label == 0.0) & (DF2.prediction < 0.5)
-        FP = (DF2.true_label == 0.0) & (DF2.prediction >= 0.5)
-        FN = (DF2.true_label == 1.0) & (DF2.prediction < 0.5)
-        
-        DF2['TP prob'] = DF2[TP]['prediction']
-        DF2['TN prob'] = DF2[TN]['prediction']
-        DF2['FP prob'] = DF2[FP]['prediction']
-        DF2['FN prob'] = DF2[FN]['prediction']
-        DF2['T prob'] = DF2[TP | TN]['prediction']
-        DF2['F prob'] = DF2[FP | FN]['prediction']
-        
-        conditionlist = [
-            (DF2['TP prob'] >= 0.5) ,
-            (DF2['TN prob'] < 0.5) ,
-            (DF2['FP prob'] >= 0.5),
-            (DF2['FN prob'] < 0.5)]
-        choicelist = ['TP', 'TN', 'FP', 'FN']
-        DF2['Prob'] = np.select(conditionlist, choicelist,
-                                default='Not Specified')
-        
-        conditionlist2 = [
-            (DF2['Prob'] == 'TP') | (DF2['Prob'] == 'TN'),
-            (DF2['Prob'] == 'FP') | (DF2['Prob'] == 'FN')]
-        choicelist2 = ['TP & TN', 'FP & FN']
-        DF2['Predict TF'] = np.select(conditionlist2, choicelist2,
-                                      default='Not Specified')
-        
-        conditionlist3 = [
-            (DF2['Prob'] == 'TP') | (DF2['Prob'] == 'FP'),
-            (DF2['Prob'] == 'TN') | (DF2['Prob'] == 'FN')]
-        choicelist3 = ['TP & FP', 'TN & FN']
-        DF2['Model PN'] = np.select(conditionlist3, choicelist3,
-                                    default='Not Specified')
-
-        conditionlist4 = [
-            (DF2['Prob'] == 'TP') | (DF2['Prob'] == 'FN'),
-            (DF2['Prob'] == 'TN') | (DF2['Prob'] == 'FP')]
-        choicelist4 = ['TP & FN', 'TN & FP']
-        DF2['Label PN'] = np.select(conditionlist4, choicelist4,
-                                    default='Not Specified')
+        # run table: one row per run of run.csv
+        RUNS = pd.DataFrame({
+            'run_id' : np.arange(len(df), dtype=np.int32),
+            **{k: df.iloc[:, v].to_numpy() for k, v in RUN.items()}
+        })
         # rename the values may be needed
-        DF2['Session'] = DF2['Session'].map({'bl':'BL',
-                                             'fu1':'FU1',
-                                             'fu2':'FU2',
-                                             'fu3':'FU3'})
+        RUNS['Session'] = RUNS['Session'].map({'bl':'BL',
+                                               'fu1':'FU1',
+                                               'fu2':'FU2',
+                                               'fu3':'FU3'})
+        
+        # list columns: one flat array per set, ROW is the run of each item
+        ROW, LIST = [], {'dataset': [], 'ID': [], 'true_label': [], 'prediction': []}
+        for DATASET, IDS, LBLS, PROBS in RUN_SETS:
+            ID, OFFSETS = parse_LIST(df[IDS])
+            LBL, OFFSETS_LBLS = parse_LIST(df[LBLS])
+            PROB, OFFSETS_PROBS = parse_LIST(df[PROBS])
+            # Same number of ids, labels and probabilities in every run
+            for OTHER in [OFFSETS_LBLS, OFFSETS_PROBS]:
+                if not np.array_equal(OFFSETS, OTHER):
+                    BAD = np.flatnonzero(np.diff(OFFSETS) != np.diff(OTHER))
+                    raise ValueError(f"{IDS}, {LBLS} and {PROBS} have different "
+                                     f"lengths in the run rows {BAD.tolist()}")
+            LIST['ID'].append(ID)
+            LIST['true_label'].append(LBL)
+            LIST['prediction'].append(PROB[:,1])
+            LIST['dataset'].append(np.full(len(ID), DATASET, dtype=object))
+            ROW.append(np.repeat(np.arange(len(df)), np.diff(OFFSETS)))
+        # per run: the test set rows, then the holdout set rows
+        ORDER = np.argsort(np.concatenate(ROW), kind='stable')
+        
+        # subject prediction table
+        PRED = pd.DataFrame({
+            'run_id' : np.concatenate(ROW)[ORDER].astype(np.int32),
+            **{k: np.concatenate(v)[ORDER] for k, v in LIST.items()}
+        })
+        PRED['Outcome'] = outcome(PRED['true_label'], PRED['prediction'])
+        
+        if star == True:
+            PRED['true_label'] = pd.to_numeric(PRED['true_label'],
+                                               downcast='integer')
+            PRED['dataset'] = PRED['dataset'].astype('category')
+            PRED = compact(PRED)
+            if save == True:
+                for NAME, DF in [('runs', RUNS), ('predictions', PRED)]:
+                    save_path = f"{self.DATA_DIR}/posthoc/all_RUN_{NAME}.csv"
+                    write_TABLE(DF, save_path, self.FORMAT)
+            return RUNS, PRED
+        
+        # generate the dataframe: run configuration repeated by index
+        DF2 = join_RUN(RUNS, PRED)
         if save == True:
             save_path = f"{self.DATA_DIR}/posthoc/all_RUN.csv"
-            if not os.path.isdir(os.path.dirname(save_path)):
-                os.makedirs(os.path.dirname(save_path))
-            DF2.to_csv(save_path, index=None)
+            write_TABLE(DF2, save_path, self.FORMAT)
         return DF2
 
-    def get_RUN(self, RUN_file):
+    def build_RUNS(self, PATH, n_jobs=1, save=False, star=False):
+        """ Load the run.csv of several experiments in parallel
+        
+        Parameters
+        ----------
+        PATH : string or list
+            glob pattern(s) of run.csv files or of result directories, the
+            run.csv files under a directory are all loaded
+        n_jobs : integer, optional
+            number of worker processes, -1 uses all the cores
+        save : boolean
+            if save == True, then save each experiment as it is loaded in
+            posthoc/all_RUN, partitioned by experiment
+        star : boolean, optional
+            if star == True, then load the run and prediction tables
+        
+        Returns
+        -------
+        DF3 : pandas.dataframe
+            The RUN dataframe of all the experiments
+        RUNS, PRED : pandas.dataframe, if star
+            run and prediction tables of all the experiments, keyed by
+            (experiment, run_id), the run_id numbered per experiment
+        
+        Examples
+        --------
+        >>> from imagen_posthocloader import *
+        >>> DATA = IMAGEN_posthoc()
+        >>> DF3 = DATA.build_RUNS(
+        ...     "../MLpipelines/results/newlbls-*-binge-*/*/run.csv",
+        ...     n_jobs = 8,                            # Processes
+        ...     save = True)                           # Save
+        >>> DF_FU3 = DF3.groupby('experiment').get_group(
+        ...     'newlbls-fu3-espad-fu3-19a-binge-n650_20211108-1536')
+
+        Notes
+        -----
+        Each run.csv is one task of the pool, parsed by set_RUN. The
+        experiment is the directory of the run.csv relative to the common
+        directory of all the files, os.sep replaced by '_', two
+        directories with the same name raise ValueError; it is the first
+        column, categorical. With save, the star tables are saved
+        in posthoc/all_RUN_runs and posthoc/all_RUN_predictions. The
+        partitions are written in a {dataset}.build directory which
+        replaces the saved dataset when all the experiments are loaded,
+        the experiments of a previous build are not kept.
+        
+        """
+        FILES = []
+        for i in [PATH] if isinstance(PATH, str) else PATH:
+            for j in sorted(glob(i)):
+                FILES += sorted(glob(f"{j}/**/run.csv", recursive=True)) \
+                    if os.path.isdir(j) else [j]
+        FILES = list(dict.fromkeys(os.path.abspath(i) for i in FILES))
+        if not FILES:
+            raise FileNotFoundError(f"no run.csv in {PATH}")
+        DIRS = [os.path.dirname(i) for i in FILES]
+        ROOT = os.path.commonpath(DIRS) if len(set(DIRS)) > 1 \
+            else os.path.dirname(DIRS[0])
+        EXPERIMENT = [os.path.relpath(i, ROOT).replace(os.sep, '_') for i in DIRS]
+        # a_b/c and a/b_c would share the name and the partition
+        SAME = pd.Series(DIRS).groupby(EXPERIMENT).unique()
+        SAME = SAME[SAME.map(len) > 1]
+        if len(SAME):
+            raise ValueError(f"the run.csv directories {list(SAME.iloc[0])} "
+                             f"have the same experiment name {SAME.index[0]}")
+
+        TASK = [(self.DATA_DIR, i, star) for i in FILES]
+        if n_jobs == -1:
+            n_jobs = os.cpu_count()
+        PARALLEL = (n_jobs != 1) and (len(TASK) > 1)
+        RUNS, PRED = [], []
+        # New datasets, swapped in once complete
+        SAVE = [f"{self.DATA_DIR}/posthoc/{i}" for i in
+                (['all_RUN_runs', 'all_RUN_predictions'] if star == True
+                 else ['all_RUN'])] if save == True else []
+        for i in SAVE:
+            shutil.rmtree(f"{i}.build", ignore_errors=True)
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(TASK))) \
+                if PARALLEL else nullcontext() as pool:
+            RESULT = pool.map(_set_RUN, TASK) if PARALLEL else map(_set_RUN, TASK)
+            for NAME, DF in zip(EXPERIMENT, RESULT):
+                # Tag and save each experiment as soon as it is loaded
+                if star == True:
+                    R, P = DF
+                    R.insert(0, 'experiment', NAME)
+                    P.insert(0, 'experiment', NAME)
+                    PART = [('all_RUN_runs', R), ('all_RUN_predictions', P)]
+                else:
+                    R, P = DF, None
+                    R.insert(0, 'experiment', NAME)
+                    PART = [('all_RUN', R)]
+                if save == True:
+                    for FILE, X in PART:
+                        write_PARTITION(X, f"{self.DATA_DIR}/posthoc/{FILE}.build",
+                                        self.FORMAT, KEY='experiment')
+                RUNS.append(R)
+                PRED.append(P)
+        for i in SAVE:
+            shutil.rmtree(i, ignore_errors=True)
+            os.rename(f"{i}.build", i)
+
+        CATEGORY = pd.CategoricalDtype(list(dict.fromkeys(EXPERIMENT)))
+        RUNS = pd.concat(RUNS, ignore_index=True).astype({'experiment': CATEGORY})
+        if star == True:
+            PRED = pd.concat(PRED, ignore_index=True).astype({'experiment': CATEGORY})
+            return RUNS, PRED
+        return RUNS
+
+    def get_RUN(self, RUN_file, columns=None):
         """ Load the RUN file
         
         Parameters
         ----------            
         RUN_file : string
-            The IMAGEN's RUN file (*.csv)
+            The IMAGEN's RUN file (*.csv) or the experiment partitioned
+            dataset directory saved by build_RUNS (all_RUN)
+        columns : list, optional
+            columns to read, None reads all the columns
 
         Returns
         -------
@@ -1251,6 +2827,8 @@ class RUN_loader:
         Notes
         -----
         This function select the RUN
+        The outcome views (VIEWS, PROBS) are derived from the Outcome
+        code when they are requested and not saved, see read_OUTCOME
         
         Examples
         --------
@@ -1263,24 +2841,32 @@ class RUN_loader:
         """
         # Load the instrument file       
         run_path = f"{self.DATA_DIR}/posthoc/{RUN_file}"
-        DF = pd.read_csv(run_path, low_memory=False)
+        DF = read_OUTCOME(run_path, columns)
         return DF
     
 #     def __str__(self):
 #         pass
 
+def _set_RUN(TASK):
+    """ Parse one run.csv task in a worker process """
+    DATA_DIR, RUN_FILE, STAR = TASK
+    return RUN_loader(DATA_DIR).set_RUN(RUN_FILE, star=STAR)
+
 class SHAP_loader:
-    def __init__(self, DATA_DIR="/ritter/share/data/IMAGEN"):
+    def __init__(self, DATA_DIR="/ritter/share/data/IMAGEN", FORMAT="csv"):
         """ Set up path
         
         Parameters
         ----------
         DATA_DIR : string, optional
             Directory IMAGEN absolute path
+        FORMAT : string, optional
+            storage format of the saved files: csv, parquet or feather
         
         """
         # Set the directory path: IMAGEN
-        self.DATA_DIR = DATA_DIR   
+        self.DATA_DIR = DATA_DIR
+        self.FORMAT = FORMAT
         
     def get_model(self, MODEL_DIR):
         """ Load the model
@@ -1470,7 +3056,7 @@ class SHAP_loader:
         ...     'SHAP')                      # SHAP    
         
         """
-        _, X_col, Other = self.get_holdout_data(HDF5)
+        X_col, Other = self.get_META(HDF5)
         with open(self.DATA_DIR+"/posthoc/explainers/"+SHAP, 'rb') as fp:
             load_shap_values = pickle.load(fp)
         
@@ -1494,10 +3080,7 @@ class SHAP_loader:
         
         if save == True:
             save_path = f"{self.DATA_DIR}/posthoc/explainers/all_{Info[0]}_{Session}_SHAP.csv"
-            # set the save option
-            if not os.path.isdir(os.path.dirname(save_path)):
-                os.makedirs(os.path.dirname(save_path))
-            DF.to_csv(save_path, index=None)
+            write_TABLE(DF, save_path, self.FORMAT)
         return DF
 
     def load_Feature(self, HDF5, SHAP):
@@ -1526,7 +3109,7 @@ class SHAP_loader:
         
         """
         # load the X_col_name
-        _, X_col, _ = self.get_holdout_data(HDF5)
+        X_col, _ = self.get_META(HDF5)
         
         # load the data
         SHAP = f"{self.DATA_DIR}/posthoc/explainers/{SHAP}"
@@ -1581,7 +3164,7 @@ class SHAP_loader:
         
         """
         # load the X_col_name
-        _, X_col, _ = self.get_holdout_data(HDF5)
+        X_col, _ = self.get_META(HDF5)
         
         # load the data
         SHAP = f"{self.DATA_DIR}/posthoc/explainers/{SHAP}"
@@ -1636,7 +3219,7 @@ class SHAP_loader:
         
         """
         # load the X_col_name
-        _, X_col, _ = self.get_holdout_data(HDF5)
+        X_col, _ = self.get_META(HDF5)
         
         # load the data
         SHAP = f"{self.DATA_DIR}/posthoc/explainers/{SHAP}"
@@ -1688,7 +3271,7 @@ class SHAP_loader:
         
         """
         # load the X_col_name
-        _, X_col, _ = self.get_holdout_data(HDF5)
+        X_col, _ = self.get_META(HDF5)
         
         # load the data
         SHAP = f"{self.DATA_DIR}/posthoc/explainers/{SHAP}"
@@ -1742,7 +3325,7 @@ class SHAP_loader:
         
         """
         # load the X_col_name
-        _, X_col, _ = self.get_holdout_data(HDF5)
+        X_col, _ = self.get_META(HDF5)
         
         # load the data
         SHAP = f"{self.DATA_DIR}/posthoc/explainers/{SHAP}"
@@ -1770,18 +3353,146 @@ class SHAP_loader:
         
         return DF
     
+# Query keyword to column of the posthoc dataset
+QUERY = {'session': 'Session', 'model': 'Model', 'dataset': 'dataset'}
+
+class POSTHOC_query:
+    def __init__(self, path, columns=None, WHERE=None):
+        """ Set up a lazy query, nothing is read until collect()
+        
+        Parameters
+        ----------
+        path : string
+            table file or session partitioned dataset directory
+        columns : list, optional
+            columns to read, None reads all the columns
+        WHERE : dictionary, optional
+            column to the list of the selected values
+
+        """
+        self.path = path
+        self.columns = columns
+        self.WHERE = dict(WHERE or {})
+
+    def where(self, **kwargs):
+        """ Add the equality filters
+        
+        Parameters
+        ----------
+        kwargs : string or list
+            session, model, dataset or any column name = selected value(s)
+
+        Returns
+        -------
+        QUERY : POSTHOC_query
+            new query with the filters added
+
+        Examples
+        --------
+        >>> from imagen_posthocloader import *
+        >>> Q = POSTHOC_query('posthoc/IMAGEN_posthoc').where(
+        ...     session = 'FU3',                # Session
+        ...     model = ['SVM-rbf','GB'])       # Model
+
+        """
+        WHERE = dict(self.WHERE)
+        for k, v in kwargs.items():
+            WHERE[QUERY.get(k, k)] = v if isinstance(v, (list, tuple)) else [v]
+        return POSTHOC_query(self.path, self.columns, WHERE)
+
+    def select(self, columns):
+        """ Set the column projection
+        
+        Parameters
+        ----------
+        columns : list
+            columns to read
+
+        Returns
+        -------
+        QUERY : POSTHOC_query
+            new query reading only these columns
+
+        """
+        return POSTHOC_query(self.path, list(columns), self.WHERE)
+
+    def collect(self):
+        """ Read the selected rows and columns
+        
+        Returns
+        -------
+        DF : pandas.dataframe
+            rows matching all the filters, projected columns
+
+        Notes
+        -----
+        The partitions of the dataset whose key value is filtered out are
+        not opened. Parquet files get the other filters as row group
+        filters, the other formats read the projected and filtered
+        columns only and drop the rows afterwards. A column missing in
+        all the rows of a parquet file has the arrow type null, its
+        filter is applied on the rows read (e.g. Model in a session
+        without RUN rows). The VIEWS and PROBS names not saved in the file
+        are derived from its Outcome and prediction columns, see derive.
+
+        """
+        FILES = sorted(glob(f"{self.path}/*=*/part.*")) \
+            if os.path.isdir(self.path) else [self.path]
+        ASKED = list(dict.fromkeys([*(self.columns or []), *self.WHERE]))
+        LIST = []
+        for path in FILES:
+            if os.path.isdir(self.path):
+                # Partition pruning: skip the filtered out key values
+                KEY, VALUE = os.path.basename(os.path.dirname(path)).split('=', 1)
+                if (KEY in self.WHERE) and \
+                        (VALUE not in [str(i) for i in self.WHERE[KEY]]):
+                    continue
+            # Filters pushed down to the parquet row groups
+            PUSH = {}
+            if path.endswith(EXT['parquet']):
+                import pyarrow as pa
+                ARROW = read_SCHEMA(path)
+                PUSH = {k: v for k, v in self.WHERE.items()
+                        if (k in ARROW.names)
+                        and not pa.types.is_null(ARROW.field(k).type)}
+            WHERE = {k: v for k, v in self.WHERE.items() if k not in PUSH}
+            # Outcome views not saved: read their codes, derive after
+            FILE = set(read_COLUMNS(path))
+            NEW = [i for i in ASKED
+                   if ((i in VIEWS) or (i in PROBS)) and (i not in FILE)]
+            COLS = None if self.columns is None else list(dict.fromkeys(
+                [*[i for i in [*self.columns, *WHERE] if i not in NEW],
+                 *(['Outcome', 'prediction'] if NEW else [])]))
+            DF = read_TABLE(path, COLS,
+                            [(k, 'in', list(v)) for k, v in PUSH.items()])
+            if NEW:
+                DF = derive(DF, NEW)
+            for k, v in WHERE.items():
+                DF = DF[DF[k].isin(v)]
+            if self.columns is not None:
+                DF = DF[self.columns]
+            else:
+                DF = DF.drop(columns=NEW)
+            LIST.append(DF.reset_index(drop=True))
+        DF = pd.concat(LIST, ignore_index=True) if LIST else pd.DataFrame(
+            columns=self.columns)
+        return DF
+
 class IMAGEN_posthoc(INSTRUMENT_loader,HDF5_loader,RUN_loader,SHAP_loader):
-    def __init__(self, DATA_DIR="/ritter/share/data/IMAGEN"):
+    def __init__(self, DATA_DIR="/ritter/share/data/IMAGEN", FORMAT="csv"):
         """ Set up path
         
         Parameters
         ----------
         DATA_DIR : string, optional
             Directory IMAGEN absolute path
+        FORMAT : string, optional
+            storage format of the saved files: csv, parquet or feather
         
         """
         # Set the directory path: IMAGEN
         self.DATA_DIR = DATA_DIR
+        self.FORMAT = FORMAT
         
     def to_INSTRUMENT(self, LIST, save=False):
         """ Merge the ROI instruments as one file
@@ -1800,7 +3511,12 @@ class IMAGEN_posthoc(INSTRUMENT_loader,HDF5_loader,RUN_loader,SHAP_loader):
             
         Notes
         -----
-        Each Instrument has different Session and ID cases
+        Each Instrument has different Session and ID cases.
+        Each instrument is indexed once by the sorted (ID, Session) key and
+        the wide table is one outer concat aligned on the union of the keys.
+        Instruments with duplicate keys are outer merged after the concat.
+        The column names found in more than one instrument are reported in
+        self.COLLISION and suffixed by the position of the instrument.
         
         Examples
         --------
@@ -1811,21 +3527,35 @@ class IMAGEN_posthoc(INSTRUMENT_loader,HDF5_loader,RUN_loader,SHAP_loader):
         ...     save = True)
 
         """
-        if len(LIST)==1:
-            self.INSTRUMENT = LIST[0]
-        else:
-            Z = pd.merge(LIST[0],LIST[1],on=['ID','Session'],how='outer')
-            if len(LIST)!=2:
-                for n in LIST[2:]:
-                    Z = pd.merge(Z,n,on=['ID','Session'],how='outer')
+        # Index each instrument once by the subject key
+        KEYED = [set_KEY(DF) for DF in LIST]
+        # Column names in more than one instrument
+        SEEN = {}
+        for n, DF in enumerate(KEYED):
+            for COL in DF.columns:
+                SEEN.setdefault(COL, []).append(n)
+        self.COLLISION = {k: v for k, v in SEEN.items() if len(v) > 1}
+        if self.COLLISION:
+            print(f"Column collision (column: instruments) = {self.COLLISION}")
+            KEYED = [DF.rename(columns={COL: f"{COL}_{n}" for COL in DF.columns
+                                        if COL in self.COLLISION})
+                     for n, DF in enumerate(KEYED)]
+
+        UNIQUE = [DF for DF in KEYED if DF.index.is_unique]
+        Z = pd.concat(UNIQUE, axis=1, join='outer', sort=True) if UNIQUE else None
+        for DF in [DF for DF in KEYED if not DF.index.is_unique]:
+            Z = DF if Z is None else pd.merge(
+                Z, DF, left_index=True, right_index=True, how='outer')
+        Z = Z.reset_index()
+        # Keep the categorical Session of the instruments
+        SESSION = {str(DF['Session'].dtype): DF['Session'].dtype for DF in LIST}
+        if len(SESSION) == 1:
+            Z['Session'] = Z['Session'].astype(*SESSION.values())
         self.INSTRUMENT = Z
 
         if save == True:
             save_path = f"{self.DATA_DIR}/posthoc/IMAGEN_INSTRUMENT.csv"
-            # set the save option
-            if not os.path.isdir(os.path.dirname(save_path)):
-                os.makedirs(os.path.dirname(save_path))
-            Z.to_csv(save_path, index=None)
+            write_TABLE(Z, save_path, self.FORMAT)
         return self.INSTRUMENT
 
     def to_HDF5(self, hdf5_file, save=False):
@@ -1865,9 +3595,7 @@ class IMAGEN_posthoc(INSTRUMENT_loader,HDF5_loader,RUN_loader,SHAP_loader):
         self.HDF5 = DF
         if save == True:
             save_path = f"{self.DATA_DIR}/posthoc/IMAGEN_HDF5.csv"
-            if not os.path.isdir(os.path.dirname(save_path)):
-                os.makedirs(os.path.dirname(save_path))
-            DF.to_csv(save_path, index=None)
+            write_TABLE(DF, save_path, self.FORMAT)
         return self.HDF5    
     
     def to_RUN(self, run_file, COL, save=False):
@@ -1901,20 +3629,18 @@ class IMAGEN_posthoc(INSTRUMENT_loader,HDF5_loader,RUN_loader,SHAP_loader):
         General information:
             'ID','Session','Trial','dataset','io','technique','Model',
             'TP prob','TN prob','FP prob','FN prob','T prob','F prob','Prob',
-            'Predict TF','Model PN','Label PN','true_label','prediction'
+            'Predict TF','Model PN','Label PN','true_label','prediction',
+            'Outcome'
         
         It may extend to other y cases in one file
         
         """
-        DF = self.get_RUN(run_file)
-        DF2 = DF[COL]
+        DF2 = self.get_RUN(run_file, COL)
 
         self.RUN = DF2
         if save == True:
             save_path = f"{self.DATA_DIR}/posthoc/IMAGEN_RUN.csv"
-            if not os.path.isdir(os.path.dirname(save_path)):
-                os.makedirs(os.path.dirname(save_path))
-            DF2.to_csv(save_path, index=None)
+            write_TABLE(DF2, save_path, self.FORMAT)
         return self.RUN
     
     def to_abs_SHAP(self, H5, SHAP, SESSION, save=False):
@@ -1945,82 +3671,16 @@ class IMAGEN_posthoc(INSTRUMENT_loader,HDF5_loader,RUN_loader,SHAP_loader):
         ...     H5,                             # HDF5 for Feature name
         ...     SHAP,                           # list of SHAP model name
         ...     save=False)                     # save
+
+        Notes
+        -----
+        The feature columns are read from the cached feature catalogue
+        of the h5 file, see catalogue.
+
         """
-        
-        def type_check(col):
-            """ Generate the region category of the Feature
-            
-            Parameters
-            ----------
-            col: string
-                Feature name
-                
-            Returns
-            -------
-            * region : String
-                Return the * region under the condition
-            
-            """
-            if 'cor' == col.split('_')[1]:
-                return "Cortical region"
-            elif 'subcor' == col.split('_')[1]:
-                return "Subcortical region"
-            else:
-                return "DTI region"
-    
-        def lobe_region(col):
-            """ Generate the lobe region of the Feature
-            
-            Parameters
-            ----------
-            col: string
-                Feature name
-                
-            Returns
-            -------
-            * lobe or * cortex or * region : string
-                Return the lobe region name
-                
-            """
-            if 'cor' == col.split('_')[1]:
-                temporal_lobe = {'bankssts', 'entorhinal', 'fusiform', 'inferiortemporal', 'middletemporal',
-                                 'parahippocampal','superiortemporal', 'temporalpole', 'transversetemporal'}
-                frontal_lobe = {'caudalmiddlefrontal', 'lateralorbitofrontal', 'paracentral', 'parsopercularis',
-                                'parsorbitalis', 'parstriangularis', 'precentral', 'rostralmiddlefrontal',
-                                'superiorfrontal', 'medialorbitofrontal', 'frontalpole'}
-                parietal_lobe = {'inferiorparietal', 'postcentral', 'precuneus', 'superiorparietal', 'supramarginal'}
-                occipital_lobe = {'cuneus', 'lateraloccipital', 'pericalcarine', 'lingual'}
-                cingulate_cortex = {'caudalanteriorcingulate', 'isthmuscingulate', 'posteriorcingulate', 'rostralanteriorcingulate'}
-                insula_cortex = {'insula'}
-                check = col.split('_')[2].split('-')[0]
-                if check in temporal_lobe:
-                    return 'Temporal lobe'
-                elif check in frontal_lobe:
-                    return 'Frontal lobe'
-                elif check in parietal_lobe:
-                    return 'Parietal lobe'
-                elif check in occipital_lobe:
-                    return 'Occipital lobe'
-                elif check in cingulate_cortex:
-                    return 'Cingulate cortex'
-                elif check in insula_cortex:
-                    return 'Insula cortex'
-                else:
-                    return 'Other'
-            elif 'subcor' == col.split('_')[1]:
-                return 'Subcortical region' # To do
-            else:
-                return 'DTI region' # To do
-            
         # Columns: Feature derivatives
-        _, X_col_names, _ = self.get_holdout_data(H5, group=False)
-        COL = pd.DataFrame(
-            {'Feature name': X_col_names}
-        )
-        COL['Modality'] = [i.split('_')[0] for i in COL['Feature name']]
-        COL['Type'] = [type_check(i) for i in COL['Feature name']]
-        COL['Lobe Region'] = [lobe_region(i) for i in COL['Feature name']]
-        COL['Value'] = [i.split('-')[-1].split('_')[-1] for i in COL['Feature name']]
+        CAT, _ = self.get_CATALOGUE(H5)
+        COL = CAT[['Feature name', 'Modality', 'Type', 'Lobe Region', 'Value']]
         
         # Columns: Mean and std derivatives
         for i in SHAP:
@@ -2051,9 +3711,7 @@ class IMAGEN_posthoc(INSTRUMENT_loader,HDF5_loader,RUN_loader,SHAP_loader):
         
         if save == True:
             save_path = f"{self.DATA_DIR}/posthoc/explainers/all_{SESSION}_SHAP.csv"
-            if not os.path.isdir(os.path.dirname(save_path)):
-                os.makedirs(os.path.dirname(save_path))
-            COL.to_csv(save_path, index=None)
+            write_TABLE(COL, save_path, self.FORMAT)
         return COL
 
     def to_sorted_mean_SHAP(self, DF, MODEL, SESSION, save=False):
@@ -2098,9 +3756,7 @@ class IMAGEN_posthoc(INSTRUMENT_loader,HDF5_loader,RUN_loader,SHAP_loader):
         DF[f'sorted {MODEL}6_{SESSION} std'] = [i[2] for i in rbf6]
         if save == True:
             save_path = f"{self.DATA_DIR}/posthoc/explainers/sorted_{MODEL}_{SESSION}_SHAP.csv"
-            if not os.path.isdir(os.path.dirname(save_path)):
-                os.makedirs(os.path.dirname(save_path))
-            DF.to_csv(save_path, index=None)
+            write_TABLE(DF, save_path, self.FORMAT)
         return DF
     
     def to_SHAP(self, SHAP, NAME, save=False):
@@ -2120,18 +3776,18 @@ class IMAGEN_posthoc(INSTRUMENT_loader,HDF5_loader,RUN_loader,SHAP_loader):
         DF = pd.concat(SHAP)
         if save == True:
             save_path = f"{self.DATA_DIR}/posthoc/explainers/{NAME}"
-            if not os.path.isdir(os.path.dirname(save_path)):
-                os.makedirs(os.path.dirname(save_path))
-            DF.to_csv(save_path, index=None)
+            write_TABLE(DF, save_path, self.FORMAT)
         return DF
     
-    def read_INSTRUMENT(self, instrument_file):
+    def read_INSTRUMENT(self, instrument_file, columns=None):
         """ Load the Instruemnt file
         
         Parameters
         ----------
         instrument_file : string
             instrument file
+        columns : list, optional
+            columns to read, None reads all the columns
             
         Returns
         -------
@@ -2155,17 +3811,19 @@ class IMAGEN_posthoc(INSTRUMENT_loader,HDF5_loader,RUN_loader,SHAP_loader):
         
         """     
         instrument_path = f"{self.DATA_DIR}/posthoc/{instrument_file}"
-        DF = pd.read_csv(instrument_path, low_memory=False)
+        DF = read_TABLE(instrument_path, columns)
         self.INSTRUMENT = DF
         return self.INSTRUMENT
 
-    def read_HDF5(self, hdf5_file):
+    def read_HDF5(self, hdf5_file, columns=None):
         """ Load the HDF5 file
         
         Parameters
         ----------
         hdf5_file : string,
             The IMAGEN's h5df file (*.csv)
+        columns : list, optional
+            columns to read, None reads all the columns
         
         Returns
         -------
@@ -2187,17 +3845,20 @@ class IMAGEN_posthoc(INSTRUMENT_loader,HDF5_loader,RUN_loader,SHAP_loader):
         """
         # Load the hdf5 file
         hdf5_path = f"{self.DATA_DIR}/posthoc/{hdf5_file}"
-        DF = pd.read_csv(hdf5_path, low_memory=False)
+        DF = read_TABLE(hdf5_path, columns)
         self.HDF5 = DF
         return self.HDF5
   
-    def read_RUN(self, run_file):
+    def read_RUN(self, run_file, columns=None):
         """ Load the RUN file
         
         Parameters
         ----------
         run_file : string
-            ML models result run.csv path
+            RUN file or the experiment partitioned dataset directory
+            (all_RUN), in posthoc
+        columns : list, optional
+            columns to read, None reads all the columns
             
         Returns
         -------
@@ -2218,22 +3879,25 @@ class IMAGEN_posthoc(INSTRUMENT_loader,HDF5_loader,RUN_loader,SHAP_loader):
         General information:
             'ID','Session','Trial','dataset','io','technique','Model',
             'TP prob','TN prob','FP prob','FN prob','T prob','F prob','Prob',
-            'Predict TF','Model PN','Label PN','true_label','prediction'
+            'Predict TF','Model PN','Label PN','true_label','prediction',
+            'Outcome'
         
         """
         # Load the hdf5 file
         run_path = f"{self.DATA_DIR}/posthoc/{run_file}"
-        DF = pd.read_csv(run_path, low_memory=False)
+        DF = read_OUTCOME(run_path, columns)
         self.RUN = DF
         return self.RUN
     
-    def read_SHAP(self, SHAP_file):
+    def read_SHAP(self, SHAP_file, columns=None):
         """ Load the SHAP file
         
         Parameters
         ----------
         SHAP_file : string
             SHAP file
+        columns : list, optional
+            columns to read, None reads all the columns
             
         Returns
         -------
@@ -2249,22 +3913,26 @@ class IMAGEN_posthoc(INSTRUMENT_loader,HDF5_loader,RUN_loader,SHAP_loader):
         
         """
         SHAP_path = self.DATA_DIR+"/posthoc/explainers/"+SHAP_file
-        DF = pd.read_csv(SHAP_path, low_memory=False)
+        DF = read_TABLE(SHAP_path, columns)
         self.SHAP = DF
         return self.SHAP
 
-    def to_posthoc(self, DATA, save=False):
+    def to_posthoc(self, DATA, SESSION=None, n_jobs=1, save=False):
         """ Set the Posthoc file
         
         Parameters
         ----------        
         DATA : list
-            [INSTRUMENT.csv,                   # instrument
-             HDF5.csv,                         # hdf5
+            [HDF5.csv,                         # hdf5
+             INSTRUMENT.csv,                   # instrument
              RUN.csv]                          # run
-             
+        SESSION : list, optional
+            sessions to join, None joins all the sessions of the HDF5
+        n_jobs : integer, optional
+            number of threads joining the sessions, -1 uses all the cores
         save : boolean
-            if save == True, then save it as .csv
+            if save == True, then save it as the session partitioned
+            dataset posthoc/IMAGEN_posthoc/Session={session}/part.csv
 
         Returns
         -------
@@ -2276,39 +3944,59 @@ class IMAGEN_posthoc(INSTRUMENT_loader,HDF5_loader,RUN_loader,SHAP_loader):
         >>> from imagen_psothocloader import *
         >>> Posthoc = IMAGEN_posthoc()
         >>> DF = Posthoc.to_posthoc(
-        ...     DATA)               # INSTRUMENT, HDF5, RUN                   
+        ...     DATA,               # HDF5, INSTRUMENT, RUN
+        ...     n_jobs = 4,         # Threads
+        ...     save = True)        # Save
         >>> DF_FU3 = DF.groupby('Session').get_group('FU3')
 
         Notes
         -----
-        ONLY FU3 implementation, other seession need modification
+        The inputs are read once and split by Session once, each session
+        is joined independently: HDF5 left join RUN left join INSTRUMENT.
+        SESSION = ['FU3'] is the former FU3 only posthoc file.
         
         """
         HDF5 = self.read_HDF5(DATA[0])
         INST = self.read_INSTRUMENT(DATA[1])
         RUN = self.read_RUN(DATA[2])
-        
-        H_FU3 = HDF5.groupby('Session').get_group('FU3')
-        I_FU3 = INST.groupby('Session').get_group('FU3')
-        R_FU3 = RUN.groupby('Session').get_group('FU3')
-        HR_FU3 = pd.merge(H_FU3, R_FU3, on=['ID','Session'], how='left')
-        DF = pd.merge(HR_FU3, I_FU3, on=['ID','Session'], how='left')
+
+        # Split each input by session once
+        H = dict(list(HDF5.groupby('Session', sort=False, observed=True)))
+        I = dict(list(INST.groupby('Session', sort=False, observed=True)))
+        R = dict(list(RUN.groupby('Session', sort=False, observed=True)))
+        if SESSION == None:
+            SESSION = sorted(H)
+
+        def join_SESSION(SES):
+            HR = pd.merge(H[SES], R.get(SES, RUN.iloc[:0]),
+                          on=['ID','Session'], how='left')
+            return pd.merge(HR, I.get(SES, INST.iloc[:0]),
+                            on=['ID','Session'], how='left')
+
+        if n_jobs == -1:
+            n_jobs = os.cpu_count()
+        if (n_jobs == 1) or (len(SESSION) <= 1):
+            LIST = [join_SESSION(SES) for SES in SESSION]
+        else:
+            with ThreadPoolExecutor(max_workers=min(n_jobs, len(SESSION))) as pool:
+                LIST = list(pool.map(join_SESSION, SESSION))
+        DF = pd.concat(LIST, ignore_index=True)
         self.posthoc = DF
         
         if save == True:
-            save_path = f"{self.DATA_DIR}/posthoc/IMAGEN_posthoc.csv"
-            if not os.path.isdir(os.path.dirname(save_path)):
-                os.makedirs(os.path.dirname(save_path))
-            DF.to_csv(save_path, index=None)
+            save_dir = f"{self.DATA_DIR}/posthoc/IMAGEN_posthoc"
+            write_PARTITION(DF, save_dir, self.FORMAT)
         return self.posthoc
 
-    def read_posthoc(self, posthoc_file):
+    def read_posthoc(self, posthoc_file, columns=None):
         """ Load the Posthoc file
         
         Parameters
         ----------
-        diagnosis_file : string
-            diagnosis file path
+        posthoc_file : string
+            posthoc file or session partitioned dataset directory
+        columns : list, optional
+            columns to read, None reads all the columns
             
         Returns
         -------
@@ -2320,20 +4008,59 @@ class IMAGEN_posthoc(INSTRUMENT_loader,HDF5_loader,RUN_loader,SHAP_loader):
         >>> from imagen_psothocloader import *
         >>> Posthoc = IMAGEN_posthoc()
         >>> DF = Posthoc.read_posthoc(
-        ...     DATA)               # INSTRUMENT, HDF5, RUN                   
+        ...     'IMAGEN_posthoc')   # posthoc dataset
         >>> DF_FU3 = DF.groupby('Session').get_group('FU3')
-
-        Notes
-        -----
-        ONLY FU3 implementation, other seession need modification
         
         """
-         # Load the posthoc file
+         # Load the posthoc file or the session partitioned dataset
         run_path = f"{self.DATA_DIR}/posthoc/{posthoc_file}"
-        DF = pd.read_csv(run_path, low_memory=False)
+        if os.path.isdir(run_path):
+            DF = read_PARTITION(run_path, columns)
+        else:
+            DF = read_TABLE(run_path, columns)
         self.posthoc = DF
         return self.posthoc
 
+    def query(self, posthoc_file='IMAGEN_posthoc', session=None, model=None,
+              dataset=None, columns=None):
+        """ Set a lazy query on the posthoc dataset
+        
+        Parameters
+        ----------
+        posthoc_file : string, optional
+            posthoc file or session partitioned dataset directory
+            (e.g. IMAGEN_posthoc, all_RUN.parquet)
+        session : string or list, optional
+            selected Session(s)
+        model : string or list, optional
+            selected Model(s)
+        dataset : string or list, optional
+            selected dataset(s): 'Test set', 'Holdout set'
+        columns : list, optional
+            columns to read, None reads all the columns
+
+        Returns
+        -------
+        QUERY : POSTHOC_query
+            lazy query, read by QUERY.collect()
+
+        Examples
+        --------
+        >>> from imagen_posthocloader import *
+        >>> posthoc = IMAGEN_posthoc()
+        >>> Q = posthoc.query(
+        ...     session = 'FU3',                 # Session
+        ...     model = 'SVM-rbf',               # Model
+        ...     dataset = 'Holdout set',         # dataset
+        ...     columns = ['ID','Session','Prob'])
+        >>> DF = Q.collect()
+
+        """
+        path = f"{self.DATA_DIR}/posthoc/{posthoc_file}"
+        WHERE = {k: v for k, v in [('session', session), ('model', model),
+                                   ('dataset', dataset)] if v is not None}
+        return POSTHOC_query(path, columns).where(**WHERE)
+
 #     def __str__(self):
 #         """ Print the instrument loader steps """
 #         return "Step 1. load the phenotype: " \
@@ -0,0 +1,139 @@
+#################################################################################
+#!/usr/bin/env python
+# coding: utf-8
+""" IMAGEN subject key: ID parsing, exclusion and (ID, Session) ordering """
+# Author: JiHoon Kim, <jihoon.kim@fu-berlin.de>, 15th November 2021
+#
+import pandas as pd
+import numpy as np
+
+# Sessions in time order
+SESSIONS = ['BL', 'FU1', 'FU2', 'FU3']
+
+def to_ID(SERIES):
+    """ Parse the psytools User code to the int64 subject ID
+
+    Parameters
+    ----------
+    SERIES : pandas.series
+        User code, e.g. '000001234567-C' or already the integer ID (FU3)
+
+    Returns
+    -------
+    ID : numpy.ndarray
+        int64 subject ID, the first 12 digits of the User code
+
+    Examples
+    --------
+    >>> from imagen_subjectkey import *
+    >>> DF['ID'] = to_ID(
+    ...     DF['User code'])                # USER CODE
+
+    Notes
+    -----
+    The codes are truncated to 12 characters by the fixed width unicode
+    cast and converted to integer in one array operation.
+
+    """
+    if pd.api.types.is_numeric_dtype(SERIES):
+        return SERIES.to_numpy(dtype=np.int64)
+    return np.asarray(SERIES, dtype='U12').astype(np.int64)
+
+def to_SESSION(SERIES):
+    """ Set the session labels as an ordered categorical
+
+    Parameters
+    ----------
+    SERIES : pandas.series
+        session labels (BL, FU1, FU2, FU3)
+
+    Returns
+    -------
+    SESSION : pandas.Categorical
+        ordered categorical, categories in SESSIONS order
+
+    Examples
+    --------
+    >>> from imagen_subjectkey import *
+    >>> DF['Session'] = to_SESSION(
+    ...     DF['Session'])                  # SESSION
+
+    """
+    return pd.Categorical(SERIES, categories=SESSIONS, ordered=True)
+
+def exclude(DF, KEY):
+    """ Drop the (ID, Session) rows listed in the key as one anti-join
+
+    Parameters
+    ----------
+    DF : pandas.dataframe
+        dataframe with the ID and Session columns
+    KEY : list
+        (ID, Session) pairs to drop
+
+    Returns
+    -------
+    DF : pandas.dataframe
+        dataframe without the listed rows
+
+    Examples
+    --------
+    >>> from imagen_subjectkey import *
+    >>> DF = exclude(
+    ...     DF,                             # DATAFRAME
+    ...     [(12809392, 'BL')])             # (ID, SESSION)
+
+    """
+    if len(KEY) == 0:
+        return DF
+    ROWS = pd.MultiIndex.from_arrays([DF['ID'], DF['Session']])
+    return DF[~ROWS.isin(pd.MultiIndex.from_tuples(KEY))]
+
+def sort_KEY(DF):
+    """ Sort the rows by (ID, Session) in session time order
+
+    Parameters
+    ----------
+    DF : pandas.dataframe
+        dataframe with the ID and Session columns
+
+    Returns
+    -------
+    DF : pandas.dataframe
+        rows sorted by ID and Session (BL, FU1, FU2, FU3), new RangeIndex
+
+    Examples
+    --------
+    >>> from imagen_subjectkey import *
+    >>> DF = sort_KEY(
+    ...     DF)                             # DATAFRAME
+
+    """
+    SES = pd.Categorical(DF['Session'], categories=SESSIONS, ordered=True)
+    ORDER = np.lexsort((SES.codes, DF['ID'].to_numpy()))
+    return DF.iloc[ORDER].reset_index(drop=True)
+
+def set_KEY(DF):
+    """ Index the rows by the sorted (ID, Session) MultiIndex
+
+    Parameters
+    ----------
+    DF : pandas.dataframe
+        dataframe with the ID and Session columns
+
+    Returns
+    -------
+    DF : pandas.dataframe
+        ID and Session as a sorted MultiIndex, ready to be joined
+        with other keyed dataframes without sorting again
+
+    Examples
+    --------
+    >>> from imagen_subjectkey import *
+    >>> INST = set_KEY(
+    ...     DF)                             # DATAFRAME
+    >>> INST_FU3 = INST.xs('FU3', level='Session')
+
+    """
+    DF = sort_KEY(DF).set_index(['ID', 'Session'])
+    return DF
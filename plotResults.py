@@ -7,6 +7,7 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import re
 import sklearn.metrics as metrics
+from imagen_listparser import parse_LIST, split_LIST
 
 
 def plot_result(df_full, x="test_score", conf_ctrl=[], input_type='',
@@ -136,13 +137,26 @@ def plot_result(df_full, x="test_score", conf_ctrl=[], input_type='',
 # Calculate p-value
 def calc_p_values(df, x="test_score", viz=False):
     
-    df["p_value"] = np.nan
     grp_order = ["io", "technique", "model"]
     if 'i_type' in df and len(df['i_type'].unique())>1:
         grp_order.insert(0, 'i_type')
-    groups = df.dropna(subset=[x, f"permuted_{x}"]).groupby(grp_order)   
+    valid = df[[x, f"permuted_{x}"]].notna().all(axis=1).to_numpy()
+    groups = df[valid].groupby(grp_order)   
     n_models = len(df["model"].unique())
     
+    # calc p_value = (C + 1)/(n_permutations + 1) of all the rows at once
+    # where C is permutations whose score >= true_score 
+    p_scores, offsets = parse_LIST(df.loc[valid, f"permuted_{x}"])
+    row = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    true_score = df.loc[valid, x].to_numpy(dtype=float)
+    C = np.bincount(row, weights=p_scores >= true_score[row],
+                    minlength=len(offsets) - 1)
+    p_vals = np.full(len(df), np.nan)
+    p_vals[valid] = (C + 1) / (np.diff(offsets) + 1)
+    # average the p-values of the trials of each group
+    df["p_value"] = pd.Series(p_vals).groupby(
+        [df[g].to_numpy() for g in grp_order]).transform("mean").to_numpy()
+    
     if viz:
         sns.reset_orig()
         n_rows = len(groups)//n_models
@@ -156,29 +170,13 @@ def calc_p_values(df, x="test_score", viz=False):
         axes = np.ravel(axes)
         plt.xlim([0,1])
         
-    for i, (g, rows) in enumerate(groups):
+    for i, (g, rows) in enumerate(groups if viz else []):
         
-        p_vals = [] 
-        rows = rows.filter(like=x)
-        if viz:
-            permuted_scores = []    
-            true_scores = rows[x]
-            
-        for _, r in rows.iterrows():
-            p_scores = np.array(eval(r[f'permuted_{x}']))
-            # calc p_value = (C + 1)/(n_permutations + 1) 
-            # where C is permutations whose score >= true_score 
-            true_score = r[x]
-            C = np.sum(p_scores >= r[x])
-            pi = (C+1)/(len(p_scores)+1)
-            p_vals.extend([pi])
-            
-            if viz: permuted_scores.extend([*p_scores])        
+        permuted_scores = p_scores[np.isin(row, groups.indices[g])]
+        true_scores = rows[x]
 #         if np.std(permuted_scores)>=1:
 #             print("[WARN] the p-values for {} have high variance across each test-set (trial). \
 # Simply averaging the p-values across trials in such a case is not recommended.".format(g))  
-
-        df.loc[(df[grp_order]==g).all(axis=1), ["p_value", ""]] = np.mean(p_vals)  
         
         if viz:
             ax = axes[i]
@@ -286,8 +284,10 @@ def compute_metric(df, metric_name):
             "ERROR: Invalid 'x' metric requested. Allowed metric_names are {}".format(
                 metrics_map.keys()))
     
-    df['y_true'] = df["test_lbls"].apply(lambda lbls: np.array(eval(lbls), dtype=int))
-    df['y_pred'] = df["test_probs"].apply(lambda probs: np.argmax(np.array(eval(probs)), axis=1))
+    lbls, offsets = parse_LIST(df["test_lbls"])
+    probs, offsets_probs = parse_LIST(df["test_probs"])
+    df['y_true'] = split_LIST(lbls.astype(int), offsets)
+    df['y_pred'] = split_LIST(np.argmax(probs, axis=1), offsets_probs)
     
     df[metric_name] = df.apply(lambda x: metric(y_true=x.y_true, y_pred=x.y_pred), axis=1)
     
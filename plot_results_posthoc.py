@@ -477,55 +477,35 @@ def plot_SHAP(MODEL, DATA, PLOT):
     # plot: summary_plot bar, dot and summary_plot
     pass
 
+# Feature type of the SHAP tables per name substring
+SHAP_TYPES = {'DTI': 'DTI_', 'T1w subcortical': 'T1w_subcor_',
+              'T1w cortical': 'T1w_cor_'}
+
 def SHAP_table(DF, SESSION, viz = False):
-    # DTI type
-    DTI0 = [i for i in zip(DF[f'sorted SVM-rbf0_{SESSION} name'], DF[f'sorted SVM-rbf0_{SESSION} mean'], DF[f'sorted SVM-rbf0_{SESSION} std']) if 'DTI_' in i[0]]
-    DTI1 = [i for i in zip(DF[f'sorted SVM-rbf1_{SESSION} name'], DF[f'sorted SVM-rbf1_{SESSION} mean'], DF[f'sorted SVM-rbf1_{SESSION} std']) if 'DTI_' in i[0]]
-    DTI2 = [i for i in zip(DF[f'sorted SVM-rbf2_{SESSION} name'], DF[f'sorted SVM-rbf2_{SESSION} mean'], DF[f'sorted SVM-rbf2_{SESSION} std']) if 'DTI_' in i[0]]
-    DTI3 = [i for i in zip(DF[f'sorted SVM-rbf3_{SESSION} name'], DF[f'sorted SVM-rbf3_{SESSION} mean'], DF[f'sorted SVM-rbf3_{SESSION} std']) if 'DTI_' in i[0]]
-    DTI4 = [i for i in zip(DF[f'sorted SVM-rbf4_{SESSION} name'], DF[f'sorted SVM-rbf4_{SESSION} mean'], DF[f'sorted SVM-rbf4_{SESSION} std']) if 'DTI_' in i[0]]
-    DTI5 = [i for i in zip(DF[f'sorted SVM-rbf5_{SESSION} name'], DF[f'sorted SVM-rbf5_{SESSION} mean'], DF[f'sorted SVM-rbf5_{SESSION} std']) if 'DTI_' in i[0]]
-    DTI6 = [i for i in zip(DF[f'sorted SVM-rbf6_{SESSION} name'], DF[f'sorted SVM-rbf6_{SESSION} mean'], DF[f'sorted SVM-rbf6_{SESSION} std']) if 'DTI_' in i[0]]
-    # T1w Subcortical type
-    SUBCOR0 = [i for i in zip(DF[f'sorted SVM-rbf0_{SESSION} name'], DF[f'sorted SVM-rbf0_{SESSION} mean'], DF[f'sorted SVM-rbf0_{SESSION} std']) if 'T1w_subcor_' in i[0]]
-    SUBCOR1 = [i for i in zip(DF[f'sorted SVM-rbf1_{SESSION} name'], DF[f'sorted SVM-rbf1_{SESSION} mean'], DF[f'sorted SVM-rbf1_{SESSION} std']) if 'T1w_subcor_' in i[0]]
-    SUBCOR2 = [i for i in zip(DF[f'sorted SVM-rbf2_{SESSION} name'], DF[f'sorted SVM-rbf2_{SESSION} mean'], DF[f'sorted SVM-rbf2_{SESSION} std']) if 'T1w_subcor_' in i[0]]
-    SUBCOR3 = [i for i in zip(DF[f'sorted SVM-rbf3_{SESSION} name'], DF[f'sorted SVM-rbf3_{SESSION} mean'], DF[f'sorted SVM-rbf3_{SESSION} std']) if 'T1w_subcor_' in i[0]]
-    SUBCOR4 = [i for i in zip(DF[f'sorted SVM-rbf4_{SESSION} name'], DF[f'sorted SVM-rbf4_{SESSION} mean'], DF[f'sorted SVM-rbf4_{SESSION} std']) if 'T1w_subcor_' in i[0]]
-    SUBCOR5 = [i for i in zip(DF[f'sorted SVM-rbf5_{SESSION} name'], DF[f'sorted SVM-rbf5_{SESSION} mean'], DF[f'sorted SVM-rbf5_{SESSION} std']) if 'T1w_subcor_' in i[0]]
-    SUBCOR6 = [i for i in zip(DF[f'sorted SVM-rbf6_{SESSION} name'], DF[f'sorted SVM-rbf6_{SESSION} mean'], DF[f'sorted SVM-rbf6_{SESSION} std']) if 'T1w_subcor_' in i[0]]
-    # T2w Subcortical type
-    COR0 = [i for i in zip(DF[f'sorted SVM-rbf0_{SESSION} name'], DF[f'sorted SVM-rbf0_{SESSION} mean'], DF[f'sorted SVM-rbf0_{SESSION} std']) if 'T1w_cor_' in i[0]]
-    COR1 = [i for i in zip(DF[f'sorted SVM-rbf1_{SESSION} name'], DF[f'sorted SVM-rbf1_{SESSION} mean'], DF[f'sorted SVM-rbf1_{SESSION} std']) if 'T1w_cor_' in i[0]]
-    COR2 = [i for i in zip(DF[f'sorted SVM-rbf2_{SESSION} name'], DF[f'sorted SVM-rbf2_{SESSION} mean'], DF[f'sorted SVM-rbf2_{SESSION} std']) if 'T1w_cor_' in i[0]]
-    COR3 = [i for i in zip(DF[f'sorted SVM-rbf3_{SESSION} name'], DF[f'sorted SVM-rbf3_{SESSION} mean'], DF[f'sorted SVM-rbf3_{SESSION} std']) if 'T1w_cor_' in i[0]]
-    COR4 = [i for i in zip(DF[f'sorted SVM-rbf4_{SESSION} name'], DF[f'sorted SVM-rbf4_{SESSION} mean'], DF[f'sorted SVM-rbf4_{SESSION} std']) if 'T1w_cor_' in i[0]]
-    COR5 = [i for i in zip(DF[f'sorted SVM-rbf5_{SESSION} name'], DF[f'sorted SVM-rbf5_{SESSION} mean'], DF[f'sorted SVM-rbf5_{SESSION} std']) if 'T1w_cor_' in i[0]]
-    COR6 = [i for i in zip(DF[f'sorted SVM-rbf6_{SESSION} name'], DF[f'sorted SVM-rbf6_{SESSION} mean'], DF[f'sorted SVM-rbf6_{SESSION} std']) if 'T1w_cor_' in i[0]]
+    # Sorted names of the 7 models stacked once, one substring scan per type
+    NAMES = DF[[f'sorted SVM-rbf{i}_{SESSION} name' for i in range(7)]].to_numpy(dtype=str).T
+    d, SETS = [], []
+    for TYPE, KEY in SHAP_TYPES.items():
+        MASK = np.char.find(NAMES, KEY) >= 0
+        SETS.append(set.intersection(*[set(j[i]) for j, i in zip(NAMES, MASK)]))
+        d.append([TYPE, *MASK.sum(axis=1).tolist(), len(SETS[-1])])
     # Common Features
-    set_DTI = (set([i[0] for i in DTI0]) & set([i[0] for i in DTI1])  & set([i[0] for i in DTI2]) & set([i[0] for i in DTI3]) &
-               set([i[0] for i in DTI4]) & set([i[0] for i in DTI5]) & set([i[0] for i in DTI6]))
-    set_T1w_Sub = (set([i[0] for i in SUBCOR0]) & set([i[0] for i in SUBCOR1]) & set([i[0] for i in SUBCOR2]) & 
-                   set([i[0] for i in SUBCOR3]) & set([i[0] for i in SUBCOR4]) & set([i[0] for i in SUBCOR5]) & set([i[0] for i in SUBCOR6]))
-    set_T1w_Cor = (set([i[0] for i in COR0]) & set([i[0] for i in COR1]) & set([i[0] for i in COR2]) &
-                   set([i[0] for i in COR3]) & set([i[0] for i in COR4]) & set([i[0] for i in COR5]) & set([i[0] for i in COR6]))
+    set_DTI, set_T1w_Sub, set_T1w_Cor = SETS
     # Generate the table
-    d = [["DTI", len(DTI0), len(DTI1), len(DTI2), len(DTI3), len(DTI4), len(DTI5), len(DTI6), len(set_DTI)],
-         ["T1w subcortical",len(SUBCOR0), len(SUBCOR1), len(SUBCOR2), len(SUBCOR3), len(SUBCOR4), len(SUBCOR5), len(SUBCOR6), len(set_T1w_Sub)],
-         ["T1w cortical",len(COR0), len(COR1), len(COR2), len(COR3), len(COR4), len(COR5), len(COR6), len(set_T1w_Cor)]]
     df = pd.DataFrame(d, columns = ['Type','SVM-rbf 0','SVM-rbf1','SVM-rbf2','SVM-rbf3','SVM-rbf4','SVM-rbf5','SVM-rbf6','Intersection'])
     
     if viz == True:
-#         print("DTI:    ",len(DTI0), len(DTI1), len(DTI2), len(DTI3), len(DTI4), len(DTI5), len(DTI6))
-#         print("SUBCOR: ",len(SUBCOR0), len(SUBCOR1), len(SUBCOR2), len(SUBCOR3), len(SUBCOR4), len(SUBCOR5), len(SUBCOR6))
-#         print("COR:    ",len(COR0), len(COR1), len(COR2), len(COR3), len(COR4), len(COR5), len(COR6))
         print(f"selected DTI (n={len(set_DTI)}): {set_DTI} \n\n"
               f"selected T1w Subcortical: (n={len(set_T1w_Sub)}): {set_T1w_Sub} \n\n"
               f"selected T1w Cortical: (n={len(set_T1w_Cor)}): {set_T1w_Cor} \n\n")
     return df
 
 def SHAP_plot(DATA, SHAP, TYPE, fig=False):
-    X, X_col_names, Other_list = posthoc.get_holdout_data(DATA, group=True)
+    if TYPE in ['Bar', 'Swarm']:
+        X, X_col_names, Other_list = posthoc.get_holdout_data(DATA, group=True)
+    else:
+        # group difference plots only need the names and the masks
+        X_col_names, Other_list = posthoc.get_META(DATA, group=True)
     with open(SHAP, 'rb') as fp:
         load_shap_values = pickle.load(fp)
 
@@ -0,0 +1,139 @@
+#################################################################################
+#!/usr/bin/env python
+# coding: utf-8
+""" Synthetic IMAGEN directory for the loader tests """
+# Author: JiHoon Kim, <jihoon.kim@fu-berlin.de>, 15th November 2021
+#
+import os
+import sys
+import h5py
+import pytest
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from imagen_posthocloader import *
+
+# ----------------------------------------------------- #
+# Raw psytools files: one file per (folder, csv)        #
+# ----------------------------------------------------- #
+# Subjects of the raw files, 71766352 and 12809392 are in EXCLUDE['PBQ']
+N = 40
+IDS = np.r_[71766352, 12809392, (10000000 + np.arange(N - 2)) * 7]
+
+# Raw values of the coded columns, the out of code-book values included
+VALUES = {
+    'test' : [0, 1, -1, -2, 5],
+    'day' : [0, 1, 2, -1, -2, 7],
+    'age' : [14, 15, 16, -1, -2],
+    'cigarettes' : [1, 2, 3, 8, 15, 25, 30, -1, -2, 4],
+    'alcohol' : [1, 2, 3, 4, -1, -2],
+    'drinks' : [0, 1, 2, 3, 4, -1, -2],
+    'stage' : [1, 2, 3, 12, 23, 13, 4, -1, -2],
+    'disorder' : [*CODES['disorder'], 'XX'],
+}
+
+def USER_CODE(DIR):
+    """ User code of the raw file: integer in FU3, 'ddd...-C' otherwise """
+    if DIR == 'FU3':
+        return IDS
+    return [f"{i:012d}-C" for i in IDS]
+
+def RAW_COLUMN(COL, DTYPE, DATA, rng):
+    """ Random raw values of one SCHEMA column """
+    CODE = CODEBOOK.get(DATA, {}).get(COL)
+    if CODE in VALUES:
+        X = rng.choice(np.array(VALUES[CODE], dtype=object), N)
+    elif DATA == 'BSI':
+        # 'R' (refused) instead of the missing values
+        return rng.choice(np.array(['0', '1', '2', '3', '4', 'R'], dtype=object),
+                          N, p=[.25, .2, .2, .2, .149, .001])
+    elif DTYPE == 'float32':
+        X = rng.integers(0, 6, N).astype(object)
+    else:
+        X = np.round(rng.random(N) * 5, 3).astype(object)
+    X[rng.random(N) < 0.1] = np.NaN
+    return X
+
+def make_PSYTOOLS(DATA_DIR, LIST=None, seed=0):
+    """ Write the raw psytools files of the instruments """
+    rng = np.random.default_rng(seed)
+    for DATA in PSYTOOLS if LIST is None else LIST:
+        for DIR, CSV in dict.fromkeys((DIR, CSV) for _, DIR, CSV in PSYTOOLS[DATA]):
+            path = f"{DATA_DIR}/IMAGEN_RAW/2.7/{DIR}/psytools/{CSV}"
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            DF = pd.DataFrame({'User code': USER_CODE(DIR),
+                               'Junk': rng.random(N),
+                               **{COL: RAW_COLUMN(COL, DTYPE, DATA, rng)
+                                  for COL, DTYPE in SCHEMA[DATA].items()}})
+            DF.to_csv(path, index=False)
+
+# ----------------------------------------------------- #
+# h5 files: X, feature names and the subject datasets   #
+# ----------------------------------------------------- #
+FEATURES = [
+    *[f'T1w_cor_{i}-{j}-thickness' for i in ['superiorfrontal', 'insula', 'cuneus']
+      for j in ['lh', 'rh']],
+    *[f'T1w_subcor_{i}-{j}-volume' for i in ['Hippocampus', 'Amygdala']
+      for j in ['Left', 'Right']],
+    'T1w_global_ICV-volume', 'DTI_FA_ACR-L)', 'DTI_FA_ACR-R)', 'DTI_MD_CST-L)',
+]
+
+def make_H5(DATA_DIR, DATA='Binge', seed=0):
+    """ Write the h5 files of H5FILES[DATA] """
+    rng = np.random.default_rng(seed)
+    os.makedirs(f"{DATA_DIR}/h5files", exist_ok=True)
+    for k, (SES, DATASET, H5) in enumerate(H5FILES[DATA]):
+        n = 30 if DATASET == 'Training' else 12
+        with h5py.File(f"{DATA_DIR}/h5files/{H5}", 'w') as d:
+            d.attrs['X_col_names'] = FEATURES
+            d.attrs['labels'] = [DATA]
+            d['X'] = rng.random((n, len(FEATURES)))
+            d['i'] = IDS[k:k + n]
+            d['sex'] = rng.integers(0, 2, n).astype(float)
+            d['site'] = rng.integers(0, len(SITE), n)
+            d[DATA] = rng.integers(0, 2, n).astype(float)
+
+# ----------------------------------------------------- #
+# ML run.csv: the RUN columns by position               #
+# ----------------------------------------------------- #
+def make_RUNCSV(path, n_runs=12, seed=0):
+    """ Write a run.csv with the test and holdout list columns """
+    rng = np.random.default_rng(seed)
+    ROWS = []
+    for k in range(n_runs):
+        n, m = rng.integers(4, 10), rng.integers(2, 6)
+        ROWS.append({
+            'Unnamed: 0': k, 'io': 'X-y', 'technique': 'cb',
+            'model': ['SVM-rbf', 'GB', 'LR', 'SVM-lin'][k % 4], 'trial': k % 7,
+            'n_samples': 100, 'n_samples_cc': 90, 'i': 'X', 'o': 'Binge',
+            'i_is_conf': False, 'o_is_conf': False,
+            'train_score': rng.random(), 'valid_score': rng.random(),
+            'test_score': rng.random(), 'roc_auc': rng.random(),
+            'test_ids': str([int(i) for i in rng.choice(IDS, n)]),
+            'test_lbls': str([int(i) for i in rng.integers(0, 2, n)]),
+            'test_probs': str([[1 - float(i), float(i)] for i in rng.random(n)]),
+            'model_SVM-rbf__C': 1.0, 'model_SVM-rbf__gamma': 0.1,
+            'runtime': 3.2, 'model_SVM-lin__C': 1.0,
+            'model_GB__learning_rate': 0.1, 'model_LR__C': 1.0, 'path': '/x',
+            'session': ['bl', 'fu2', 'fu3'][k % 3],
+            'holdout_score': rng.random(), 'holdout_roc_auc': rng.random(),
+            'holdout_ids': str([int(i) for i in rng.choice(IDS, m)]),
+            'holdout_lbls': str([int(i) for i in rng.integers(0, 2, m)]),
+            'holdout_probs': str([[1 - float(i), float(i)] for i in rng.random(m)]),
+            'permuted_test_score': str([float(i) for i in rng.random(20)]),
+            'permuted_roc_auc': str([float(i) for i in rng.random(20)]),
+        })
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pd.DataFrame(ROWS).to_csv(path, index=False)
+    return path
+
+@pytest.fixture
+def DATA_DIR(tmp_path):
+    """ IMAGEN directory with the raw psytools, h5 files and a run.csv """
+    DATA_DIR = str(tmp_path / 'IMAGEN')
+    make_PSYTOOLS(DATA_DIR)
+    make_H5(DATA_DIR)
+    make_RUNCSV(f"{DATA_DIR}/results/experiment/run.csv")
+    yield DATA_DIR
+    close_H5()
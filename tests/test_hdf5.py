@@ -0,0 +1,165 @@
+#################################################################################
+#!/usr/bin/env python
+# coding: utf-8
+""" HDF5_loader: labels, h5 handle pool, lazy X, catalogue and datasets """
+# Author: JiHoon Kim, <jihoon.kim@fu-berlin.de>, 15th November 2021
+#
+import os
+import h5py
+import numpy as np
+import pandas as pd
+import pytest
+from imagen_posthocloader import *
+from conftest import FEATURES, IDS
+
+def H5_PATH(DATA_DIR, k=0):
+    return f"{DATA_DIR}/h5files/{H5FILES['Binge'][k][2]}"
+
+# ----------------------------------------------------- #
+# Labels of the h5 files                                #
+# ----------------------------------------------------- #
+def test_set_HDF5(DATA_DIR):
+    # positional save, as before n_jobs was added
+    DF3 = HDF5_loader(DATA_DIR).set_HDF5('Binge', True)
+    assert os.path.isfile(f"{DATA_DIR}/posthoc/all_Binge.csv")
+    pd.testing.assert_frame_equal(
+        HDF5_loader(DATA_DIR).set_HDF5('Binge', n_jobs=1), DF3)
+    LIST = []
+    for SES, DATASET, H5 in H5FILES['Binge']:
+        with h5py.File(f"{DATA_DIR}/h5files/{H5}", 'r') as d:
+            LIST.append(pd.DataFrame({
+                'ID': d['i'][()], 'Session': SES, 'y': 'Binge', 'Dataset': DATASET,
+                'Sex': ['Male' if i == 0 else 'Female' for i in d['sex'][()]],
+                'Site': [SITE[i] for i in d['site'][()]],
+                'Class': ['HC' if i == 0 else 'AAM' for i in d['Binge'][()]]}))
+    pd.testing.assert_frame_equal(DF3.astype({'Sex': object, 'Site': object,
+                                              'Class': object}),
+                                  pd.concat(LIST))
+
+def test_set_LABEL_invalid(DATA_DIR):
+    with h5py.File(H5_PATH(DATA_DIR), 'r+') as d:
+        d['Binge'][0] = 2
+    with pytest.raises(ValueError, match=r"Binge values \[2.\] are not codes"):
+        HDF5_loader(DATA_DIR).set_LABEL('Binge', *H5FILES['Binge'][0])
+    with h5py.File(H5_PATH(DATA_DIR), 'r+') as d:
+        d['Binge'][0] = np.NaN
+    with pytest.raises(ValueError, match="are not codes"):
+        HDF5_loader(DATA_DIR).set_HDF5('Binge')
+
+# ----------------------------------------------------- #
+# h5 handle pool and the metadata without X             #
+# ----------------------------------------------------- #
+def test_open_H5_pool(DATA_DIR, monkeypatch):
+    monkeypatch.setattr('imagen_posthocloader.H5POOL_SIZE', 2)
+    close_H5()
+    PATH = [H5_PATH(DATA_DIR, k) for k in range(3)]
+    data = open_H5(PATH[0])
+    assert open_H5(PATH[0]) is data
+    # bounded: the least recently used handle is closed
+    open_H5(PATH[1]), open_H5(PATH[2])
+    assert list(H5POOL) == PATH[1:] and not data.id.valid
+    # a rewritten file is opened again
+    OLD = open_H5(PATH[2])
+    with h5py.File(PATH[2] + '.new', 'w') as d, h5py.File(PATH[2], 'r') as e:
+        for KEY in e:
+            d[KEY] = e[KEY][()]
+        d.attrs.update(e.attrs)
+        d['i'][0] = 1
+    os.replace(PATH[2] + '.new', PATH[2])
+    os.utime(PATH[2], ns=(0, 0))
+    assert open_H5(PATH[2]) is not OLD and not OLD.id.valid
+    assert read_META(PATH[2])[1][1][0] == 1
+    close_H5(PATH[1])
+    assert list(H5POOL) == PATH[2:]
+    close_H5()
+    assert not H5POOL
+
+def test_read_META(DATA_DIR):
+    path = H5_PATH(DATA_DIR)
+    X_col_names, Other = read_META(path, group=True)
+    with h5py.File(path, 'r') as d:
+        assert list(X_col_names) == [i.replace(')', '') for i in FEATURES]
+        for A, KEY in zip(Other, ['Binge', 'i', 'sex', 'Binge']):
+            np.testing.assert_array_equal(A, d[KEY][()])
+    # cached: the same arrays, the same result as get_holdout_data
+    assert read_META(path, group=True)[1][0] is Other[0]
+    with HDF5_loader(DATA_DIR) as DATA:
+        X, NAMES, OTHER = DATA.get_holdout_data(H5FILES['Binge'][0][2])
+        assert X.shape == (30, len(FEATURES))
+        np.testing.assert_array_equal(NAMES, X_col_names)
+        assert H5POOL
+    assert not H5POOL
+
+# ----------------------------------------------------- #
+# Lazy feature matrix                                   #
+# ----------------------------------------------------- #
+def test_runs():
+    assert runs(np.array([0, 1, 2, 7, 8, 10])) == \
+        [slice(0, 3), slice(7, 9), slice(10, 11)]
+    assert runs(np.array([], dtype=np.int64)) == []
+
+def test_H5_matrix(DATA_DIR):
+    path = H5_PATH(DATA_DIR)
+    with h5py.File(path, 'r') as d:
+        DENSE = d['X'][()]
+    X = H5_matrix(path)
+    np.testing.assert_array_equal(np.asarray(X), DENSE)
+    # scattered, unsorted and repeated rows and columns
+    ROWS, COLS = np.array([17, 3, 4, 5, 29, 3, 0]), np.array([9, 2, 3, 12, 2])
+    VIEW = H5_matrix(path, COLS=COLS).take(ROWS)
+    assert VIEW.shape == (7, 5)
+    np.testing.assert_array_equal(VIEW.to_numpy(), DENSE[np.ix_(ROWS, COLS)])
+    np.testing.assert_array_equal(VIEW.take(np.array([], dtype=int)).to_numpy(), DENSE[:0, COLS])
+    # prefix selection and chunks
+    DTI = X.select('DTI_').take(X.ROWS[::-2])
+    POS = [i for i, j in enumerate(FEATURES) if j.startswith('DTI_')]
+    assert list(DTI.columns) == [FEATURES[i].replace(')', '') for i in POS]
+    CHUNKS = [CHUNK for _, CHUNK in DTI.iter_chunks(4)]
+    assert [len(i) for i in CHUNKS] == [4, 4, 4, 3]
+    np.testing.assert_array_equal(np.vstack(CHUNKS), DENSE[::-2][:, POS])
+    SUB = X.select(columns=['T1w_global_ICV-volume', 'DTI_FA_ACR-L'])
+    np.testing.assert_array_equal(SUB.to_numpy(), DENSE[:, [10, 11]])
+
+# ----------------------------------------------------- #
+# Feature catalogue                                     #
+# ----------------------------------------------------- #
+def test_read_CATALOGUE(DATA_DIR):
+    path = H5_PATH(DATA_DIR)
+    CAT, INDEX = read_CATALOGUE(path)
+    assert read_CATALOGUE(path)[0] is CAT
+    assert CAT['Feature name'].tolist() == [i.replace(')', '') for i in FEATURES]
+    NAMES = CAT['Feature name'].to_numpy()
+    assert list(NAMES[INDEX['Type']['Cortical region']]) == FEATURES[:6]
+    assert list(NAMES[INDEX['Type']['Subcortical region']]) == FEATURES[6:10]
+    assert list(NAMES[INDEX['Modality']['DTI']]) == list(NAMES[11:])
+    assert CAT.loc[INDEX['Lobe Region']['Occipital lobe'], 'Hemisphere'].tolist() \
+        == ['Left', 'Right']
+    assert CAT['Value'][0] == 'thickness'
+
+# ----------------------------------------------------- #
+# Cross-session dataset of the h5 files                 #
+# ----------------------------------------------------- #
+def test_H5_dataset(DATA_DIR):
+    D = HDF5_loader(DATA_DIR).get_DATASET('Binge')
+    DIRECT = {}
+    for SES, DATASET, H5 in H5FILES['Binge']:
+        with h5py.File(f"{DATA_DIR}/h5files/{H5}", 'r') as d:
+            DIRECT[SES, DATASET] = pd.DataFrame(
+                d['X'][()], index=d['i'][()],
+                columns=[i.replace(')', '') for i in FEATURES])
+    assert len(D) == sum(len(i) for i in DIRECT.values())
+    # one subject across the sessions and datasets
+    ID = IDS[3]
+    DF = D.read(ID=ID, prefix='DTI_')
+    assert list(DF.columns) == [i.replace(')', '') for i in FEATURES[11:]]
+    assert len(DF) == sum(ID in i.index for i in DIRECT.values())
+    for (SES, DATASET, _), ROW in DF.iterrows():
+        np.testing.assert_array_equal(ROW, DIRECT[SES, DATASET].loc[ID, DF.columns])
+    # holdout of one session, the asked columns in order
+    COLS = ['T1w_global_ICV-volume', 'T1w_cor_insula-lh-thickness']
+    SES, DATASET, _ = next(i for i in H5FILES['Binge'] if i[1] == 'Holdout')
+    DF = D.read(session=SES, dataset=DATASET, columns=COLS)
+    EXPECT = DIRECT[SES, DATASET][COLS].sort_index()
+    np.testing.assert_array_equal(DF.to_numpy(), EXPECT.to_numpy())
+    assert DF.index.get_level_values('ID').tolist() == EXPECT.index.tolist()
+    assert D.read(ID=[1]).empty
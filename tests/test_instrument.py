@@ -0,0 +1,205 @@
+#################################################################################
+#!/usr/bin/env python
+# coding: utf-8
+""" INSTRUMENT_loader: code-book, raw reads, build and storage of instruments """
+# Author: JiHoon Kim, <jihoon.kim@fu-berlin.de>, 15th November 2021
+#
+import numpy as np
+import pandas as pd
+import pytest
+from imagen_posthocloader import *
+from imagen_subjectkey import SESSIONS
+from conftest import make_PSYTOOLS
+
+# ----------------------------------------------------- #
+# Code-book decoding                                    #
+# ----------------------------------------------------- #
+def LOOKUP(SERIES, CODE):
+    """ Decode value by value, as the former per-instrument functions """
+    MAP = CODES[CODE]
+    if CODE in KEEP:
+        return [MAP.get(i, i) for i in SERIES]
+    return [MAP.get(i, np.NaN) for i in SERIES]
+
+@pytest.mark.parametrize('CODE', [i for i in CODES if i != 'disorder'])
+def test_decode_codes(CODE):
+    SERIES = pd.Series([*CODES[CODE], 99, np.NaN] * 3, dtype=np.float32)
+    LABEL = pd.Series(decode(SERIES, CODE), dtype=object)
+    EXPECT = pd.Series(LOOKUP(SERIES, CODE), dtype=object)
+    pd.testing.assert_series_equal(LABEL, EXPECT, check_names=False)
+    if CODE not in KEEP:
+        assert list(decode(SERIES, CODE).categories) == list(CODES[CODE].values())
+
+def test_decode_bins():
+    SERIES = pd.Series([0, 3, 4, 5, 6, 7, 10, 11, np.NaN], dtype=np.float32)
+    FLAG = ['positive alchololism screening' if i > 4 else
+            'negative alchololism screening' for i in SERIES]
+    assert list(decode(SERIES, 'flag')) == FLAG
+    DEPENDENCE = ['less dependent', 'less dependent', 'moderately dependent',
+                  'moderately dependent', 'moderately dependent',
+                  'highly dependent', 'highly dependent', np.NaN, np.NaN]
+    assert pd.Series(decode(SERIES, 'dependence'), dtype=object).equals(
+        pd.Series(DEPENDENCE, dtype=object))
+
+def test_set_INSTRUMENT_PBQ(DATA_DIR):
+    PBQ = INSTRUMENT_loader(DATA_DIR).set_INSTRUMENT('PBQ')
+    RAW = pd.read_csv(f"{DATA_DIR}/IMAGEN_RAW/2.7/BL/psytools/"
+                      "IMAGEN-IMGN_PBQ_RC1-BASIC_DIGEST.csv")
+    RAW['ID'] = RAW['User code'].str[:12].astype(np.int64)
+    BL = PBQ[PBQ['Session'] == 'BL'].set_index('ID')
+    RAW = RAW.set_index('ID').loc[BL.index]
+    for COL, CODE in CODEBOOK['PBQ'].items():
+        EXPECT = pd.Series(LOOKUP(RAW[COL], CODE), index=BL.index, dtype=object)
+        pd.testing.assert_series_equal(BL[COL].astype(object), EXPECT,
+                                       check_names=False)
+
+# ----------------------------------------------------- #
+# Parallel build of several instruments                 #
+# ----------------------------------------------------- #
+def test_build_instruments_parallel(DATA_DIR):
+    LIST = ['NEO', 'GEN', 'BSI', 'FTND']
+    SERIAL = INSTRUMENT_loader(DATA_DIR).build_instruments(LIST, n_jobs=1)
+    PARALLEL = INSTRUMENT_loader(DATA_DIR).build_instruments(LIST, n_jobs=2)
+    assert list(PARALLEL) == LIST
+    for DATA in LIST:
+        pd.testing.assert_frame_equal(PARALLEL[DATA], SERIAL[DATA])
+        assert list(PARALLEL[DATA]['Session'].unique()) == \
+            [i for i in SESSIONS if i in [j[0] for j in PSYTOOLS[DATA]]]
+
+# ----------------------------------------------------- #
+# Raw columns and dtypes read per instrument            #
+# ----------------------------------------------------- #
+@pytest.mark.parametrize('DATA', ['PBQ', 'GEN', 'NEO', 'BSI', 'CTQ_MD'])
+def test_read_PSYTOOLS_schema(DATA_DIR, DATA):
+    _, DIR, CSV = PSYTOOLS[DATA][0]
+    DF = read_PSYTOOLS(f"{DATA_DIR}/IMAGEN_RAW/2.7/{DIR}/psytools/{CSV}", DATA)
+    assert list(DF.columns) == ['User code', *SCHEMA[DATA]]
+    for COL, DTYPE in SCHEMA[DATA].items():
+        assert DF[COL].dtype == DTYPE
+
+# ----------------------------------------------------- #
+# Raw psytools cache                                    #
+# ----------------------------------------------------- #
+def test_read_PSYTOOLS_cache(DATA_DIR, monkeypatch):
+    monkeypatch.setattr('imagen_posthocloader.RAW_SIZE', 2)
+    RAW.clear()
+    PATH = [f"{DATA_DIR}/IMAGEN_RAW/2.7/{DIR}/psytools/{CSV}"
+            for _, DIR, CSV in PSYTOOLS['NEO']]
+    FIRST = read_PSYTOOLS(PATH[0], 'NEO')
+    CACHED = next(iter(RAW.values()))
+    # the sessions sharing a file get the cached columns, as copies
+    FIRST['open_mean'].fillna(-9, inplace=True)
+    FIRST['open_mean'].values[0] = -9
+    SECOND = read_PSYTOOLS(PATH[0], 'NEO')
+    assert next(iter(RAW.values())) is CACHED
+    pd.testing.assert_series_equal(SECOND['open_mean'], CACHED['open_mean'])
+    assert not (SECOND['open_mean'] == -9).any()
+    # bounded: the least recently used file is dropped
+    for path in PATH[1:]:
+        read_PSYTOOLS(path, 'NEO')
+    assert [i[0] for i in RAW] == PATH[-2:]
+    # a rewritten file replaces the entry of its previous version
+    pd.read_csv(PATH[-1]).head(5).to_csv(PATH[-1], index=False)
+    assert len(read_PSYTOOLS(PATH[-1], 'NEO')) == 5
+    assert [i[0] for i in RAW] == PATH[-2:]
+    RAW.clear()
+
+# ----------------------------------------------------- #
+# Incremental rebuild from the manifests                #
+# ----------------------------------------------------- #
+@pytest.mark.parametrize('FORMAT', ['csv', 'parquet'])
+def test_build_instruments_update(DATA_DIR, FORMAT, monkeypatch):
+    LIST = list(PSYTOOLS)
+    BUILT = INSTRUMENT_loader(DATA_DIR, FORMAT).build_instruments(
+        LIST, save=True, update=True)
+    # up to date: loaded from the saved files, nothing is decoded again
+    monkeypatch.setattr('imagen_posthocloader._set_SESSION', None)
+    LOADED = INSTRUMENT_loader(DATA_DIR, FORMAT).build_instruments(
+        LIST, update=True)
+    for DATA in LIST:
+        pd.testing.assert_frame_equal(LOADED[DATA], BUILT[DATA])
+    monkeypatch.undo()
+    # a rewritten raw file rebuilds its instrument only
+    make_PSYTOOLS(DATA_DIR, ['NEO'], seed=1)
+    NEW = INSTRUMENT_loader(DATA_DIR, FORMAT).build_instruments(
+        ['NEO', 'MAST'], update=True)
+    assert not NEW['NEO'].equals(BUILT['NEO'])
+    pd.testing.assert_frame_equal(NEW['MAST'], BUILT['MAST'])
+
+# ----------------------------------------------------- #
+# Subscale scoring                                      #
+# ----------------------------------------------------- #
+@pytest.mark.parametrize('DATA', list(SCALES))
+def test_score(DATA):
+    rng = np.random.default_rng(0)
+    ITEMS = sorted({i for COLS, _ in SCALES[DATA].values() for i in COLS})
+    DF = pd.DataFrame(rng.integers(0, 5, (50, len(ITEMS))).astype(np.float32),
+                      columns=ITEMS)
+    DF = DF.mask(rng.random(DF.shape) < 0.02)
+    SCORE = score(DF, DATA)
+    for NAME, (COLS, HOW) in SCALES[DATA].items():
+        X = DF[COLS].astype(np.float64)
+        EXPECT = X.sum(axis=1, skipna=False) if HOW == 'sum' \
+            else X.mean(axis=1, skipna=False)
+        pd.testing.assert_series_equal(SCORE[NAME], EXPECT, check_names=False)
+
+def test_score_missing_and_reverse(monkeypatch):
+    monkeypatch.setitem(REVERSE, 'PANAS_03', 6)
+    DF = pd.DataFrame(np.full((2, 20), 2, dtype=np.float32),
+                      columns=[f'PANAS_{i:02d}' for i in range(1, 21)])
+    DF.loc[1, 'PANAS_01'] = np.NaN
+    SCORE = score(DF, 'PANAS', MAX_MISSING=1)
+    # 9 items of 2 and PANAS_03 scored 6 - 2, prorated to 10 items
+    assert SCORE['Positive Affect Score'].tolist() == [22, (16 + 4) * 10 / 9]
+    assert SCORE['Negative Affect Score'].tolist() == [20, 20]
+
+# ----------------------------------------------------- #
+# GEN disorders: indicator matrix and joined views      #
+# ----------------------------------------------------- #
+def test_join_DISORDER():
+    DF = pd.DataFrame({
+        'Disorder_PF_1' : ['ALC', 'SCZ', np.NaN, 'XX'],
+        'Disorder_PF_2' : ['DRUG', np.NaN, np.NaN, 'ALC'],
+        # listed twice for the first subject
+        'Disorder_PF_3' : ['ALC', 'ALC', np.NaN, np.NaN],
+    })
+    IND = indicate(DF, list(DF.columns), 'disorder')
+    assert IND.shape == (4, len(CODES['disorder'])) and IND.dtype == bool
+    GEN = pd.DataFrame({f'{P}_{i}': IND[:, k] for P in ['Paternal', 'Maternal']
+                        for k, i in enumerate(CODES['disorder'])})
+    GEN = join_DISORDER(GEN)
+    assert GEN['Paternal_disorder'].tolist() == [
+        'Alcohol problems,Drug problems', 'Alcohol problems,Schizophrenia',
+        '', 'Alcohol problems']
+    assert GEN['Pd_list'].tolist() == [
+        ['Alcohol problems', 'Drug problems'],
+        ['Alcohol problems', 'Schizophrenia'], [], ['Alcohol problems']]
+
+def test_set_INSTRUMENT_GEN(DATA_DIR):
+    GEN = INSTRUMENT_loader(DATA_DIR).set_INSTRUMENT('GEN')
+    RAW = pd.read_csv(f"{DATA_DIR}/IMAGEN_RAW/2.7/BL/psytools/"
+                      "IMAGEN-IMGN_GEN_RC5-BASIC_DIGEST.csv")
+    RAW['ID'] = RAW['User code'].str[:12].astype(np.int64)
+    FU3 = GEN[GEN['Session'] == 'FU3'].set_index('ID')
+    RAW = RAW.set_index('ID').loc[FU3.index]
+    for i, CODE in enumerate(CODES['disorder']):
+        EXPECT = (RAW[[f'Disorder_PM_{j}' for j in range(1, 7)]] == CODE).any(axis=1)
+        assert (FU3[f'Maternal_{CODE}'] == EXPECT).all()
+
+# ----------------------------------------------------- #
+# Compact dtypes                                        #
+# ----------------------------------------------------- #
+def test_compact():
+    DF = pd.DataFrame({'ID': [1.0, 2.0], 'sum': [3.0, np.NaN],
+                       'mean': [1 / 3, 0.5]})
+    DF = compact(DF)
+    assert DF.dtypes.tolist() == [np.float64, np.float32, np.float64]
+
+def test_set_INSTRUMENT_dtypes(DATA_DIR):
+    PBQ = INSTRUMENT_loader(DATA_DIR).set_INSTRUMENT('PBQ')
+    assert PBQ['Session'].dtype == pd.CategoricalDtype(SESSIONS, ordered=True)
+    assert PBQ['pbq_03'].dtype == pd.CategoricalDtype(list(CODES['test'].values()))
+    OBJECT = PBQ.astype({i: object for i in CODEBOOK['PBQ']})
+    assert PBQ.memory_usage(deep=True).sum() < OBJECT.memory_usage(deep=True).sum()
+    PANAS = INSTRUMENT_loader(DATA_DIR).set_INSTRUMENT('PANAS')
+    assert (PANAS[list(SCALES['PANAS'])].dtypes == np.float32).all()
@@ -0,0 +1,55 @@
+#################################################################################
+#!/usr/bin/env python
+# coding: utf-8
+""" imagen_listparser: run.csv list columns without eval """
+# Author: JiHoon Kim, <jihoon.kim@fu-berlin.de>, 15th November 2021
+#
+import numpy as np
+import pandas as pd
+import pytest
+from imagen_listparser import *
+from conftest import make_RUNCSV
+
+# ----------------------------------------------------- #
+# Same values as eval on the run.csv list columns       #
+# ----------------------------------------------------- #
+@pytest.mark.parametrize('COL', ['test_ids', 'test_lbls', 'test_probs',
+                                 'holdout_probs', 'permuted_roc_auc'])
+def test_parse_LIST_eval(tmp_path, COL):
+    df = pd.read_csv(make_RUNCSV(tmp_path / 'run.csv'))
+    VALUES, OFFSETS = parse_LIST(df[COL])
+    EXPECT = [np.array(eval(i)) for i in df[COL]]
+    assert VALUES.dtype == EXPECT[0].dtype
+    for A, B in zip(split_LIST(VALUES, OFFSETS), EXPECT):
+        np.testing.assert_array_equal(A, B)
+
+def test_parse_LIST_dtypes():
+    VALUES, OFFSETS = parse_LIST(pd.Series(['[1, 2]', '[]', '[3]']))
+    assert VALUES.dtype == np.int64 and OFFSETS.tolist() == [0, 2, 2, 3]
+    VALUES, _ = parse_LIST(pd.Series(['[1, 2]', '[1e-05, nan]']))
+    assert VALUES.dtype == np.float64 and np.isnan(VALUES[-1])
+    VALUES, OFFSETS = parse_LIST(pd.Series(['[[0.2, 0.8]]', '[[1, 0], [0, 1]]']))
+    assert VALUES.shape == (3, 2) and OFFSETS.tolist() == [0, 1, 3]
+
+@pytest.mark.parametrize('TEXT', ["[1, 'a']", "[__import__('os')]",
+                                  '[[1, 2], [3]]'])
+def test_parse_LIST_invalid(TEXT):
+    with pytest.raises(ValueError):
+        parse_LIST(pd.Series(['[0, 1]', TEXT]))
+
+# ----------------------------------------------------- #
+# Missing cells                                         #
+# ----------------------------------------------------- #
+def test_parse_LIST_missing():
+    SERIES = pd.Series(['[1, 2]', np.NaN, '  ', None, '[3]'],
+                       index=[10, 11, 12, 13, 14], dtype=object)
+    with pytest.raises(ValueError, match=r"rows \[11, 12, 13\]"):
+        parse_LIST(SERIES)
+    VALUES, OFFSETS = parse_LIST(SERIES, missing='empty')
+    assert VALUES.tolist() == [1, 2, 3] and VALUES.dtype == np.int64
+    assert np.diff(OFFSETS).tolist() == [2, 0, 0, 0, 1]
+    VALUES, OFFSETS = parse_LIST(pd.Series([np.NaN, '[[0.2, 0.8]]']),
+                                 missing='empty')
+    assert VALUES.shape == (1, 2) and OFFSETS.tolist() == [0, 0, 1]
+    with pytest.raises(ValueError):
+        parse_LIST(SERIES, missing='skip')
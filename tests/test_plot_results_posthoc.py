@@ -0,0 +1,29 @@
+#################################################################################
+#!/usr/bin/env python
+# coding: utf-8
+""" plot_results_posthoc: SHAP tables """
+# Author: JiHoon Kim, <jihoon.kim@fu-berlin.de>, 15th November 2021
+#
+import numpy as np
+import pandas as pd
+from plot_results_posthoc import SHAP_table
+from conftest import FEATURES
+
+# ----------------------------------------------------- #
+# SHAP table: feature types by name substring           #
+# ----------------------------------------------------- #
+def test_SHAP_table():
+    rng = np.random.default_rng(0)
+    # 'DTI_' inside a name counts as DTI, as the substring scan always did
+    NAMES = [*FEATURES, 'T1w_subcor_DTI_like-volume', 'Global_T1w_cor_x']
+    DF = pd.DataFrame({f'sorted SVM-rbf{i}_FU3 name': rng.choice(NAMES, 12)
+                       for i in range(7)})
+    DF['sorted SVM-rbf0_FU3 name'] = NAMES[:12]
+    TABLE = SHAP_table(DF, 'FU3')
+    for TYPE, KEY in [['DTI', 'DTI_'], ['T1w subcortical', 'T1w_subcor_'],
+                      ['T1w cortical', 'T1w_cor_']]:
+        MODEL = [[j for j in DF[f'sorted SVM-rbf{i}_FU3 name'] if KEY in j]
+                 for i in range(7)]
+        ROW = TABLE.set_index('Type').loc[TYPE]
+        assert ROW.tolist() == [*[len(i) for i in MODEL],
+                                len(set.intersection(*[set(i) for i in MODEL]))]
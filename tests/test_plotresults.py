@@ -0,0 +1,43 @@
+#################################################################################
+#!/usr/bin/env python
+# coding: utf-8
+""" plotResults: permutation p-values of the run.csv scores """
+# Author: JiHoon Kim, <jihoon.kim@fu-berlin.de>, 15th November 2021
+#
+import numpy as np
+import pandas as pd
+import pytest
+from plotResults import calc_p_values
+from conftest import make_RUNCSV
+
+def LOOP(df, x="test_score"):
+    """ p-value per row with eval, averaged per group, as the former loop """
+    df["p_value"] = np.nan
+    grp_order = ["io", "technique", "model"]
+    if 'i_type' in df and len(df['i_type'].unique())>1:
+        grp_order.insert(0, 'i_type')
+    groups = df.dropna(subset=[x, f"permuted_{x}"]).groupby(grp_order)
+    for g, rows in groups:
+        p_vals = []
+        for _, r in rows.filter(like=x).iterrows():
+            p_scores = np.array(eval(r[f'permuted_{x}']))
+            p_vals.append((np.sum(p_scores >= r[x]) + 1) / (len(p_scores) + 1))
+        df.loc[(df[grp_order]==g).all(axis=1), "p_value"] = np.mean(p_vals)
+    return df
+
+# ----------------------------------------------------- #
+# Vectorized p-values against the former loop           #
+# ----------------------------------------------------- #
+@pytest.mark.parametrize('x', ['test_score', 'roc_auc'])
+def test_calc_p_values(tmp_path, x):
+    df = pd.read_csv(make_RUNCSV(tmp_path / 'run.csv', n_runs=30))
+    # ties with the permuted scores, missing rows and an input type column
+    df.loc[0, x] = eval(df.loc[0, f'permuted_{x}'])[3]
+    df.loc[1, f'permuted_{x}'] = np.NaN
+    df.loc[2, x] = np.NaN
+    df.loc[df['model'] == 'LR', x] = np.NaN
+    df['i_type'] = np.where(df.index % 2, 'X', 'Xc')
+    OUT = calc_p_values(df.copy(), x)
+    EXPECT = LOOP(df.copy(), x)
+    pd.testing.assert_series_equal(OUT['p_value'], EXPECT['p_value'])
+    assert OUT['p_value'].notna().sum() == (df['model'] != 'LR').sum()
@@ -0,0 +1,103 @@
+#################################################################################
+#!/usr/bin/env python
+# coding: utf-8
+""" IMAGEN_posthoc: instrument join, posthoc assembly and the lazy query """
+# Author: JiHoon Kim, <jihoon.kim@fu-berlin.de>, 15th November 2021
+#
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from imagen_posthocloader import *
+from imagen_subjectkey import sort_KEY
+
+# ----------------------------------------------------- #
+# Key-aligned join of the instruments                   #
+# ----------------------------------------------------- #
+def test_to_INSTRUMENT(DATA_DIR):
+    posthoc = IMAGEN_posthoc(DATA_DIR)
+    LIST = list(posthoc.build_instruments(['NEO', 'CTS', 'FTND', 'PBQ']).values())
+    Z = posthoc.to_INSTRUMENT(LIST)
+    # the former chain of outer merges
+    EXPECT = LIST[0]
+    for DF in LIST[1:]:
+        EXPECT = pd.merge(EXPECT, DF, on=['ID', 'Session'], how='outer')
+    EXPECT = sort_KEY(EXPECT.astype({'Session': str}))
+    assert list(Z.columns) == list(EXPECT.columns)
+    assert Z['Session'].dtype == LIST[0]['Session'].dtype
+    pd.testing.assert_frame_equal(Z.astype({'Session': str}), EXPECT,
+                                  check_dtype=False, check_categorical=False)
+
+# ----------------------------------------------------- #
+# All-session posthoc dataset                           #
+# ----------------------------------------------------- #
+def make_POSTHOC(DATA_DIR, FORMAT, SESSION=None):
+    """ Save the HDF5, INSTRUMENT and RUN inputs of to_posthoc """
+    posthoc = IMAGEN_posthoc(DATA_DIR, FORMAT)
+    posthoc.set_HDF5('Binge', save=True)
+    posthoc.to_INSTRUMENT(list(posthoc.build_instruments(
+        ['NEO', 'FTND', 'PBQ']).values()), save=True)
+    RUN = posthoc.set_RUN(f"{DATA_DIR}/results/experiment/run.csv")
+    if SESSION is not None:
+        RUN = RUN[RUN['Session'].isin(SESSION)]
+    write_TABLE(RUN, f"{DATA_DIR}/posthoc/all_RUN.csv", FORMAT)
+    return posthoc, [f'all_Binge{EXT[FORMAT]}', f'IMAGEN_INSTRUMENT{EXT[FORMAT]}',
+                     f'all_RUN{EXT[FORMAT]}']
+
+@pytest.mark.parametrize('FORMAT', ['csv', 'parquet'])
+def test_to_posthoc(DATA_DIR, FORMAT):
+    posthoc, DATA = make_POSTHOC(DATA_DIR, FORMAT)
+    DF = posthoc.to_posthoc(DATA, save=True)
+    assert sorted(DF['Session'].unique()) == ['BL', 'FU2', 'FU3']
+    # the sessions are joined independently, in parallel or not
+    pd.testing.assert_frame_equal(posthoc.to_posthoc(DATA, n_jobs=3), DF)
+    FU3 = posthoc.to_posthoc(DATA, SESSION=['FU3'])
+    pd.testing.assert_frame_equal(
+        FU3, DF[DF['Session'] == 'FU3'].reset_index(drop=True))
+    # HDF5 left join RUN left join INSTRUMENT
+    HDF5 = posthoc.read_HDF5(DATA[0])
+    RUN = posthoc.read_RUN(DATA[2])
+    assert len(DF) == len(pd.merge(HDF5, RUN, on=['ID', 'Session'], how='left'))
+    # saved partitioned by session
+    assert sorted(os.listdir(f"{DATA_DIR}/posthoc/IMAGEN_posthoc")) == \
+        ['Session=BL', 'Session=FU2', 'Session=FU3']
+    SAVED = posthoc.read_posthoc('IMAGEN_posthoc')
+    KEY = ['Session', 'ID', 'Trial', 'Model', 'dataset']
+    pd.testing.assert_frame_equal(
+        SAVED.sort_values(KEY, ignore_index=True),
+        DF.sort_values(KEY, ignore_index=True),
+        check_dtype=FORMAT != 'csv', check_categorical=False)
+
+# ----------------------------------------------------- #
+# Lazy query with partition pruning and pushdown        #
+# ----------------------------------------------------- #
+@pytest.mark.filterwarnings('error::pandas.errors.SettingWithCopyWarning')
+@pytest.mark.parametrize('FORMAT', ['csv', 'parquet'])
+def test_query(DATA_DIR, FORMAT):
+    # no RUN rows in BL and FU2: Model is missing in all their rows
+    posthoc, DATA = make_POSTHOC(DATA_DIR, FORMAT, SESSION=['FU3'])
+    DF = posthoc.to_posthoc(DATA, save=True)
+    COLS = ['ID', 'Session', 'Model', 'dataset', 'prediction']
+    for WHERE in [dict(session='FU3', model='GB'), dict(model=['GB', 'LR']),
+                  dict(session=['BL', 'FU3'], dataset='Holdout set'),
+                  dict(session='BL', model='GB')]:
+        OUT = posthoc.query(columns=COLS, **WHERE).collect()
+        MASK = np.ones(len(DF), dtype=bool)
+        for k, v in WHERE.items():
+            MASK &= DF[QUERY[k]].isin(v if isinstance(v, list) else [v])
+        EXPECT = DF.loc[MASK, COLS].reset_index(drop=True)
+        pd.testing.assert_frame_equal(
+            OUT.sort_values(COLS, ignore_index=True),
+            EXPECT.sort_values(COLS, ignore_index=True),
+            check_dtype=False, check_categorical=False)
+    # PROBS derived per partition from the saved Outcome, missing without RUN
+    assert 'T prob' not in DF
+    OUT = posthoc.query(columns=['Session', 'Prob', 'T prob']).collect()
+    EXPECT = derive(DF[['Session', 'Prob', 'Outcome', 'prediction']], ['T prob'])
+    KEY = ['Session', 'Prob', 'T prob']
+    pd.testing.assert_frame_equal(
+        OUT.astype({'Prob': object}).sort_values(KEY, ignore_index=True),
+        EXPECT[['Session', 'Prob', 'T prob']].astype({'Prob': object})
+        .sort_values(KEY, ignore_index=True),
+        check_dtype=False, check_categorical=False)
+    assert OUT.loc[OUT['Session'] == 'BL', 'T prob'].isna().all()
@@ -0,0 +1,238 @@
+#################################################################################
+#!/usr/bin/env python
+# coding: utf-8
+""" RUN_loader: run.csv subject rows, star tables, threshold sweep """
+# Author: JiHoon Kim, <jihoon.kim@fu-berlin.de>, 15th November 2021
+#
+import numpy as np
+import os
+from glob import glob
+import pandas as pd
+import pytest
+from imagen_posthocloader import *
+from conftest import make_RUNCSV
+
+def REFERENCE(run_file):
+    """ Explode run.csv row by row with eval, as the former set_RUN """
+    df = pd.read_csv(run_file, low_memory = False)
+    DF = []
+    for i in range(len(df)):
+        for DATASET, IDS, LBLS, PROBS in RUN_SETS:
+            DF.append(pd.DataFrame({
+                **{k: df.iloc[i, v] for k, v in RUN.items()},
+                'dataset' : DATASET,
+                'ID' : eval(df[IDS].values[i]),
+                'true_label' : eval(df[LBLS].values[i]),
+                'prediction' : [j[1] for j in eval(df[PROBS].values[i])]}))
+    DF2 = pd.concat(DF).reset_index(drop=True)
+    TRUE, PRED = DF2['true_label'], DF2['prediction']
+    MASK = {'TP': (TRUE == 1) & (PRED >= 0.5), 'TN': (TRUE == 0) & (PRED < 0.5),
+            'FP': (TRUE == 0) & (PRED >= 0.5), 'FN': (TRUE == 1) & (PRED < 0.5)}
+    for k in MASK:
+        DF2[f'{k} prob'] = DF2[MASK[k]]['prediction']
+    DF2['T prob'] = DF2[MASK['TP'] | MASK['TN']]['prediction']
+    DF2['F prob'] = DF2[MASK['FP'] | MASK['FN']]['prediction']
+    DF2['Prob'] = np.select(list(MASK.values()), list(MASK), 'Not Specified')
+    for VIEW, PAIRS in [('Predict TF', ['TP & TN', 'FP & FN']),
+                        ('Model PN', ['TP & FP', 'TN & FN']),
+                        ('Label PN', ['TP & FN', 'TN & FP'])]:
+        DF2[VIEW] = np.select([DF2['Prob'].isin(i.split(' & ')) for i in PAIRS],
+                              PAIRS, 'Not Specified')
+    DF2['Session'] = DF2['Session'].map({'bl':'BL', 'fu1':'FU1',
+                                         'fu2':'FU2', 'fu3':'FU3'})
+    return DF2
+
+def OBJECT(DF):
+    """ Categoricals as their labels, for the comparison """
+    return DF.astype({i: object for i in DF.select_dtypes('category')})
+
+# ----------------------------------------------------- #
+# Subject rows of run.csv                               #
+# ----------------------------------------------------- #
+def test_set_RUN(tmp_path):
+    run_file = make_RUNCSV(tmp_path / 'run.csv')
+    EXPECT = REFERENCE(run_file)
+    DF2 = derive(RUN_loader(str(tmp_path)).set_RUN(run_file), list(PROBS))
+    DF2 = OBJECT(DF2.drop(columns='Outcome'))
+    pd.testing.assert_frame_equal(DF2, EXPECT[DF2.columns], check_dtype=False)
+
+@pytest.mark.parametrize('COL', ['test_lbls', 'holdout_probs'])
+def test_set_RUN_lengths(tmp_path, COL):
+    run_file = make_RUNCSV(tmp_path / 'run.csv', n_runs=3)
+    df = pd.read_csv(run_file)
+    # one item moved from run 0 to run 1, the totals are unchanged
+    ROW0, ROW1 = eval(df.loc[0, COL]), eval(df.loc[1, COL])
+    df.loc[0, COL], df.loc[1, COL] = str(ROW0[1:]), str([ROW0[0], *ROW1])
+    df.to_csv(run_file, index=False)
+    with pytest.raises(ValueError, match=r"run rows \[0, 1\]"):
+        RUN_loader(str(tmp_path)).set_RUN(run_file)
+    with pytest.raises(ValueError):
+        REFERENCE(run_file)
+
+def test_set_RUN_not_specified(tmp_path):
+    run_file = make_RUNCSV(tmp_path / 'run.csv', n_runs=2)
+    df = pd.read_csv(run_file)
+    df.loc[0, 'test_lbls'] = str([2] * (df.loc[0, 'test_ids'].count(',') + 1))
+    df.to_csv(run_file, index=False)
+    DF2 = RUN_loader(str(tmp_path)).set_RUN(run_file)
+    TEST = (DF2.index < df.loc[0, 'test_ids'].count(',') + 1)
+    assert (DF2.loc[TEST, 'Outcome'] == -1).all()
+    assert (DF2.loc[TEST, list(VIEWS)] == 'Not Specified').all().all()
+    pd.testing.assert_frame_equal(OBJECT(DF2[list(VIEWS)]),
+                                  REFERENCE(run_file)[list(VIEWS)])
+
+# ----------------------------------------------------- #
+# Star tables: runs and subject predictions             #
+# ----------------------------------------------------- #
+@pytest.mark.parametrize('FORMAT', ['csv', 'parquet'])
+def test_set_RUN_star(tmp_path, FORMAT):
+    run_file = make_RUNCSV(tmp_path / 'run.csv')
+    LOADER = RUN_loader(str(tmp_path), FORMAT)
+    DF2 = LOADER.set_RUN(run_file)
+    RUNS, PRED = LOADER.set_RUN(run_file, save=True, star=True)
+    assert len(RUNS) == 12 and RUNS['run_id'].is_unique
+    assert len(PRED) == len(DF2) and PRED['Outcome'].dtype == np.int8
+    pd.testing.assert_frame_equal(OBJECT(join_RUN(RUNS, PRED)), OBJECT(DF2),
+                                  check_dtype=False)
+    # saved tables give the same join
+    R = read_TABLE(f"{tmp_path}/posthoc/all_RUN_runs.{FORMAT}")
+    P = read_TABLE(f"{tmp_path}/posthoc/all_RUN_predictions.{FORMAT}")
+    pd.testing.assert_frame_equal(OBJECT(join_RUN(R, P, ['Session', 'Model'])),
+                                  OBJECT(DF2[['Session', 'Model', *PRED.columns[1:],
+                                              *VIEWS]]), check_dtype=False)
+
+# ----------------------------------------------------- #
+# Outcome views derived on read                         #
+# ----------------------------------------------------- #
+def test_derive():
+    DF = pd.DataFrame({'Outcome': np.array([0, 1, 2, 3, -1], dtype=np.int8),
+                       'prediction': [.1, .2, .7, .9, np.NaN]})
+    COPY = DF.copy()
+    OUT = derive(DF, ['Prob', 'Model PN', 'T prob'])
+    # the input is not modified
+    pd.testing.assert_frame_equal(DF, COPY)
+    assert OUT['Prob'].tolist() == ['TN', 'FN', 'FP', 'TP', 'Not Specified']
+    assert OUT['Model PN'].tolist() == ['TN & FN', 'TN & FN', 'TP & FP',
+                                        'TP & FP', 'Not Specified']
+    np.testing.assert_array_equal(OUT['T prob'], [.1, np.NaN, np.NaN, .9, np.NaN])
+
+@pytest.mark.parametrize('FORMAT', ['csv', 'parquet'])
+def test_query_views(DATA_DIR, FORMAT):
+    posthoc = IMAGEN_posthoc(DATA_DIR, FORMAT)
+    posthoc.set_RUN(f"{DATA_DIR}/results/experiment/run.csv", save=True)
+    FILE = f'all_RUN{EXT[FORMAT]}'
+    COLS = ['ID', 'Session', 'Prob', 'T prob']
+    EXPECT = posthoc.get_RUN(FILE, COLS)
+    assert EXPECT['T prob'].notna().any()
+    OUT = posthoc.query(FILE, columns=COLS).collect()
+    pd.testing.assert_frame_equal(OUT, EXPECT)
+    # filter on a derived view, FP prob only set on its rows
+    OUT = posthoc.query(FILE, session='FU3', columns=['ID', 'FP prob']) \
+        .where(Prob='FP').collect()
+    ALL = posthoc.get_RUN(FILE, ['ID', 'Session', 'Prob', 'FP prob'])
+    EXPECT = ALL[(ALL['Session'] == 'FU3') & (ALL['Prob'] == 'FP')]
+    pd.testing.assert_frame_equal(OUT, EXPECT[['ID', 'FP prob']]
+                                  .reset_index(drop=True))
+    assert list(posthoc.query(FILE).where(Prob='TP').collect().columns) == \
+        list(read_COLUMNS(f"{DATA_DIR}/posthoc/{FILE}"))
+
+# ----------------------------------------------------- #
+# Threshold sweep per model                             #
+# ----------------------------------------------------- #
+def test_sweep(tmp_path):
+    from sklearn.metrics import roc_auc_score, average_precision_score, roc_curve
+    DF = RUN_loader(str(tmp_path)).set_RUN(make_RUNCSV(tmp_path / 'run.csv'))
+    # ties and a single class group
+    DF['prediction'] = np.round(DF['prediction'], 1)
+    DF.loc[DF['Trial'] == 0, 'true_label'] = 1
+    CURVE, SCORE = sweep(DF)
+    for _, ROW in SCORE.iterrows():
+        G = DF[(DF[SWEEP] == ROW[SWEEP]).all(axis=1)]
+        Y, S = G['true_label'], G['prediction']
+        assert ROW['n'] == len(G) and ROW['P'] == Y.sum()
+        if Y.nunique() < 2:
+            assert np.isnan(ROW['roc_auc'])
+            continue
+        assert ROW['roc_auc'] == pytest.approx(roc_auc_score(Y, S))
+        assert ROW['average_precision'] == \
+            pytest.approx(average_precision_score(Y, S))
+        C = CURVE[(CURVE[SWEEP] == ROW[SWEEP]).all(axis=1)]
+        FPR, TPR, THRESHOLD = roc_curve(Y, S, drop_intermediate=False)
+        np.testing.assert_allclose(C['threshold'], THRESHOLD[1:])
+        np.testing.assert_allclose(C['TPR'], TPR[1:])
+        np.testing.assert_allclose(C['FPR'], FPR[1:])
+        assert (C['TP'] + C['FN'] == ROW['P']).all()
+        NEG = S.to_numpy()[None, :] < C['threshold'].to_numpy()[:, None]
+        assert (C['TN'] == (NEG & (Y.to_numpy() == 0)).sum(axis=1)).all()
+    BEST = best_threshold(CURVE, metric='F1')
+    assert len(BEST) == len(SCORE)
+    for _, ROW in BEST.iterrows():
+        C = CURVE[(CURVE[SWEEP] == ROW[SWEEP]).all(axis=1)]
+        assert ROW['F1'] == C['F1'].max()
+
+# ----------------------------------------------------- #
+# run.csv of several experiments                        #
+# ----------------------------------------------------- #
+@pytest.mark.parametrize('FORMAT', ['csv', 'parquet'])
+def test_build_RUNS(DATA_DIR, FORMAT):
+    for k, NAME in enumerate(['exp-b', 'exp-a']):
+        make_RUNCSV(f"{DATA_DIR}/results/{NAME}/run.csv", n_runs=4, seed=k)
+    posthoc = IMAGEN_posthoc(DATA_DIR, FORMAT)
+    PATH = f"{DATA_DIR}/results/exp-*/run.csv"
+    DF = posthoc.build_RUNS(PATH, save=True)
+    pd.testing.assert_frame_equal(posthoc.build_RUNS(PATH, n_jobs=2), DF)
+    assert list(DF['experiment'].cat.categories) == ['exp-a', 'exp-b']
+    # the saved partitions read back, the outcome views derived
+    for READ in [posthoc.get_RUN, posthoc.read_RUN]:
+        SAVED = READ('all_RUN')
+        pd.testing.assert_frame_equal(OBJECT(SAVED), OBJECT(DF),
+                                      check_dtype=False)
+        COLS = ['experiment', 'ID', 'Prob', 'T prob']
+        EXPECT = derive(DF.copy(), ['T prob'])[COLS]
+        pd.testing.assert_frame_equal(OBJECT(READ('all_RUN', COLS)),
+                                      OBJECT(EXPECT), check_dtype=False)
+
+def test_build_RUNS_star(DATA_DIR):
+    for k, NAME in enumerate(['exp-b', 'exp-a']):
+        make_RUNCSV(f"{DATA_DIR}/results/{NAME}/run.csv", n_runs=4, seed=k)
+    posthoc = IMAGEN_posthoc(DATA_DIR, 'parquet')
+    PATH = f"{DATA_DIR}/results/exp-*/run.csv"
+    DF = posthoc.build_RUNS(PATH)
+    RUNS, PRED = posthoc.build_RUNS(PATH, save=True, star=True)
+    # run_id per experiment, the experiment column once in the join
+    assert RUNS['run_id'].tolist() == [0, 1, 2, 3] * 2
+    WIDE = join_RUN(RUNS, PRED)
+    assert isinstance(WIDE['experiment'], pd.Series)
+    pd.testing.assert_frame_equal(OBJECT(WIDE), OBJECT(DF), check_dtype=False)
+    R = posthoc.get_RUN('all_RUN_runs')
+    P = posthoc.get_RUN('all_RUN_predictions')
+    pd.testing.assert_frame_equal(
+        OBJECT(join_RUN(R, P, ['Session', 'Model'])),
+        OBJECT(DF[['experiment', 'Session', 'Model', *PRED.columns[2:], *VIEWS]]),
+        check_dtype=False)
+
+def test_build_RUNS_replace(DATA_DIR):
+    for k, NAME in enumerate(['exp-a', 'exp-b', 'exp-c']):
+        make_RUNCSV(f"{DATA_DIR}/results/{NAME}/run.csv", n_runs=4, seed=k)
+    posthoc = IMAGEN_posthoc(DATA_DIR, 'parquet')
+    posthoc.build_RUNS(f"{DATA_DIR}/results/exp-[ab]/run.csv", save=True)
+    posthoc.build_RUNS(f"{DATA_DIR}/results/exp-[ab]/run.csv", save=True, star=True)
+    # a later build with other experiments replaces the saved datasets
+    DF = posthoc.build_RUNS(f"{DATA_DIR}/results/exp-[bc]/run.csv", save=True)
+    RUNS, PRED = posthoc.build_RUNS(f"{DATA_DIR}/results/exp-[bc]/run.csv",
+                                    save=True, star=True)
+    assert sorted(posthoc.get_RUN('all_RUN')['experiment'].unique()) == \
+        ['exp-b', 'exp-c']
+    pd.testing.assert_frame_equal(OBJECT(posthoc.get_RUN('all_RUN')), OBJECT(DF),
+                                  check_dtype=False)
+    WIDE = join_RUN(posthoc.get_RUN('all_RUN_runs'),
+                    posthoc.get_RUN('all_RUN_predictions'))
+    pd.testing.assert_frame_equal(OBJECT(WIDE), OBJECT(DF), check_dtype=False)
+    assert not glob(f"{DATA_DIR}/posthoc/*.build")
+
+def test_build_RUNS_names(DATA_DIR):
+    for NAME in ['a_b/c', 'a/b_c']:
+        make_RUNCSV(f"{DATA_DIR}/results/{NAME}/run.csv", n_runs=2)
+    with pytest.raises(ValueError, match="same experiment name a_b_c"):
+        IMAGEN_posthoc(DATA_DIR).build_RUNS(f"{DATA_DIR}/results/a*", save=True)
+    assert not os.path.exists(f"{DATA_DIR}/posthoc/all_RUN")
@@ -0,0 +1,53 @@
+#################################################################################
+#!/usr/bin/env python
+# coding: utf-8
+""" Storage: csv, parquet and feather tables and the partitioned datasets """
+# Author: JiHoon Kim, <jihoon.kim@fu-berlin.de>, 15th November 2021
+#
+import numpy as np
+import pandas as pd
+import pytest
+from imagen_posthocloader import *
+from imagen_subjectkey import to_SESSION
+
+def TABLE():
+    """ One column per dtype of the posthoc files """
+    return pd.DataFrame({
+        'ID' : np.array([3, 1, 2, 4], dtype=np.int64),
+        'Session' : to_SESSION(['BL', 'FU1', 'FU3', 'BL']),
+        'Prob' : pd.Categorical(['TP', 'TN', np.NaN, 'TP'],
+                                categories=['TN', 'FN', 'FP', 'TP']),
+        'score' : np.array([1.5, np.NaN, 3, 4], dtype=np.float32),
+        'flag' : [True, False, True, True],
+        'name' : ['a', None, 'c', 'd'],
+        # numbers and labels, e.g. PBQ age
+        'age' : np.array([14.0, 'not known', np.NaN, 16], dtype=object),
+    })
+
+@pytest.mark.parametrize('FORMAT', ['parquet', 'feather'])
+def test_TABLE_round_trip(tmp_path, FORMAT):
+    DF = TABLE()
+    path = write_TABLE(DF, f"{tmp_path}/posthoc/all_X.csv", FORMAT)
+    assert path.endswith(EXT[FORMAT])
+    pd.testing.assert_frame_equal(read_TABLE(path), DF)
+    assert read_COLUMNS(path) == list(DF.columns)
+    # projection, the split column is joined back
+    pd.testing.assert_frame_equal(read_TABLE(path, ['age', 'ID']),
+                                  DF[['age', 'ID']])
+    pd.testing.assert_frame_equal(read_TABLE(path, ['ID']), DF[['ID']])
+    assert list(DF.columns) == list(TABLE().columns)
+
+def test_TABLE_csv(tmp_path):
+    DF = TABLE().drop(columns='age')
+    path = write_TABLE(DF, f"{tmp_path}/posthoc/all_X.parquet", 'csv')
+    assert path.endswith('.csv')
+    assert list(read_TABLE(path, ['score', 'ID']).columns) == ['score', 'ID']
+    assert read_TABLE(path)['ID'].tolist() == DF['ID'].tolist()
+
+@pytest.mark.parametrize('FORMAT', ['parquet', 'feather'])
+def test_INSTRUMENT_round_trip(DATA_DIR, FORMAT):
+    PBQ = INSTRUMENT_loader(DATA_DIR, FORMAT).set_INSTRUMENT('PBQ', save=True)
+    assert (PBQ['pbq_03b'].map(type) == str).any()
+    SAVED = INSTRUMENT_loader(DATA_DIR, FORMAT).get_INSTRUMENT(
+        f'all_PBQ{EXT[FORMAT]}')
+    pd.testing.assert_frame_equal(SAVED, PBQ)
@@ -0,0 +1,32 @@
+#################################################################################
+#!/usr/bin/env python
+# coding: utf-8
+""" Subject key: ID parsing, exclusion and (ID, Session) ordering """
+# Author: JiHoon Kim, <jihoon.kim@fu-berlin.de>, 15th November 2021
+#
+import numpy as np
+import pandas as pd
+from imagen_subjectkey import *
+
+def test_to_ID():
+    CODE = pd.Series(['000012809392-C', '000071766352-C', '000000000007-I'])
+    assert to_ID(CODE).tolist() == [int(i[:12]) for i in CODE]
+    assert to_ID(CODE).dtype == np.int64
+    assert to_ID(pd.Series([12809392, 7])).tolist() == [12809392, 7]
+
+def test_to_SESSION():
+    SESSION = to_SESSION(pd.Series(['FU3', 'BL', 'FU1', 'FU2']))
+    assert SESSION.ordered and list(SESSION.categories) == SESSIONS
+    assert sorted(SESSION) == ['BL', 'FU1', 'FU2', 'FU3']
+
+def test_exclude_and_sort():
+    DF = pd.DataFrame({'ID': [2, 1, 2, 1, 3], 'x': range(5),
+                       'Session': ['FU1', 'FU3', 'BL', 'BL', 'FU1']})
+    OUT = sort_KEY(exclude(DF, [(2, 'FU1'), (3, 'BL')]))
+    assert list(zip(OUT['ID'], OUT['Session'])) == \
+        [(1, 'BL'), (1, 'FU3'), (2, 'BL'), (3, 'FU1')]
+    assert OUT.index.tolist() == [0, 1, 2, 3]
+    assert exclude(DF, []) is DF
+    KEY = set_KEY(DF)
+    assert KEY.index.names == ['ID', 'Session']
+    assert KEY.index.is_monotonic_increasing